@@ -0,0 +1,114 @@
+import asyncio
+import time
+import sys
+import os
+
+# 动态获取当前脚本所在目录，并根据相对路径设置sys.path
+def load_sys_path():
+    """动态查找项目根目录并将 modules 和 jobs/sync 目录添加到 sys.path"""
+    project_root_name = 'Python'
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+
+    while True:
+        if os.path.basename(current_dir) == project_root_name:
+            project_root = current_dir
+            break
+        new_dir = os.path.dirname(current_dir)
+        if new_dir == current_dir:
+            raise RuntimeError(f"无法找到包含目录 '{project_root_name}' 的项目根目录")
+        current_dir = new_dir
+
+    # 需要添加的路径列表
+    paths_to_add = [
+        os.path.join(project_root, 'auto_scripts', 'modules'),
+        os.path.join(project_root, 'auto_scripts', 'jobs', 'sync')
+    ]
+
+    # 添加路径并确保唯一性
+    for path in paths_to_add:
+        if path not in sys.path:
+            sys.path.append(path)
+
+# 调用函数加载配置
+load_sys_path()
+from log_tools import setup_logger
+# 直接使用同步任务的写入函数, 保证对比的是实际运行的代码路径
+from daily_database_sync import db_manager, write_rows
+
+# 获取logger
+logger = setup_logger(__file__)
+
+# 基准测试配置
+benchmark_table = 'orderitems'  # 个人数据库中作为样本数据来源的表
+benchmark_rows = 100000  # 样本行数
+benchmark_batch_size = 10000  # 每个批次的行数, 与同步任务保持一致
+benchmark_writers = ['executemany', 'multi_row', 'load_data']
+
+# 读取样本数据
+async def load_sample_rows():
+    """
+    从个人数据库读取最新的样本数据
+    :return: 样本数据, 格式与同步任务的row_format相同
+    """
+    async with db_manager.connection('myDB_Alicloud') as conn:
+        return await db_manager.fetch_all(conn, f"SELECT * FROM {benchmark_table} ORDER BY `id` DESC LIMIT %s", (benchmark_rows,))
+
+# 按批次写入并计时
+async def timed_write(scratch_table, rows, writer, upsert):
+    """
+    按批次把样本数据写入临时基准表, 返回耗时
+    :param scratch_table: 临时基准表名
+    :param rows: 样本数据
+    :param writer: 写入方式
+    :param upsert: 是否按id插入或更新
+    :return: 写入耗时(秒)
+    """
+    start_time = time.time()
+    for i in range(0, len(rows), benchmark_batch_size):
+        async with db_manager.connection('myDB_Alicloud') as conn:
+            await write_rows(conn, scratch_table, rows[i:i + benchmark_batch_size], writer, upsert=upsert)
+    return time.time() - start_time
+
+# 主函数
+async def main():
+    start_time = time.time()
+    scratch_table = f"{benchmark_table}_benchmark"
+    results = []
+    try:
+        rows = await load_sample_rows()
+        if not rows:
+            logger.info(f"{benchmark_table} 没有样本数据, 跳过基准测试")
+            return
+        logger.info(f"已读取 {benchmark_table} 样本数据 {len(rows)} 行, 批次大小 {benchmark_batch_size}")
+
+        for writer in benchmark_writers:
+            # 每种写入方式使用结构相同的空表, 先测插入, 再对相同数据测插入或更新(全部命中已存在的id)
+            async with db_manager.connection('myDB_Alicloud') as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(f"DROP TABLE IF EXISTS {scratch_table}")
+                    await cursor.execute(f"CREATE TABLE {scratch_table} LIKE {benchmark_table}")
+            try:
+                insert_time = await timed_write(scratch_table, rows, writer, upsert=False)
+                upsert_time = await timed_write(scratch_table, rows, writer, upsert=True)
+            except Exception as e:
+                logger.error(f"写入方式 {writer} 基准测试失败: {e}")
+                continue
+            results.append((writer, insert_time, upsert_time))
+            logger.info(f"写入方式 {writer}: 插入耗时 {insert_time:.2f} 秒 ({len(rows) / max(insert_time, 1e-6):.0f} 行/秒), "
+                        f"插入或更新耗时 {upsert_time:.2f} 秒 ({len(rows) / max(upsert_time, 1e-6):.0f} 行/秒)")
+
+        if len(results) > 1:
+            base_writer, base_insert, base_upsert = results[0]
+            for writer, insert_time, upsert_time in results[1:]:
+                logger.info(f"{writer} 相比 {base_writer}: 插入加速 {base_insert / max(insert_time, 1e-6):.2f} 倍, "
+                            f"插入或更新加速 {base_upsert / max(upsert_time, 1e-6):.2f} 倍")
+    finally:
+        async with db_manager.connection('myDB_Alicloud') as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DROP TABLE IF EXISTS {scratch_table}")
+        await db_manager.close_all()
+        logger.info(f"基准测试总时长: {time.time() - start_time:.2f} 秒")
+
+# 运行主函数
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+import asyncio
+import time
+import sys
+import os
+import yaml
+
+# 动态获取当前脚本所在目录，并根据相对路径设置sys.path
+def load_sys_path():
+    """动态查找项目根目录并将 modules 和 jobs/sync 目录添加到 sys.path"""
+    project_root_name = 'Python'
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+
+    while True:
+        if os.path.basename(current_dir) == project_root_name:
+            project_root = current_dir
+            break
+        new_dir = os.path.dirname(current_dir)
+        if new_dir == current_dir:
+            raise RuntimeError(f"无法找到包含目录 '{project_root_name}' 的项目根目录")
+        current_dir = new_dir
+
+    # 需要添加的路径列表
+    paths_to_add = [
+        os.path.join(project_root, 'auto_scripts', 'modules'),
+        os.path.join(project_root, 'auto_scripts', 'jobs', 'sync')
+    ]
+
+    # 添加路径并确保唯一性
+    for path in paths_to_add:
+        if path not in sys.path:
+            sys.path.append(path)
+    return project_root
+
+# 调用函数加载配置
+project_root = load_sys_path()
+from aiomysql.cursors import RE_INSERT_VALUES
+from log_tools import setup_logger
+from insert_builder import MultiRowInsert, fetch_max_allowed_packet
+# 直接使用同步任务的写入函数, 保证验证的是实际运行的代码路径
+from daily_database_sync import db_manager, write_rows
+
+# 获取logger
+logger = setup_logger(__file__)
+
+# 基准测试配置
+benchmark_rows = 5000  # 每张表的样本行数
+benchmark_writers = ['executemany', 'multi_row']
+
+# 读取同步配置中的所有表
+def load_tables():
+    """
+    读取daily_database_query.yaml中的所有表名
+    :return: 表名列表
+    """
+    config_path = os.path.join(project_root, 'auto_scripts', 'sql', 'config', 'daily_database_query.yaml')
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return list(yaml.safe_load(f)['daily_database_query'].keys())
+
+# 读取连接上已执行的INSERT语句数
+async def count_insert_statements(conn):
+    """
+    读取当前连接的Com_insert会话状态, 每条INSERT语句(无论包含多少行)计数1次
+    :param conn: MySQL连接
+    :return: INSERT语句数
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute("SHOW SESSION STATUS LIKE 'Com_insert'")
+        row = await cursor.fetchone()
+    return int(row['Value'] if isinstance(row, dict) else row[1])
+
+# 按写入方式写入样本并统计语句数
+async def measure_writer(scratch_table, rows, writer):
+    """
+    在同一个连接上写入样本数据, 统计服务端执行的INSERT语句数和耗时
+    :param scratch_table: 临时基准表名
+    :param rows: 样本数据(RowBatch)
+    :param writer: 写入方式
+    :return: (INSERT语句数, 耗时秒数)
+    """
+    async with db_manager.connection('myDB_Alicloud') as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"TRUNCATE TABLE {scratch_table}")
+        before = await count_insert_statements(conn)
+        start_time = time.time()
+        await write_rows(conn, scratch_table, rows, writer)
+        elapsed = time.time() - start_time
+        statements = await count_insert_statements(conn) - before
+    return statements, elapsed
+
+# 验证单张表
+async def verify_table(table_name):
+    """
+    对比executemany与multi_row在该表上的语句数和耗时
+    :param table_name: 表名
+    :return: multi_row执行的INSERT语句数是否与按max_allowed_packet拆分的语句数一致
+    """
+    async with db_manager.connection('myDB_Alicloud') as conn:
+        rows = await db_manager.fetch_all(
+            conn, f"SELECT * FROM {table_name} ORDER BY `id` DESC LIMIT %s", (benchmark_rows,), row_format='tuple')
+    if len(rows) < 2:
+        logger.info(f"{table_name} 样本数据不足 2 行, 跳过")
+        return True
+
+    # executemany方式使用的语句能否被aiomysql改写为多行语句
+    legacy_query = f"""
+        INSERT INTO {table_name} ({', '.join(rows.columns)})
+        VALUES ({', '.join(['%s'] * len(rows.columns))})
+        """
+    legacy_rewritten = RE_INSERT_VALUES.match(legacy_query) is not None
+
+    scratch_table = f"{table_name}_insert_benchmark"
+    results = {}
+    try:
+        async with db_manager.connection('myDB_Alicloud') as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DROP TABLE IF EXISTS {scratch_table}")
+                await cursor.execute(f"CREATE TABLE {scratch_table} LIKE {table_name}")
+        for writer in benchmark_writers:
+            results[writer] = await measure_writer(scratch_table, rows, writer)
+        # 样本按max_allowed_packet拆分后应有的语句数, 转义使用同一环境的连接
+        async with db_manager.connection('myDB_Alicloud') as conn:
+            max_packet = await fetch_max_allowed_packet(conn)
+            expected_statements = sum(
+                1 for _ in MultiRowInsert(scratch_table, rows.columns).statements(conn.escape, rows.rows, max_packet))
+    finally:
+        async with db_manager.connection('myDB_Alicloud') as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DROP TABLE IF EXISTS {scratch_table}")
+
+    details = ', '.join(
+        f"{writer}: {statements} 条语句, {elapsed:.2f} 秒 ({len(rows) / max(elapsed, 1e-6):.0f} 行/秒)"
+        for writer, (statements, elapsed) in results.items())
+    multi_row_statements = results['multi_row'][0]
+    passed = multi_row_statements == expected_statements
+    log = logger.info if passed else logger.error
+    log(f"{table_name} ({len(rows.columns)} 列, {len(rows)} 行): aiomysql改写executemany语句: {'是' if legacy_rewritten else '否'}, "
+        f"{details}, multi_row预期 {expected_statements} 条语句, 实际 {multi_row_statements} 条, {'一致' if passed else '不一致'}")
+    return passed
+
+# 主函数
+async def main():
+    start_time = time.time()
+    failed_tables = []
+    try:
+        for table_name in load_tables():
+            try:
+                if not await verify_table(table_name):
+                    failed_tables.append(table_name)
+            except Exception as e:
+                logger.error(f"{table_name} 验证失败: {e}")
+                failed_tables.append(table_name)
+    finally:
+        await db_manager.close_all()
+        logger.info(f"基准测试总时长: {time.time() - start_time:.2f} 秒")
+    if failed_tables:
+        logger.error(f"以下表的多行INSERT验证未通过: {', '.join(failed_tables)}")
+        sys.exit(1)
+    logger.info("所有表的multi_row写入都按max_allowed_packet拆分为预期数量的多行INSERT语句")
+
+# 运行主函数
+if __name__ == "__main__":
+    asyncio.run(main())
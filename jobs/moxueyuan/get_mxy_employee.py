@@ -43,6 +43,7 @@ load_sys_path()
 
 from modules.db_conn import DBManager
 from modules.log_tools import setup_logger
+from modules.batch_sizer import BatchSizerStore
 
 # 获取logger - 使用规则要求的日志格式
 logger = setup_logger(__file__)
@@ -55,6 +56,9 @@ for handler in logger.handlers:
         new_formatter = logging.Formatter('[%(asctime)s] [employee] [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
         handler.setFormatter(new_formatter)
 
+# 写入数据库的批次大小: 按估算字节数和实际吞吐量自适应调整, 学习到的行数供下次运行使用
+batch_sizers = BatchSizerStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'state', 'get_mxy_employee_batch_sizes.json'))
+
 # 考试数据字段定义
 EXAM_COLUMNS = ['examId', 'userid', 'reexam', 'userName', 'makeUp', 
                 'stateValue', 'state', 'examName', 'gradetime']
@@ -256,19 +260,21 @@ async def save_to_database(db_manager: DBManager, df: pd.DataFrame, table_name:
                 await cursor.execute(f"TRUNCATE TABLE `{table_name}`")
                 logger.info(f"已清空表 {table_name}")
                 
-                # 分批插入数据
-                batch_size = 10000
-                for i in range(0, len(df), batch_size):
-                    batch = df.iloc[i:i + batch_size]
-                    values = batch.values.tolist()
-                    columns = batch.columns.tolist()
-                    placeholders = ', '.join(['%s'] * len(columns))
-                    
-                    sql = f"INSERT INTO `{table_name}` ({', '.join(columns)}) VALUES ({placeholders})"
+                # 分批插入数据, 批次大小按字节预算和吞吐量自适应
+                columns = df.columns.tolist()
+                placeholders = ', '.join(['%s'] * len(columns))
+                sql = f"INSERT INTO `{table_name}` ({', '.join(columns)}) VALUES ({placeholders})"
+                rows = df.values.tolist()
+                sizer = batch_sizers.get(table_name)
+                inserted = 0
+                for values in sizer.iter_batches(rows):
+                    batch_start_time = time.time()
                     await cursor.executemany(sql, values)
                     await conn.commit()
+                    sizer.record(len(values), time.time() - batch_start_time)
+                    inserted += len(values)
                     
-                    logger.info(f"已插入 {min(i + batch_size, len(df))}/{len(df)} 条记录到表 {table_name}")
+                    logger.info(f"已插入 {inserted}/{len(df)} 条记录到表 {table_name}")
         finally:
             await db_manager.release_connection('myDB_Alicloud', conn)
     except Exception as e:
@@ -280,6 +286,7 @@ async def process_and_save_data():
     try:
         logger.info(f"开始执行数据获取任务")
         db_manager = DBManager(logger=logger)
+        batch_sizers.load()
         
         # 加载配置
         exam_config, course_config = load_config_from_env()
@@ -340,6 +347,10 @@ async def process_and_save_data():
     except Exception as e:
         logger.error(f"处理数据时发生错误: {str(e)}")
     finally:
+        try:
+            batch_sizers.save()
+        except OSError as e:
+            logger.error(f"保存批次大小失败: {str(e)}")
         await db_manager.close_all()
 
 if __name__ == "__main__":
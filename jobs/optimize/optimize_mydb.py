@@ -37,6 +37,7 @@ def load_sys_path():
 load_sys_path()
 from modules.db_conn import DBManager
 from modules.log_tools import setup_logger
+from modules.partition_manager import PartitionManager
 
 # 获取logger
 logger = setup_logger(__file__)
@@ -79,12 +80,14 @@ def load_tables_from_yaml(config_subpath='auto_scripts/sql/config/daily_database
 async def optimize_tables():
     """对数据库表执行OPTIMIZE操作
     OPTIMIZE TABLE用于重建表和索引, 可以回收未使用的空间并整理数据文件
+    按createdAt分区的表只重建上次重建后有删除或写入的分区
     """
     tables = load_tables_from_yaml()
     start_time = time.time()
     
     # 创建数据库管理器
     db_manager = DBManager(logger=logger)
+    partition_manager = PartitionManager(db_manager, 'myDB_Alicloud')
     
     try:
         total_tables = len(tables)
@@ -94,6 +97,18 @@ async def optimize_tables():
         for index, table in enumerate(tables, 1):
             table_start_time = time.time()
             try:
+                # 分区表只重建有变化的分区
+                if await partition_manager.get_range_partitions(table):
+                    partitions = await partition_manager.load_pending(table)
+                    if not partitions:
+                        logger.info(f"[{index}/{total_tables}] 分区表 {table} 没有需要重建的分区, 跳过")
+                        continue
+                    logger.info(f"[{index}/{total_tables}] 开始重建分区表 {table} 的分区: {', '.join(partitions)}")
+                    await partition_manager.rebuild_partitions(table, partitions)
+                    logger.info(f"[{index}/{total_tables}] 完成分区表 {table} 的分区重建, 耗时 {time.time() - table_start_time:.2f} 秒")
+                    await asyncio.sleep(3)  # 等待3秒
+                    continue
+
                 # 获取数据库连接
                 conn = await db_manager.get_connection('myDB_Alicloud')
                 try:
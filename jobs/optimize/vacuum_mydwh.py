@@ -77,25 +77,18 @@ async def vacuum_tables():
     
     # 创建数据库管理器
     db_manager = DBManager(logger=logger)
-    pool = None
     
     try:
         total_tables = len(tables_config)
         logger.info(f"准备对 {total_tables} 张表执行VACUUM ANALYZE操作")
         
-        # 获取连接池
-        pool = await db_manager.get_connection('myDWH_Tencent')
-        
         # 遍历每个表, 逐个优化
         for index, (table_name, table_info) in enumerate(tables_config.items(), 1):
             table_start_time = time.time()
+            schema = table_info.get('schema', 'zcwhr_dwh')  # 从配置中获取schema
             try:
-                # 从连接池获取一个连接, 并设置为原始模式（不自动管理事务）
-                async with pool.acquire() as conn:
-                    schema = table_info.get('schema', 'zcwhr_dwh')  # 从配置中获取schema
-                    # 设置search_path
-                    await conn.execute(f'SET search_path TO {schema}')
-                    
+                # 从连接池获取一个连接并设置search_path, 退出时自动归还连接和并发许可
+                async with db_manager.connection('myDWH_Tencent', schema=schema) as conn:
                     logger.info(f"[{index}/{total_tables}] 开始对表 {schema}.{table_name} 执行VACUUM ANALYZE")
                     sql = f'VACUUM ANALYZE "{table_name}";'  # 由于已设置search_path, 这里不需要schema前缀
                     await conn.execute(sql)
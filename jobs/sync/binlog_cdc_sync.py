@@ -0,0 +1,313 @@
+import asyncio
+import aiomysql
+import time
+import sys
+import os
+import warnings
+import yaml
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+
+# 忽略 VALUES 函数的警告
+warnings.filterwarnings('ignore', message='.*VALUES function.*')
+
+# 动态获取当前脚本所在目录，并根据相对路径设置sys.path
+def load_sys_path():
+    """动态查找项目根目录并将 config 目录添加到 sys.path"""
+    project_root_name = 'Python'
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+
+    while True:
+        if os.path.basename(current_dir) == project_root_name:
+            project_root = current_dir
+            break
+        new_dir = os.path.dirname(current_dir)
+        if new_dir == current_dir:
+            raise RuntimeError(f"无法找到包含目录 '{project_root_name}' 的项目根目录")
+        current_dir = new_dir
+
+    # 需要添加的路径列表
+    paths_to_add = [
+        os.path.join(project_root, 'auto_scripts', 'modules')
+    ]
+
+    # 添加路径并确保唯一性
+    for path in paths_to_add:
+        if path not in sys.path:
+            sys.path.append(path)
+
+# 调用函数加载配置
+load_sys_path()
+# 导入数据库连接管理器和日志工具
+from db_conn import DBManager
+from log_tools import setup_logger
+from query_compiler import QueryCompiler
+from insert_builder import MultiRowInsert, fetch_max_allowed_packet
+
+# 获取logger
+logger = setup_logger(__file__)
+
+# -------------------------------------------------------
+# 基于binlog的实时增量同步(CDC)
+# 常驻运行, 读取公司数据库的行格式binlog(binlog_format=ROW), 按微批次把插入/更新/删除同步到个人数据库:
+#   插入/更新: 收集变化行的id, 使用daily_database_query.yaml中同一张表的data_query(相同的列和表达式)按id重新查询后插入或更新
+#   删除: 按id删除; 重新查询不到(已删除或不再满足row_filter)的id同样删除
+# 每个微批次写入成功后在个人数据库的cdc_checkpoints表记录binlog位置, 重启后从该位置继续
+# 按id重新查询使重复应用同一段binlog不会产生错误数据, 因此检查点只需保证"至少一次"
+#
+# 本地测试: 启动开启行格式binlog的MySQL容器, 在database.yaml中增加对应环境后修改cdc_source_env/cdc_target_env
+#   docker run -d --name mysql-cdc -p 3307:3306 -e MYSQL_ROOT_PASSWORD=<密码> mysql:8.0 \
+#     --server-id=1 --log-bin=mysql-bin --binlog-format=ROW --binlog-row-image=FULL
+# -------------------------------------------------------
+
+# CDC配置
+cdc_source_env = 'zcwDB_Alicloud'  # 读取binlog的源库, 账号需要 REPLICATION SLAVE, REPLICATION CLIENT 权限
+cdc_target_env = 'myDB_Alicloud'  # 写入的目标库, 同时保存检查点
+cdc_tables = ['orders', 'orderitems', 'deliveryreceipts']  # 实时同步的表, 必须是daily_database_query.yaml中的大表
+cdc_server_id = 4301  # 作为复制从库时使用的server_id, 不能与其他从库重复
+cdc_job = 'binlog_cdc_sync'  # 检查点表中的任务名
+cdc_batch_rows = 5000  # 每个微批次最多包含的变化行数
+cdc_batch_seconds = 5  # 每个微批次最长的收集时间(秒)
+cdc_idle_seconds = 2  # 没有新事件时的等待时间(秒)
+cdc_fetch_size = 1000  # 按id重新查询时每条查询的id数量
+checkpoint_table = 'cdc_checkpoints'
+
+# 初始化数据库管理器, 按id重新查询的结果使用RowBatch, 行元组直接生成多行INSERT语句
+db_manager = DBManager(logger=logger, max_retry=3, connect_timeout=20, max_concurrent=3, row_format='tuple')
+
+# 目标库的max_allowed_packet, 首次写入时查询一次, 用于拆分多行INSERT语句
+packet_settings = {}
+
+# 查询模板编译器
+query_compiler = QueryCompiler()
+
+# 加载yaml配置中CDC表的查询
+def load_table_configs():
+    """
+    从daily_database_query.yaml读取CDC表的data_query和row_filter
+    :return: {表名: {'data_query_template': ..., 'row_filter': ...}}
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    config_path = os.path.join(project_root, 'sql', 'config', 'daily_database_query.yaml')
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"未找到配置文件: {config_path}")
+    with open(config_path, 'r', encoding='utf-8') as f:
+        configs = yaml.safe_load(f)['daily_database_query']
+
+    table_configs = {}
+    for table in cdc_tables:
+        conf = configs.get(table)
+        if not conf or conf.get('type') != 'large_table':
+            raise ValueError(f"{table} 不是daily_database_query.yaml中的大表, 无法进行CDC同步")
+        table_configs[table] = {
+            'data_query_template': conf['queries']['data_query'],
+            'row_filter': conf.get('row_filter')
+        }
+    return table_configs
+
+# 构建按id重新查询的语句
+def build_id_query(table_config):
+    """
+    把data_query中的{date_conditions}替换为按id查询的条件, 列和表达式与日常同步完全相同
+    row_filter中不能使用@start_date等同步区间参数
+    :param table_config: CDC表配置
+    :return: 编译后的查询, 参数为@cdc_ids(id元组, 由驱动展开为IN列表)
+    """
+    conditions = ["`id` IN @cdc_ids"]
+    if table_config.get('row_filter'):
+        conditions.append(table_config['row_filter'].strip())
+    return query_compiler.compile(table_config['data_query_template'], date_conditions=f"({' AND '.join(conditions)})")
+
+# 检查点: 读取上次写入成功的binlog位置
+async def load_checkpoint():
+    """
+    读取检查点, 不存在时创建检查点表
+    :return: (binlog文件名, 位置), 没有检查点时为(None, None)
+    """
+    async with db_manager.connection(cdc_target_env) as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {checkpoint_table} (
+                `job` VARCHAR(64) NOT NULL COMMENT 'CDC任务',
+                `log_file` VARCHAR(255) NOT NULL COMMENT 'binlog文件名',
+                `log_pos` BIGINT NOT NULL COMMENT 'binlog位置',
+                `updated_at` DATETIME NOT NULL COMMENT '检查点更新时间',
+                PRIMARY KEY (`job`)
+            ) COMMENT='binlog同步检查点'
+            """)
+            await cursor.execute(f"SELECT `log_file`, `log_pos` FROM {checkpoint_table} WHERE `job` = %s", (cdc_job,))
+            row = await cursor.fetchone()
+    return (row['log_file'], row['log_pos']) if row else (None, None)
+
+# 检查点: 记录写入成功的binlog位置
+async def save_checkpoint(log_file, log_pos):
+    """
+    记录检查点
+    :param log_file: binlog文件名
+    :param log_pos: binlog位置
+    """
+    async with db_manager.connection(cdc_target_env) as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"""
+            INSERT INTO {checkpoint_table} (`job`, `log_file`, `log_pos`, `updated_at`)
+            VALUES (%s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE `log_file` = VALUES(`log_file`), `log_pos` = VALUES(`log_pos`),
+                `updated_at` = VALUES(`updated_at`)
+            """, (cdc_job, log_file, log_pos))
+
+# 没有检查点时从源库当前的binlog位置开始
+async def fetch_current_position():
+    """
+    获取源库当前的binlog位置, 首次运行前应先完成一次日常全量/增量同步
+    :return: (binlog文件名, 位置)
+    """
+    async with db_manager.connection(cdc_source_env) as conn:
+        async with conn.cursor() as cursor:
+            try:
+                await cursor.execute("SHOW BINARY LOG STATUS")  # MySQL 8.2+
+            except aiomysql.MySQLError:
+                await cursor.execute("SHOW MASTER STATUS")
+            row = await cursor.fetchone()
+    if not row:
+        raise RuntimeError(f"{cdc_source_env} 未开启binlog")
+    return row['File'], row['Position']
+
+# 创建binlog读取器
+def create_stream(log_file, log_pos):
+    """
+    创建binlog读取器, 只读取CDC表的行事件
+    :param log_file: 开始读取的binlog文件名
+    :param log_pos: 开始读取的位置
+    :return: BinLogStreamReader
+    """
+    config = db_manager.configs[cdc_source_env]
+    return BinLogStreamReader(
+        connection_settings={
+            'host': config['host'],
+            'port': config.get('port', 3306),
+            'user': config['user'],
+            'passwd': config['password'],
+            'charset': config.get('charset', 'utf8mb4')
+        },
+        server_id=cdc_server_id,
+        only_schemas=[config.get('default_db', 'mysql')],
+        only_tables=cdc_tables,
+        only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent],
+        resume_stream=True,
+        log_file=log_file,
+        log_pos=log_pos,
+        blocking=False
+    )
+
+# 读取一个微批次的binlog事件(在线程中运行, BinLogStreamReader是同步阻塞的)
+def read_batch(stream):
+    """
+    读取事件直到达到cdc_batch_rows行、cdc_batch_seconds秒或没有新事件
+    :param stream: BinLogStreamReader
+    :return: ({表名: {'upsert': id集合, 'delete': id集合}}, 变化行数, binlog文件名, 位置)
+    """
+    changes = {}
+    row_count = 0
+    start_time = time.time()
+    while row_count < cdc_batch_rows and time.time() - start_time < cdc_batch_seconds:
+        event = stream.fetchone()
+        if event is None:
+            break
+        table_changes = changes.setdefault(event.table, {'upsert': set(), 'delete': set()})
+        for row in event.rows:
+            if isinstance(event, DeleteRowsEvent):
+                row_id = row['values']['id']
+                table_changes['upsert'].discard(row_id)
+                table_changes['delete'].add(row_id)
+            else:
+                values = row['after_values'] if isinstance(event, UpdateRowsEvent) else row['values']
+                row_id = values['id']
+                table_changes['delete'].discard(row_id)
+                table_changes['upsert'].add(row_id)
+            row_count += 1
+    return changes, row_count, stream.log_file, stream.log_pos
+
+# 把一个表的变化写入个人数据库
+async def apply_table_changes(table_name, table_config, upsert_ids, delete_ids):
+    """
+    按id重新查询变化的行并插入或更新, 删除已删除或不再满足row_filter的行
+    :param table_name: 表名
+    :param table_config: CDC表配置
+    :param upsert_ids: 插入/更新的id集合
+    :param delete_ids: 删除的id集合
+    :return: (插入或更新的行数, 删除的行数)
+    """
+    compiled = build_id_query(table_config)
+    upsert_ids = sorted(upsert_ids)
+    missing_ids = set(delete_ids)
+    upserted_rows = 0
+    deleted_rows = 0
+
+    for i in range(0, len(upsert_ids), cdc_fetch_size):
+        batch_ids = upsert_ids[i:i + cdc_fetch_size]
+        async with db_manager.connection(cdc_source_env) as conn:
+            data = await db_manager.fetch_all(conn, compiled.bind_sql, compiled.bind({'cdc_ids': tuple(batch_ids)}))
+        id_index = data.column_index('id') if data.columns else 0
+        missing_ids.update(set(batch_ids) - {row[id_index] for row in data.rows})
+        if not data:
+            continue
+        async with db_manager.connection(cdc_target_env) as conn:
+            if 'max_allowed_packet' not in packet_settings:
+                packet_settings['max_allowed_packet'] = await fetch_max_allowed_packet(conn)
+            statement = MultiRowInsert(table_name, data.columns, [col for col in data.columns if col != 'id'])
+            async with conn.cursor() as cursor:
+                for insert_query, _ in statement.statements(conn.escape, data.rows, packet_settings['max_allowed_packet']):
+                    await cursor.execute(insert_query)
+        upserted_rows += len(data)
+
+    missing_ids = sorted(missing_ids)
+    for i in range(0, len(missing_ids), cdc_fetch_size):
+        batch_ids = missing_ids[i:i + cdc_fetch_size]
+        async with db_manager.connection(cdc_target_env) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DELETE FROM {table_name} WHERE `id` IN %s", (tuple(batch_ids),))
+                deleted_rows += cursor.rowcount
+    return upserted_rows, deleted_rows
+
+# 主函数
+async def main():
+    table_configs = load_table_configs()
+    await db_manager.warm_up([cdc_source_env, cdc_target_env])
+
+    log_file, log_pos = await load_checkpoint()
+    if log_file is None:
+        log_file, log_pos = await fetch_current_position()
+        await save_checkpoint(log_file, log_pos)
+        logger.info(f"没有检查点, 从源库当前位置开始: {log_file}:{log_pos}")
+    else:
+        logger.info(f"从检查点继续: {log_file}:{log_pos}")
+
+    stream = create_stream(log_file, log_pos)
+    try:
+        while True:
+            changes, row_count, next_file, next_pos = await asyncio.to_thread(read_batch, stream)
+            if not row_count:
+                if next_file and (next_file, next_pos) != (log_file, log_pos):
+                    # 只读到其他表的事件, 同样推进检查点
+                    log_file, log_pos = next_file, next_pos
+                    await save_checkpoint(log_file, log_pos)
+                await asyncio.sleep(cdc_idle_seconds)
+                continue
+
+            batch_start_time = time.time()
+            for table_name, table_changes in changes.items():
+                upserted_rows, deleted_rows = await apply_table_changes(
+                    table_name, table_configs[table_name], table_changes['upsert'], table_changes['delete'])
+                logger.info(f"{table_name} 插入或更新 {upserted_rows} 行, 删除 {deleted_rows} 行")
+
+            # 所有表写入成功后才推进检查点, 写入失败时进程退出, 重启后从上一个检查点重新应用
+            log_file, log_pos = next_file, next_pos
+            await save_checkpoint(log_file, log_pos)
+            logger.info(f"微批次完成, 变化行数: {row_count}, 耗时: {time.time() - batch_start_time:.2f}秒, "
+                        f"检查点: {log_file}:{log_pos}")
+    finally:
+        stream.close()
+        await db_manager.close_all()
+
+if __name__ == "__main__":
+    asyncio.run(main())
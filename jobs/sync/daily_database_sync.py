@@ -1,11 +1,17 @@
 import asyncio
 import aiomysql
+import argparse
 import time
 from datetime import datetime, timedelta
 import sys
 import os
 import warnings
 import functools
+import contextlib
+import re
+import math
+import multiprocessing
+import concurrent.futures
 import logging
 from typing import TypeVar, Callable, Any, Coroutine
 import yaml
@@ -41,8 +47,20 @@ def load_sys_path():
 # 调用函数加载配置
 load_sys_path()
 # 导入数据库连接管理器和日志工具
-from db_conn import DBManager
+from db_conn import DBManager, RowBatch
 from log_tools import setup_logger
+from query_compiler import QueryCompiler
+from bulk_loader import BulkLoader
+from adaptive_limiter import AdaptiveLimiter, is_congestion_error
+from watermark_store import WatermarkStore
+from range_deleter import RangeDeleter, merge_date_ranges
+from staging_merger import StagingMerger
+from deletion_detector import DeletionDetector
+from partition_manager import PartitionManager
+from run_checkpoint import RunCheckpoint, RelayCheckpoint
+from sync_planner import SyncHistory, lpt_schedule
+from batch_sizer import BatchSizerStore
+from insert_builder import MultiRowInsert, fetch_max_allowed_packet
 
 # 获取logger
 logger = setup_logger(__file__)
@@ -56,14 +74,198 @@ days_interval = 1 # 表示日期始位置; 所以相比days_offset要多往前
 # @filter_date = CURRENT_DATE - days_updated, 默认值45
 days_updated = 45 # 与days_interval的作用相同, 表示日期始位置, 只是在queries_large_table中筛选特定日期区间以减少数据查询量
 
+# 水位线配置: 开启后大表和小表的@start_date使用个人数据库sync_watermarks表中上次同步成功的@end_date,
+# 漏跑的日期在下次运行时一并同步; 没有水位线的表仍使用 CURRENT_DATE - days_interval
+use_watermark = True
+watermark_job = 'daily_database_sync'
+
 # 查询超时配置 (单位: 秒)
 # 正常情况下查询20秒内完成, 45秒已是2倍+缓冲时间
 # 如果超时通常意味着查询卡住了, 应该快速失败并重试, 而不是等待更长时间
 # 设置60秒: 比45秒稍宽松但避免长时间卡住
 large_table_query_timeout = 60  # 大表日期查询超时时间, 快速失败策略
 
+# 大表流式同步配置
+# 开启后使用无缓冲的服务端游标按固定行数分块读取, 每个分块直接插入个人数据库, 内存占用只与分块大小相关
+stream_large_table = True
+stream_chunk_size = 10000  # 每次从服务端游标读取并插入的行数
+# 流水线配置: 读取任务把分块放入有界队列, 多个写入任务并行消费, 读取与写入同时进行
+pipeline_queue_size = 4  # 队列中最多缓存的分块数, 写入落后时读取会阻塞等待(背压)
+# 背压等待期间服务端游标仍然打开, 公司数据库在net_write_timeout内发不出数据时会中断查询, 该日期只能整日重新同步;
+# 读取连接的net_write_timeout设为stream_net_write_timeout, 写入消化满队列(pipeline_queue_size个分块)的耗时必须保持在该值以内
+# 背压等待不计入source_limiter的延迟样本
+stream_net_write_timeout = 600
+pipeline_writers = 5  # 每张表的写入任务数, 实际同时写入的数量由target_limiter控制
+pipeline_redo_rounds = 2  # 同步中途失败的日期最多重新同步的轮数
+
+# 同步数据的结果格式
+# tuple: 结果集为RowBatch(列名一份+行元组), 行元组直接传给executemany/LOAD DATA, 不为每行构建字典
+# dict: 结果集为字典列表, 写入时再转换为元组
+row_format = 'tuple'
+
 # 初始化数据库管理器
-db_manager = DBManager(logger=logger, max_retry=3, connect_timeout=20, max_concurrent=5)
+db_manager = DBManager(logger=logger, max_retry=3, connect_timeout=20, max_concurrent=5, row_format=row_format)
+
+# 并发配置
+# 同时处理的表数量, 表内读取和写入的实际并发由下面的自适应并发控制器决定
+table_concurrency = 3
+# 公司数据库读取与个人数据库写入分别控制: 分块延迟正常时逐步增加并发, 超时/锁等待/延迟超标时并发减半
+# 最大并发不超过DBManager的max_concurrent, 运行结束时在日志中输出各自最终的并发上限
+source_limiter = AdaptiveLimiter('公司数据库读取', initial=2, maximum=db_manager.max_concurrent, target_latency=15)
+target_limiter = AdaptiveLimiter('个人数据库写入', initial=2, maximum=db_manager.max_concurrent, target_latency=10)
+
+# 大表重新同步前的删除: 连续日期合并为区间, 按宽度为delete_chunk_rows的主键窗口逐段删除并提交, 与写入共享target_limiter
+# 删除与读取同时进行, 删除完成后才开始写入
+delete_chunk_rows = 5000
+range_deleter = RangeDeleter(db_manager, 'myDB_Alicloud', chunk_rows=delete_chunk_rows, limiter=target_limiter)
+
+# 大表按日期重新同步的方式, 可在yaml中按表配置resync_strategy覆盖
+# staging: 读取的数据先写入暂存表{table}__staging, 再按日期在一个短事务中删除原数据并 INSERT ... SELECT 暂存表的数据,
+#          读取期间原表数据完整, 读取失败的日期保留原数据(只用于流式同步, 需要在yaml中按表开启)
+# delete: 先按日期区间分段删除原数据, 删除与读取同时进行, 写入完成前个人数据库缺少这些日期的数据(默认)
+default_resync_strategy = 'delete'
+staging_merge_days = 1  # 每个合并事务最多包含的连续日期数, 越小持有锁的时间越短
+staging_merger = StagingMerger(db_manager, 'myDB_Alicloud', limiter=target_limiter, max_days=staging_merge_days)
+
+# 小表的同步方式, 可在yaml中按表配置upsert_strategy覆盖
+# delete_upsert: 先删除个人数据库中updatedAt在同步区间内的行, 再插入或更新同样的行(默认)
+# id_diff: 只插入或更新同步区间内有变化的行, 再按主键顺序归并比较两边的主键, 批量删除源库中已物理删除的行,
+#          每次同步都会读取两边的全部主键, 只在yaml中为会物理删除行的表开启
+default_upsert_strategy = 'delete_upsert'
+deletion_detector = DeletionDetector(db_manager, 'zcwDB_Alicloud', 'myDB_Alicloud', page_rows=50000,
+                                     delete_batch_rows=delete_chunk_rows, source_limiter=source_limiter,
+                                     target_limiter=target_limiter)
+
+# 按createdAt分区的目标表: 变化日期较多的分区在暂存表中整体重新加载后 EXCHANGE PARTITION, 有变化的分区记录到分区维护表
+partition_manager = PartitionManager(db_manager, 'myDB_Alicloud')
+
+# 运行断点: 记录每张表需要同步的日期和已完整写入的日期, 使用 --resume 运行时跳过已完成的表和日期
+run_checkpoint = RunCheckpoint(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'state', 'daily_database_sync.json'))
+
+# 执行计划: 按预计行数和历史耗时估算每张表的耗时, 按耗时从长到短(LPT)安排表的开始顺序
+# 使用 --plan 运行时只输出预计的执行时间线, 不同步数据
+default_rows_per_second = 5000  # 没有历史耗时的表按该速度估算
+sync_history = SyncHistory(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'state', 'daily_database_sync_history.json'))
+table_estimates = {}  # 表名: 计划阶段的预计行数
+
+# 写入个人数据库的批次大小: 按估算字节数(不超过max_allowed_packet)和实际吞吐量自适应调整, 学习到的行数供下次运行使用
+batch_sizers = BatchSizerStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'state', 'daily_database_sync_batch_sizes.json'))
+
+# 多进程分片执行: 使用 --workers N 运行时, 表按预计耗时(LPT)分配到N个worker进程
+# 每个worker进程有独立的事件循环、DBManager连接池和自适应并发控制, 个人数据库的连接数最多约为 N × max_concurrent
+# 运行断点、执行计划历史和批次大小只由主进程保存, worker进程的进度经队列发送给主进程合并
+# 按日期同步的大表预计耗时超过每个进程的平均耗时时, 按连续日期拆分为多个分片分配到不同进程, 全部分片完成后才推进水位线
+shard_min_dates = 5  # 每个分片至少包含的日期数
+
+# 写入个人数据库的方式, 可在yaml中按表配置writer覆盖
+# multi_row: 直接生成多行 INSERT ... VALUES (...),(...) 语句, 按max_allowed_packet拆分(默认)
+# executemany: 参数化INSERT交给aiomysql的executemany, 语句不匹配其改写规则时会退化为每行一次往返, 保留用于对比
+# load_data: 批次序列化为TSV后通过 LOAD DATA LOCAL INFILE 加载, 插入或更新经由临时暂存表, 需要个人数据库开启local_infile
+default_writer = 'multi_row'
+bulk_loader = BulkLoader()
+# 个人数据库的max_allowed_packet, 首次写入时查询一次
+packet_settings = {}
+
+# 全量刷新表的刷新方式, 可在yaml中按表配置refresh_strategy覆盖
+# shadow: 数据写入影子表{table}__new(写入期间去掉普通二级索引), 完成后用 RENAME TABLE 原子切换, 刷新期间原表可正常读取
+# truncate: 先 TRUNCATE 原表再写入, 写入期间原表为空或不完整
+# diff: 按id区间比较源库和个人数据库的校验和, 只重新同步校验和不一致的区间
+default_refresh_strategy = 'shadow'
+diff_fanout = 16  # diff方式每层把不一致的id区间拆分的份数
+diff_leaf_rows = 2000  # diff方式区间行数不超过该值时不再拆分, 直接重新同步区间内的行
+
+# 查询执行方式
+# bind: 查询模板编译为%s参数化查询, 日期/id参数在客户端绑定, 每次查询一次往返, 无需SET用户变量
+# prepare: 每个连接对同一编译结果只PREPARE一次, 之后设置变化的参数变量并通过 EXECUTE ... USING 复用服务端预处理语句
+query_execution_mode = 'bind'
+
+# 查询模板编译器, 编译结果按模板缓存, 同一张表的所有分块共用
+query_compiler = QueryCompiler()
+
+# 同步日期区间参数@start_date/@end_date/@filter_date的具体日期值, 首次使用时由公司数据库计算一次, 整个运行期间保持不变
+session_vars = {}
+
+# 水位线存储和本次运行开始时读取到的各表水位线
+watermark_store = WatermarkStore(db_manager)
+table_watermarks = {}
+
+# 获取表的同步区间参数
+def get_window_params(table_name):
+    """
+    获取表的增量同步区间参数, 有水位线时@start_date从上次同步成功的位置开始
+    :param table_name: 表名
+    :return: 覆盖同步日期区间的参数字典, 没有水位线时为空字典
+    """
+    watermark = table_watermarks.get(table_name, {}).get('last_updated_at')
+    if use_watermark and watermark:
+        return {'start_date': watermark}
+    return {}
+
+# 获取批次数据中的最大id
+def max_row_id(data):
+    """
+    获取批次数据中的最大id
+    :param data: RowBatch或字典列表
+    :return: 最大id, 没有数据或没有id列时为None
+    """
+    if not data:
+        return None
+    if isinstance(data, RowBatch):
+        if 'id' not in data.columns:
+            return None
+        id_index = data.column_index('id')
+        return max(row[id_index] for row in data.rows)
+    return max(row['id'] for row in data) if 'id' in data[0] else None
+
+# 记录表同步成功后的水位线
+async def save_watermark(table_name, max_id=None):
+    """
+    表同步成功后把本次的@end_date记录为水位线, 保存失败只记录日志, 下次运行会重新同步同一区间
+    :param table_name: 表名
+    :param max_id: 本次同步的最大id
+    """
+    if not use_watermark or 'end_date' not in session_vars:
+        return
+    try:
+        await watermark_store.save(watermark_job, table_name, session_vars['end_date'], max_id)
+    except Exception as e:
+        logger.error(f"{table_name} 保存水位线失败: {e}")
+
+# 获取同步日期区间参数
+async def load_session_vars(conn):
+    """
+    获取@start_date/@end_date/@filter_date对应的日期值, 只在首次调用时按数据库的CURRENT_DATE计算一次
+    :param conn: 公司数据库连接
+    :return: {'start_date': 日期, 'end_date': 日期, 'filter_date': 日期}
+    """
+    if not session_vars:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                "SELECT CURRENT_DATE - INTERVAL %s DAY AS start_date, "
+                "CURRENT_DATE - INTERVAL %s DAY AS end_date, "
+                "CURRENT_DATE - INTERVAL %s DAY AS filter_date",
+                (days_interval, days_offset, days_updated)
+            )
+            session_vars.update(await cursor.fetchone())
+    return session_vars
+
+# 编译公司数据库查询模板并绑定参数
+async def build_source_query(conn, template, params=None, **fragments):
+    """
+    编译查询模板, 按query_execution_mode生成可执行的查询语句和参数
+    :param conn: 公司数据库连接
+    :param template: 查询模板, 可包含@start_date等用户变量和{date_conditions}等占位符
+    :param params: 同步日期区间以外的参数, 如分块的日期和id区间
+    :param fragments: 占位符对应的SQL片段
+    :return: (查询语句, 参数), 直接传给cursor.execute或db_manager.stream_query
+    """
+    compiled = query_compiler.compile(template, **fragments)
+    values = {**await load_session_vars(conn), **(params or {})}
+    if query_execution_mode == 'prepare':
+        statement_name = await db_manager.prepare_statement('zcwDB_Alicloud', conn, compiled.prepare_sql)
+        await db_manager.set_session_vars('zcwDB_Alicloud', conn, dict(zip(compiled.param_names, compiled.bind(values))))
+        return compiled.execute_sql(statement_name), None
+    return compiled.bind_sql, compiled.bind(values)
 
 # 获取公司数据库连接(zcwDB_Alicloud)
 async def get_company_connection():
@@ -104,14 +306,12 @@ async def fetch_dates_with_updates(conn, query, table_name):
     try:
         logger.info(f"{table_name} 开始执行Step 1日期查询")
         async with conn.cursor() as cursor:
-            # 使用 days_interval 和 days_offset 设置时间
-            await cursor.execute(f"SET @start_date = CURRENT_DATE - INTERVAL {days_interval} DAY;")
-            await cursor.execute(f"SET @end_date = CURRENT_DATE - INTERVAL {days_offset} DAY;")
-            await cursor.execute(f"SET @filter_date = CURRENT_DATE - INTERVAL {days_updated} DAY;")
+            # 编译查询模板并绑定同步日期区间参数(有水位线时从上次同步成功的位置开始)
+            date_query, args = await build_source_query(conn, query, get_window_params(table_name))
             
             # 执行查询并记录时间
             query_start = time.time()
-            await cursor.execute(query)
+            await cursor.execute(date_query, args)
             dates = await cursor.fetchall()
             query_time = time.time() - query_start
             
@@ -131,71 +331,160 @@ async def fetch_dates_with_updates(conn, query, table_name):
         await db_manager.release_connection('zcwDB_Alicloud', conn)
 
 # sync_large_table_step2: 删除个人数据库中对应createdAt的数据
-async def delete_existing_data(conn, table_name, dates):
+async def delete_existing_data(table_name, dates, checkpoint_key=None):
+    """
+    删除个人数据库中指定createdAt日期的数据: 连续日期合并为区间, 区间内按主键分段删除, 每段单独提交
+    删除失败时抛出异常, 由调用方重试整张表
+    :param table_name: 表名
+    :param dates: 日期列表
+    :param checkpoint_key: 删除完成后在运行断点中记录deleted阶段的名称(表名或分片名称), 为None时不记录
+    :return: (删除的行数, 删除耗时秒数)
+    """
+    total_start_time = time.time()
+    total_deleted_rows = 0
+    for start, end in merge_date_ranges(dates):
+        logger.info(f"开始删除 {table_name} 中 {start} 至 {end} 的数据")
+        start_time = time.time()
+        deleted_rows = await range_deleter.delete_range(table_name, 'createdAt', start, end)
+        elapsed_time = time.time() - start_time
+        logger.info(f"删除 {table_name} 中 {start} 至 {end} 的数据完成, 共删除 {deleted_rows} 行, "
+                    f"耗时 {elapsed_time:.2f} 秒 ({deleted_rows / max(elapsed_time, 1e-6):.0f} 行/秒)")
+        total_deleted_rows += deleted_rows
+    total_elapsed_time = time.time() - total_start_time
+    logger.info(f"{table_name} 删除了 {total_deleted_rows} 行数据, 删除总计耗时 {total_elapsed_time:.2f} 秒 "
+                f"({total_deleted_rows / max(total_elapsed_time, 1e-6):.0f} 行/秒)")
+    if checkpoint_key:
+        run_checkpoint.mark_stage(checkpoint_key, 'deleted')
+    return total_deleted_rows, total_elapsed_time
+
+# 运行断点: 日期的所有分块都已写入时记录该日期
+def checkpoint_date_callback(checkpoint_key):
+    """
+    获取记录已完成日期的回调
+    :param checkpoint_key: 运行断点中的名称(表名或分片名称)
+    :return: 回调函数, 参数为日期
+    """
+    return lambda date: run_checkpoint.mark_dates_done(checkpoint_key, [date])
+
+# 构建大表按createdAt日期查询的筛选条件
+def build_date_conditions(table_config, with_id_range=False):
+    """
+    构建大表按createdAt日期查询的筛选条件, 日期和id区间以参数形式出现, 同一张表的所有分块共用同一个编译结果
+    :param table_config: 大表配置, 包含可选的row_filter(额外的行筛选条件)
+    :param with_id_range: 是否限制主键区间
+    :return: 用于替换data_query中{date_conditions}的条件语句
+    """
+    conditions = ["`createdAt` BETWEEN @chunk_start AND @chunk_end"]
+    if table_config.get('row_filter'):
+        conditions.append(table_config['row_filter'].strip())
+    if with_id_range:
+        conditions.append("`id` BETWEEN @id_lo AND @id_hi")
+    return f"({' AND '.join(conditions)})"
+
+# 构建同步单元的查询参数
+def build_chunk_params(date, id_range=None):
+    """
+    构建同步单元的查询参数
+    :param date: 日期字符串, 格式YYYY-MM-DD
+    :param id_range: 主键区间(lo, hi), 为None时不限制id
+    :return: 与build_date_conditions对应的参数字典
+    """
+    params = {'chunk_start': f"{date} 00:00:00", 'chunk_end': f"{date} 23:59:59"}
+    if id_range:
+        params.update(id_lo=int(id_range[0]), id_hi=int(id_range[1]))
+    return params
+
+# 将id最小值/最大值/行数拆分为若干个行数接近目标值的主键区间
+def split_id_range(min_id, max_id, row_count, target_rows):
+    """
+    按目标行数将[min_id, max_id]均匀拆分为多个主键区间
+    :param min_id: 区间内最小id
+    :param max_id: 区间内最大id
+    :param row_count: 区间内行数
+    :param target_rows: 每个区间的目标行数
+    :return: 主键区间列表[(lo, hi), ...]
+    """
+    chunk_count = max(1, -(-row_count // target_rows))  # 向上取整
+    step = -(-(max_id - min_id + 1) // chunk_count)
+    return [
+        (lo, min(lo + step - 1, max_id))
+        for lo in range(min_id, max_id + 1, step)
+    ]
+
+# sync_large_table_step3(分块规划): 按chunking配置把每个日期拆分为同步单元
+async def plan_sync_units(table_name, dates, table_config):
+    """
+    规划大表的同步单元
+    strategy为date时每个日期一个单元; 为id_range时按目标行数把每个日期拆分为多个主键区间
+    :param table_name: 表名
+    :param dates: 需要同步的日期列表
+    :param table_config: 大表配置, 包含chunking配置
+    :return: 同步单元列表[(日期, 主键区间或None), ...]
+    """
+    chunking = table_config.get('chunking', {})
+    if chunking.get('strategy', 'date') != 'id_range':
+        return [(date, None) for date in dates]
+
+    target_rows = int(chunking.get('target_rows', 50000))
+    stats_template = (
+        f"SELECT MIN(`id`) AS min_id, MAX(`id`) AS max_id, COUNT(*) AS row_count "
+        f"FROM {table_name} WHERE {{date_conditions}}"
+    )
+    units = []
+    conn = await get_company_connection()
     try:
-        total_start_time = time.time()
         async with conn.cursor() as cursor:
-            total_deleted_rows = 0
             for date in dates:
-                date_condition = f"`createdAt` BETWEEN '{date} 00:00:00' AND '{date} 23:59:59'"
-                delete_query = f"DELETE FROM {table_name} WHERE {date_condition}"
-                logger.info(f"开始删除 {table_name} 中日期 {date} 的数据")
-                start_time = time.time()
-                await cursor.execute(delete_query)
-                deleted_rows = cursor.rowcount
-                elapsed_time = time.time() - start_time
-                logger.info(f"删除 {table_name} 中日期 {date} 的数据完成, 共删除 {deleted_rows} 行, 耗时 {elapsed_time:.2f} 秒")
-                total_deleted_rows += deleted_rows
-        total_elapsed_time = time.time() - total_start_time
-        logger.info(f"{table_name} 删除了 {total_deleted_rows} 行数据, 删除总计耗时 {total_elapsed_time:.2f} 秒")
-        return total_deleted_rows
-    except Exception as e:
-        logger.error(f"删除 {table_name} 中的数据时发生错误信息: {e}")
-        return 0
+                stats_query, args = await build_source_query(
+                    conn, stats_template, build_chunk_params(date), date_conditions=build_date_conditions(table_config))
+                await asyncio.wait_for(cursor.execute(stats_query, args), timeout=large_table_query_timeout)
+                row = await cursor.fetchone()
+                if not row or not row['row_count']:
+                    logger.info(f"{table_name} 中日期 {date} 没有数据")
+                    continue
+                id_ranges = split_id_range(row['min_id'], row['max_id'], row['row_count'], target_rows)
+                logger.info(f"{table_name} 日期 {date} 行数: {row['row_count']}, 拆分为 {len(id_ranges)} 个主键区间")
+                units.extend((date, id_range) for id_range in id_ranges)
     finally:
-        await db_manager.release_connection('myDB_Alicloud', conn)
+        await db_manager.release_connection('zcwDB_Alicloud', conn)
+    return units
 
 # sync_large_table_step3: 公司数据库异步获取每个createdAt的数据
-async def fetch_and_collect_data_with_retry_by_date(table_name, date, data_query_template, all_data_by_date, semaphore):
+async def fetch_and_collect_data_with_retry_by_date(table_name, date, table_config, all_data_by_date, semaphore):
     max_retries = 5
     retry_count = 0
     while retry_count <= max_retries:
         conn = None
-        async with semaphore:
+        retry_delay = None
+        async with semaphore, source_limiter.slot() as slot:
             try:
                 logger.info(f"开始获取 {table_name} 中日期 {date} 的数据")
-                if table_name == "deliveryreceiptitems":
-                    date_conditions = f"(`createdAt` BETWEEN '{date} 00:00:00' AND '{date} 23:59:59' AND sort_time BETWEEN @filter_date AND @end_date)"
-                elif table_name == "orders":
-                    date_conditions = f"(`createdAt` BETWEEN '{date} 00:00:00' AND '{date} 23:59:59' AND `status` IN ('CONFIRMED', 'DELIVERED', 'DONE', 'RECEIVED'))"
-                else:
-                    date_conditions = f"(`createdAt` BETWEEN '{date} 00:00:00' AND '{date} 23:59:59')"
-                data_query = data_query_template.format(date_conditions=date_conditions)
                 conn = await get_company_connection()
                 start_time = time.time()
-                async with conn.cursor() as cursor:
-                    await cursor.execute(f"SET @start_date = CURRENT_DATE - INTERVAL {days_interval} DAY;")
-                    await cursor.execute(f"SET @end_date = CURRENT_DATE - INTERVAL {days_offset} DAY;")
-                    await cursor.execute(f"SET @filter_date = CURRENT_DATE - INTERVAL {days_updated} DAY;")
-                    await cursor.execute(data_query)
-                    data = await cursor.fetchall()
-                    row_count = len(data)
+                # 编译查询模板并绑定日期参数
+                data_query, args = await build_source_query(
+                    conn, table_config['data_query_template'], build_chunk_params(date),
+                    date_conditions=build_date_conditions(table_config))
+                data = await db_manager.fetch_all(conn, data_query, args)
+                row_count = len(data)
                 query_time = time.time() - start_time
                 if row_count > 0:
                     logger.info(f"{table_name} 中日期 {date} 获取成功, 行数: {row_count}, 耗时: {query_time:.2f}秒")
                     all_data_by_date[date] = data
                 else:
                     logger.info(f"{table_name} 中日期 {date} 没有数据")
-                return  # 成功后直接返回
+                return True  # 成功后直接返回
             except aiomysql.MySQLError as e:
                 logger.error(f"查询 {table_name} 日期 {date} 时失败, 错误信息: {e}")
+                if is_congestion_error(e):
+                    slot.mark_congested()
                 retry_count += 1
                 if retry_count >= 3:
                     logger.error(f"{table_name} 日期 {date} 错误次数达到 {retry_count} 次, 等待 5 秒后重试")
-                    await asyncio.sleep(5)
+                    retry_delay = 5
                 else:
                     logger.info(f"等待 3 秒后重试 {table_name} 日期 {date}")
-                    await asyncio.sleep(3)
+                    retry_delay = 3
             except Exception as e:
                 logger.error(f"{table_name} 日期 {date} 发生未知错误信息: {e}")
                 import traceback
@@ -204,10 +493,108 @@ async def fetch_and_collect_data_with_retry_by_date(table_name, date, data_query
             finally:
                 if conn:
                     await db_manager.release_connection('zcwDB_Alicloud', conn)
-    # 失败时不抛异常, 直接返回
+        # 释放并发名额后再等待重试, 等待时间不计入读取延迟
+        if retry_delay:
+            await asyncio.sleep(retry_delay)
+    # 失败时不抛异常, 返回False
+    return False
+
+# 按writer把单个批次写入个人数据库
+async def write_rows(conn, table_name, batch_data, writer, upsert=False):
+    """
+    按writer把单个批次写入个人数据库并提交
+    :param conn: 个人数据库连接
+    :param table_name: 表名
+    :param batch_data: 批次数据(RowBatch或字典列表)
+    :param writer: 写入方式, multi_row、executemany或load_data
+    :param upsert: 是否按id插入或更新, 否则直接插入
+    """
+    if isinstance(batch_data, RowBatch):
+        columns, rows = batch_data.columns, batch_data.rows
+    else:
+        columns, rows = list(batch_data[0].keys()), [tuple(row.values()) for row in batch_data]
+
+    if writer == 'load_data':
+        if upsert:
+            await bulk_loader.upsert(conn, table_name, columns, rows)
+        else:
+            await bulk_loader.load(conn, table_name, columns, rows)
+        return
+
+    if writer == 'multi_row':
+        if 'max_allowed_packet' not in packet_settings:
+            packet_settings['max_allowed_packet'] = await fetch_max_allowed_packet(conn)
+        # 只根据 id 字段进行重复检查, 忽略其他字段(如 phone)的冲突
+        statement = MultiRowInsert(table_name, columns, [col for col in columns if col != 'id'] if upsert else None)
+        async with conn.cursor() as cursor:
+            for insert_query, _ in statement.statements(conn.escape, rows, packet_settings['max_allowed_packet']):
+                await cursor.execute(insert_query)
+        await conn.commit()
+        return
+
+    async with conn.cursor() as cursor:
+        # 构建插入语句, 明确指定字段名
+        insert_query = f"""
+        INSERT INTO {table_name} ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        """
+        if upsert:
+            # 只根据 id 字段进行重复检查, 忽略其他字段(如 phone)的冲突
+            updates = ', '.join([f'{key} = VALUES({key})' for key in columns if key != 'id'])
+            insert_query += f"ON DUPLICATE KEY UPDATE {updates}"
+        await cursor.executemany(insert_query, rows)
+    await conn.commit()
+
+# sync_large_table_step4: 插入单个批次的数据到个人数据库(带重试)
+async def insert_batch(table_name, batch_data, batch_label, writer=default_writer, upsert=False):
+    """
+    插入单个批次的数据到个人数据库, 失败时重试
+    :param table_name: 表名
+    :param batch_data: 批次数据(RowBatch或字典列表)
+    :param batch_label: 批次描述, 用于日志
+    :param writer: 写入方式, multi_row、executemany或load_data
+    :param upsert: 是否按id插入或更新
+    :return: 插入成功的行数, 超过重试次数跳过时返回0
+    """
+    batch_length = len(batch_data)
+    retries = 0
+    max_retries = 3
+
+    while retries <= max_retries:
+        conn = None
+        try:
+            batch_start_time = time.time()
+            logger.info(f"插入 {table_name} {batch_label}, 行数: {batch_length}")
+
+            async with target_limiter.slot():
+                conn = await get_personal_connection()
+                await write_rows(conn, table_name, batch_data, writer, upsert=upsert)
+
+            batch_time = time.time() - batch_start_time
+            logger.info(f"{table_name} {batch_label} 插入成功, 耗时: {batch_time:.2f}秒")
+            return batch_length
+
+        except aiomysql.MySQLError as e:
+            logger.error(f"插入 {table_name} {batch_label} 失败, MySQL错误: {e}")
+            retries += 1
+            if retries > max_retries:
+                logger.error(f"{table_name} {batch_label} 跳过")
+                break
+            else:
+                logger.info(f"重试插入 {table_name} {batch_label}, 暂停 5 秒后重试")
+                await asyncio.sleep(5)
+        except Exception as e:
+            logger.error(f"插入 {table_name} {batch_label} 时发生未知错误: {e}")
+            import traceback
+            traceback.print_exc()
+            break
+        finally:
+            if conn:
+                await db_manager.release_connection('myDB_Alicloud', conn)
+    return 0
 
 # sync_large_table_step4: 从公司数据库插入所有createdAt的数据到个人数据库
-async def insert_data_by_date(table_name, data_by_date):
+async def insert_data_by_date(table_name, data_by_date, writer=default_writer):
     total_inserted = 0
     total_start_time = time.time()
     logger.info(f"准备插入 {table_name}, 共 {len(data_by_date)} 个日期批次")
@@ -217,65 +604,561 @@ async def insert_data_by_date(table_name, data_by_date):
         if data_length == 0:
             continue
             
-        # 确定是否需要分批插入(根据数据量)
-        batch_size = 10000 if data_length > 10000 else data_length
-        batches_count = (data_length + batch_size - 1) // batch_size  # 向上取整
-        
-        logger.info(f"{table_name} 日期 {date} 数据量: {data_length}行, 分 {batches_count} 批插入")
+        # 批次大小由batch_sizer按字节预算和吞吐量确定
+        sizer = batch_sizers.get(table_name)
+        logger.info(f"{table_name} 日期 {date} 数据量: {data_length}行, 初始批次大小: {sizer.rows}行")
         
         date_inserted = 0
-        for i in range(0, data_length, batch_size):
-            batch_data = data[i:i + batch_size]
-            batch_length = len(batch_data)
-            retries = 0
-            max_retries = 3
-            
-            while retries <= max_retries:
-                conn = None
-                try:
-                    batch_start_time = time.time()
-                    logger.info(f"插入 {table_name} 批次 {i//batch_size + 1}/{batches_count}, 行数: {batch_length}")
-                    
-                    conn = await get_personal_connection()
-                    async with conn.cursor() as cursor:
-                        insert_query = f"""
-                        INSERT INTO {table_name} ({', '.join(batch_data[0].keys())})
-                        VALUES ({', '.join(['%s'] * len(batch_data[0]))})
-                        """
-                        await cursor.executemany(insert_query, [tuple(row.values()) for row in batch_data])
-                    await conn.commit()
-                    
-                    batch_time = time.time() - batch_start_time
-                    date_inserted += batch_length
-                    total_inserted += batch_length
-                    
-                    logger.info(f"{table_name} 批次 {i//batch_size + 1}/{batches_count} 插入成功, 耗时: {batch_time:.2f}秒, 进度: {date_inserted}/{data_length}")
-                    break  # 当前批次成功, 退出重试循环
-                    
-                except aiomysql.MySQLError as e:
-                    logger.error(f"插入 {table_name} 批次 {i//batch_size + 1}/{batches_count} 失败, MySQL错误: {e}")
-                    retries += 1
-                    if retries > max_retries:
-                        logger.error(f"{table_name} 中日期 {date} 的批次 {i//batch_size + 1} 跳过")
-                        break
-                    else:
-                        logger.info(f"重试插入 {table_name} 批次 {i//batch_size + 1}, 暂停 5 秒后重试")
-                        await asyncio.sleep(5)
-                except Exception as e:
-                    logger.error(f"插入 {table_name} 批次 {i//batch_size + 1}/{batches_count} 时发生未知错误: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    break
-                finally:
-                    if conn:
-                        await db_manager.release_connection('myDB_Alicloud', conn)
+        for batch_index, batch_data in enumerate(sizer.iter_batches(data), 1):
+            batch_start_time = time.time()
+            inserted = await insert_batch(table_name, batch_data, f"日期 {date} 批次 {batch_index}", writer)
+            if inserted < len(batch_data):
+                sizer.record_failure()
+            else:
+                sizer.record(inserted, time.time() - batch_start_time)
+            date_inserted += inserted
+            total_inserted += inserted
+        logger.info(f"{table_name} 日期 {date} 插入进度: {date_inserted}/{data_length}")
     
     total_time = time.time() - total_start_time
     logger.info(f"{table_name} 所有数据插入完成, 总插入行数: {total_inserted}, 总耗时: {total_time:.2f}秒")
     return total_inserted
 
+# 流式读取: 设置读取连接的会话参数
+async def prepare_stream_connection(conn):
+    """
+    放宽流式读取连接的net_write_timeout, 避免写入落后(背压)期间服务端中断打开的游标
+    :param conn: 公司数据库连接
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute("SET SESSION net_write_timeout = %s", (stream_net_write_timeout,))
+
+# 流式读取: 把分块放入队列, 记录背压等待时间
+async def put_chunk(queue, item, table_name, unit_label):
+    """
+    把分块放入有界队列, 队列已满时等待写入任务消费; 等待超过stream_net_write_timeout的一半时记录警告
+    :param queue: 分块队列
+    :param item: 队列元素
+    :param table_name: 表名
+    :param unit_label: 同步单元描述
+    """
+    start_time = time.time()
+    await queue.put(item)
+    wait_time = time.time() - start_time
+    if wait_time > stream_net_write_timeout / 2:
+        logger.warning(f"{table_name} {unit_label} 等待写入 {wait_time:.1f} 秒, 接近读取连接的net_write_timeout "
+                       f"({stream_net_write_timeout} 秒), 请减小pipeline_queue_size或stream_chunk_size")
+
+# sync_large_table_step3(流水线生产者): 使用服务端游标分块获取单个createdAt日期的数据并放入队列
+async def produce_date_chunks(table_name, date, id_range, table_config, queue, semaphore, failed_dates):
+    """
+    流式获取单个同步单元(日期或日期内的主键区间)的数据, 每个分块放入有界队列, 队列已满时阻塞等待写入任务消费(背压)
+    :param table_name: 表名
+    :param date: 日期字符串, 格式YYYY-MM-DD
+    :param id_range: 主键区间(lo, hi), 为None时同步整个日期
+    :param table_config: 大表配置
+    :param queue: 分块队列, 元素为(日期, 分块描述, 分块数据)
+    :param semaphore: 限制单张表同时读取的同步单元数的信号量, 所有表的读取并发由source_limiter控制
+    :param failed_dates: 已放入部分分块后失败的日期集合, 由调用方删除后重新同步
+    :return: (获取行数, 读取耗时秒数)
+    """
+    max_retries = 5
+    retry_count = 0
+    fetched_rows = 0
+    fetch_time = 0.0
+    unit_label = f"日期 {date}" + (f" id区间 {id_range[0]}-{id_range[1]}" if id_range else "")
+    while retry_count <= max_retries:
+        conn = None
+        chunk_index = 0
+        retry_delay = None
+        async with semaphore, source_limiter.slot() as slot:
+            try:
+                logger.info(f"开始流式获取 {table_name} 中{unit_label} 的数据")
+                conn = await get_company_connection()
+                await prepare_stream_connection(conn)
+                start_time = time.time()
+                read_start_time = start_time
+                # 编译查询模板并绑定日期和id区间参数
+                data_query, args = await build_source_query(
+                    conn, table_config['data_query_template'], build_chunk_params(date, id_range),
+                    date_conditions=build_date_conditions(table_config, id_range is not None))
+                async for chunk in db_manager.stream_query(conn, data_query, args, chunk_size=stream_chunk_size):
+                    chunk_read_time = time.time() - read_start_time
+                    fetch_time += chunk_read_time
+                    slot.add_sample(chunk_read_time)
+                    chunk_index += 1
+                    fetched_rows += len(chunk)
+                    await put_chunk(queue, (date, f"{unit_label} 分块 {chunk_index}", chunk), table_name, unit_label)
+                    read_start_time = time.time()
+                fetch_time += time.time() - read_start_time
+                query_time = time.time() - start_time
+                if fetched_rows > 0:
+                    logger.info(f"{table_name} 中{unit_label} 获取成功, 行数: {fetched_rows}, 分块数: {chunk_index}, 耗时: {query_time:.2f}秒")
+                else:
+                    logger.info(f"{table_name} 中{unit_label} 没有数据")
+                return fetched_rows, fetch_time
+            except aiomysql.MySQLError as e:
+                logger.error(f"流式查询 {table_name} {unit_label} 时失败, 错误信息: {e}")
+                if is_congestion_error(e):
+                    slot.mark_congested()
+                # 已放入队列的分块无法撤回, 交由调用方删除该日期后重新同步
+                if chunk_index > 0:
+                    logger.error(f"{table_name} {unit_label} 已发送 {chunk_index} 个分块, 标记日期 {date} 为待重新同步")
+                    failed_dates.add(date)
+                    return fetched_rows, fetch_time
+                retry_count += 1
+                if retry_count >= 3:
+                    logger.error(f"{table_name} {unit_label} 错误次数达到 {retry_count} 次, 等待 5 秒后重试")
+                    retry_delay = 5
+                else:
+                    logger.info(f"等待 3 秒后重试 {table_name} {unit_label}")
+                    retry_delay = 3
+            except Exception as e:
+                logger.error(f"{table_name} {unit_label} 发生未知错误信息: {e}")
+                import traceback
+                traceback.print_exc()
+                if chunk_index > 0:
+                    failed_dates.add(date)
+                break
+            finally:
+                if conn:
+                    await db_manager.release_connection('zcwDB_Alicloud', conn)
+        # 释放并发名额后再等待重试, 等待时间不计入读取延迟
+        if retry_delay:
+            await asyncio.sleep(retry_delay)
+    # 失败时不抛异常, 返回已获取的行数; 该日期标记为待重新同步, 避免被当作已完成
+    failed_dates.add(date)
+    return fetched_rows, fetch_time
+
+# sync_large_table_step4(流水线消费者): 从队列中取出分块插入个人数据库
+async def consume_date_chunks(table_name, queue, stats, failed_dates, writer=default_writer, upsert=False, on_inserted=None):
+    """
+    循环从队列取出分块并插入个人数据库, 取到None时退出
+    :param table_name: 表名
+    :param queue: 分块队列
+    :param stats: 写入统计字典, 包含inserted(插入行数)、insert_time(插入耗时)和max_id(已插入的最大id)
+    :param failed_dates: 存在插入失败分块的日期集合
+    :param writer: 写入方式, multi_row、executemany或load_data
+    :param upsert: 是否按id插入或更新, delta模式使用
+    :param on_inserted: 可选的回调, 每个分块处理完成后以(日期, 插入行数)调用
+    """
+    while True:
+        item = await queue.get()
+        try:
+            if item is None:
+                return
+            date, chunk_label, chunk = item
+            insert_start_time = time.time()
+            inserted = await insert_batch(table_name, chunk, chunk_label, writer, upsert)
+            stats['insert_time'] += time.time() - insert_start_time
+            stats['inserted'] += inserted
+            if inserted < len(chunk):
+                failed_dates.add(date)
+            else:
+                chunk_max_id = max_row_id(chunk)
+                if chunk_max_id is not None:
+                    stats['max_id'] = max(stats['max_id'] or chunk_max_id, chunk_max_id)
+            if on_inserted:
+                on_inserted(date, inserted)
+        finally:
+            queue.task_done()
+
+# 单张表同时读取的同步单元数上限
+def get_unit_semaphore(table_config):
+    """
+    获取限制单张表同时读取的同步单元数的信号量
+    :param table_config: 大表配置, chunking.parallel为单表上限, 未配置时只受source_limiter限制
+    :return: 信号量
+    """
+    parallel = table_config.get('chunking', {}).get('parallel', source_limiter.maximum)
+    return asyncio.Semaphore(max(1, int(parallel)))
+
+# sync_large_table_step3 + step4: 读取与写入重叠执行的流水线
+async def run_fetch_insert_pipeline(table_name, dates, table_config, delete_task=None, target_table=None,
+                                    on_date_complete=None):
+    """
+    生产者按同步单元流式读取公司数据库, 通过有界队列交给多个写入任务插入个人数据库
+    :param table_name: 表名
+    :param dates: 需要同步的日期列表
+    :param table_config: 大表配置
+    :param delete_task: 可选的删除任务, 读取与删除同时进行, 删除完成后才启动写入任务; 删除失败时停止读取并抛出异常
+    :param target_table: 写入的表, 默认与table_name相同(分区交换时为暂存表)
+    :param on_date_complete: 可选的回调, 日期的所有同步单元都已读取且所有分块都已成功写入时以日期调用
+    :return: (获取行数, 插入行数, 读取耗时, 插入耗时, 失败日期集合, 已插入的最大id)
+    """
+    queue = asyncio.Queue(maxsize=pipeline_queue_size)
+    stats = {'inserted': 0, 'insert_time': 0.0, 'max_id': None}
+    failed_dates = set()
+    units = await plan_sync_units(table_name, dates, table_config)
+    date_semaphore = get_unit_semaphore(table_config)
+
+    # 按日期统计未读取完的同步单元数、已读取和已写入的行数, 用于判断日期是否已完整写入
+    pending_units = {}
+    for date, _ in units:
+        pending_units[date] = pending_units.get(date, 0) + 1
+    fetched_by_date = {date: 0 for date in pending_units}
+    inserted_by_date = {date: 0 for date in pending_units}
+
+    def check_date_complete(date):
+        if on_date_complete and pending_units[date] == 0 and date not in failed_dates \
+                and inserted_by_date[date] >= fetched_by_date[date]:
+            pending_units[date] = -1  # 只回调一次
+            on_date_complete(date)
+
+    def record_inserted(date, inserted):
+        inserted_by_date[date] += inserted
+        check_date_complete(date)
+
+    async def produce_unit(date, id_range):
+        result = await produce_date_chunks(table_name, date, id_range, table_config, queue, date_semaphore, failed_dates)
+        pending_units[date] -= 1
+        fetched_by_date[date] += result[0]
+        check_date_complete(date)
+        return result
+
+    producers = asyncio.gather(*[produce_unit(date, id_range) for date, id_range in units])
+    writers = []
+    try:
+        if delete_task is not None:
+            try:
+                await delete_task
+            except BaseException:
+                # 删除失败时写入任务尚未启动, 停止读取以免生产者阻塞在已满的队列上
+                producers.cancel()
+                await asyncio.gather(producers, return_exceptions=True)
+                raise
+        writers = [
+            asyncio.create_task(consume_date_chunks(
+                target_table or table_name, queue, stats, failed_dates, table_config['writer'], on_inserted=record_inserted))
+            for _ in range(pipeline_writers)
+        ]
+        results = await producers
+    finally:
+        # 所有生产者结束后, 为每个写入任务放入结束标记
+        for _ in writers:
+            await queue.put(None)
+        await asyncio.gather(*writers)
+
+    fetched_rows = sum(result[0] for result in results)
+    fetch_time = sum(result[1] for result in results)
+    return fetched_rows, stats['inserted'], fetch_time, stats['insert_time'], failed_dates, stats['max_id']
+
+# sync_large_table(delta模式): 按updatedAt区间查询的筛选条件
+def build_delta_conditions(table_config, matching=True):
+    """
+    构建delta模式按updatedAt区间查询的筛选条件, 走updatedAt索引的范围扫描
+    :param table_config: 大表配置, 包含可选的row_filter
+    :param matching: True为区间内满足row_filter的行; False为区间内更新后不再满足row_filter的行
+    :return: 用于替换{date_conditions}的条件语句, matching为False且没有row_filter时返回None
+    """
+    conditions = ["`updatedAt` BETWEEN @start_date AND @end_date"]
+    row_filter = (table_config.get('row_filter') or '').strip()
+    if row_filter:
+        conditions.append(row_filter if matching else f"NOT COALESCE(({row_filter}), FALSE)")
+    elif not matching:
+        return None
+    return f"({' AND '.join(conditions)})"
+
+# sync_large_table(delta模式)生产者: 流式获取updatedAt区间内的行并放入队列
+async def produce_delta_chunks(table_name, table_config, queue):
+    """
+    流式获取同步区间内updatedAt有变化的行, 每个分块放入有界队列
+    :param table_name: 表名
+    :param table_config: 大表配置
+    :param queue: 分块队列, 元素为('delta', 分块描述, 分块数据)
+    :return: (获取行数, 读取耗时秒数, 是否读取完整)
+    """
+    conn = None
+    fetched_rows = 0
+    fetch_time = 0.0
+    chunk_index = 0
+    async with source_limiter.slot() as slot:
+        try:
+            logger.info(f"开始流式获取 {table_name} 的增量数据")
+            conn = await get_company_connection()
+            await prepare_stream_connection(conn)
+            data_query, args = await build_source_query(
+                conn, table_config['data_query_template'], get_window_params(table_name),
+                date_conditions=build_delta_conditions(table_config))
+            read_start_time = time.time()
+            async for chunk in db_manager.stream_query(conn, data_query, args, chunk_size=stream_chunk_size):
+                chunk_read_time = time.time() - read_start_time
+                fetch_time += chunk_read_time
+                slot.add_sample(chunk_read_time)
+                chunk_index += 1
+                fetched_rows += len(chunk)
+                await put_chunk(queue, ('delta', f"增量 分块 {chunk_index}", chunk), table_name, '增量')
+                read_start_time = time.time()
+            fetch_time += time.time() - read_start_time
+            logger.info(f"{table_name} 增量数据获取成功, 行数: {fetched_rows}, 分块数: {chunk_index}, 耗时: {fetch_time:.2f}秒")
+            return fetched_rows, fetch_time, True
+        except aiomysql.MySQLError as e:
+            logger.error(f"增量查询 {table_name} 时失败, 错误信息: {e}")
+            if is_congestion_error(e):
+                slot.mark_congested()
+            return fetched_rows, fetch_time, False
+        except Exception as e:
+            logger.error(f"增量查询 {table_name} 时发生未知错误信息: {e}")
+            return fetched_rows, fetch_time, False
+        finally:
+            if conn:
+                await db_manager.release_connection('zcwDB_Alicloud', conn)
+
+# sync_large_table(delta模式): 删除区间内更新后不再满足row_filter的行
+async def delete_filtered_rows(table_name, table_config):
+    """
+    区间内更新后不再满足row_filter的行(如订单状态变为取消)在个人数据库中按id删除
+    :param table_name: 表名
+    :param table_config: 大表配置
+    :return: 删除的行数
+    """
+    conditions = build_delta_conditions(table_config, matching=False)
+    if conditions is None:
+        return 0
+    conn = await get_company_connection()
+    try:
+        id_query, args = await build_source_query(
+            conn, f"SELECT `id` FROM {table_name} WHERE {{date_conditions}}", get_window_params(table_name),
+            date_conditions=conditions)
+        ids = [row[0] for row in (await db_manager.fetch_all(conn, id_query, args, row_format='tuple')).rows]
+    finally:
+        await db_manager.release_connection('zcwDB_Alicloud', conn)
+
+    deleted_rows = 0
+    batch_size = 1000
+    for i in range(0, len(ids), batch_size):
+        batch_ids = ids[i:i + batch_size]
+        async with target_limiter.slot():
+            conn2 = await get_personal_connection()
+            try:
+                async with conn2.cursor() as cursor:
+                    await cursor.execute(
+                        f"DELETE FROM {table_name} WHERE `id` IN ({', '.join(['%s'] * len(batch_ids))})", batch_ids)
+                    deleted_rows += cursor.rowcount
+            finally:
+                await db_manager.release_connection('myDB_Alicloud', conn2)
+    if ids:
+        logger.info(f"{table_name} 区间内不再满足筛选条件的行: {len(ids)}, 已删除: {deleted_rows}")
+    return deleted_rows
+
+# sync_large_table(delta模式): 只同步updatedAt在区间内的行, 按id插入或更新
+async def sync_large_table_delta(table_name, table_config):
+    """
+    delta模式同步大表: 不再查询有更新的createdAt日期并整日删除重建,
+    只流式获取updatedAt在同步区间内的行并按id插入或更新; 插入或更新可以重复执行, 失败时整体重试
+    注意: 公司数据库中被物理删除的行不会被发现
+    :param table_name: 表名
+    :param table_config: 大表配置
+    :return: 是否同步成功
+    """
+    total_start_time = time.time()
+    logger.info(f"开始处理表: {table_name}, 增量模式(delta)")
+    total_row_count = 0
+    inserted_rows = 0
+    data_query_time = 0.0
+    insert_time = 0.0
+    max_id = None
+    sync_complete = False
+
+    # Step 1 + Step 2: 流水线读取增量数据并按id插入或更新
+    for round_index in range(pipeline_redo_rounds + 1):
+        queue = asyncio.Queue(maxsize=pipeline_queue_size)
+        stats = {'inserted': 0, 'insert_time': 0.0, 'max_id': None}
+        failed_chunks = set()
+        writers = [
+            asyncio.create_task(consume_date_chunks(
+                table_name, queue, stats, failed_chunks, table_config['writer'], upsert=True))
+            for _ in range(pipeline_writers)
+        ]
+        try:
+            fetched_rows, fetch_time, fetch_complete = await produce_delta_chunks(table_name, table_config, queue)
+        finally:
+            for _ in writers:
+                await queue.put(None)
+            await asyncio.gather(*writers)
+        total_row_count += fetched_rows
+        inserted_rows += stats['inserted']
+        data_query_time += fetch_time
+        insert_time += stats['insert_time']
+        max_id = max(filter(None, [max_id, stats['max_id']]), default=None)
+        if fetch_complete and not failed_chunks:
+            sync_complete = True
+            break
+        if round_index < pipeline_redo_rounds:
+            logger.warning(f"{table_name} 增量同步不完整, 第 {round_index + 1} 轮重新同步")
+            await asyncio.sleep(5)
+
+    # Step 3: 删除区间内不再满足筛选条件的行
+    start_delete_time = time.time()
+    try:
+        await delete_filtered_rows(table_name, table_config)
+    except aiomysql.MySQLError as e:
+        logger.error(f"删除 {table_name} 不再满足筛选条件的行时发生 MySQL 错误信息: {e}")
+        sync_complete = False
+    delete_time = time.time() - start_delete_time
+
+    total_sync_time = time.time() - total_start_time
+    steps_time_str = (
+        f"其中数据查询: {data_query_time:.2f} 秒 ({(data_query_time/total_sync_time*100):.1f}%), "
+        f"数据删除: {delete_time:.2f} 秒 ({(delete_time/total_sync_time*100):.1f}%), "
+        f"数据插入: {insert_time:.2f} 秒 ({(insert_time/total_sync_time*100):.1f}%)"
+    )
+    logger.info(f"{table_name} 数据同步完成, 总耗时: {total_sync_time:.2f} 秒 ({steps_time_str}), "
+                f"总查询到的行数: {total_row_count} 行, 插入的行数: {inserted_rows} 行")
+
+    # 增量数据全部写入时才推进水位线, 否则下次运行重新同步同一区间
+    if not sync_complete:
+        logger.error(f"{table_name} 增量同步不完整, 水位线保持不变")
+        return False
+    await save_watermark(table_name, max_id)
+    return True
+
+# sync_large_table_step2(分区表): 变化日期较多的分区整体重新加载后交换
+async def sync_exchange_partitions(table_name, table_config, dates):
+    """
+    目标表按createdAt分区时, 分区内需要同步的日期数不少于partition_exchange.min_days的分区
+    在暂存表中加载整个分区区间的数据, 然后通过 EXCHANGE PARTITION 替换分区, 不再逐行删除;
+    只交换整个区间都在[@filter_date, @end_date]内的分区, 否则区间外的日期也会被重新加载, 未被读取到的行会随交换被删除;
+    其余日期仍按删除后重新插入处理, 并记录有变化的分区供维护任务重建
+    :param table_name: 表名
+    :param table_config: 大表配置, partition_exchange.min_days为整体交换的最少日期数
+    :param dates: 需要同步的日期列表
+    :return: (已交换的日期集合, 统计字典{fetched, inserted, fetch_time, insert_time, exchange_time, max_id})
+    """
+    stats = {'fetched': 0, 'inserted': 0, 'fetch_time': 0.0, 'insert_time': 0.0, 'exchange_time': 0.0, 'max_id': None}
+    exchange_config = table_config.get('partition_exchange')
+    if not exchange_config or not dates:
+        return set(), stats
+    added = await partition_manager.add_month_partitions(table_name, datetime.strptime(max(dates), '%Y-%m-%d'))
+    if added:
+        logger.info(f"{table_name} 新增分区: {', '.join(added)}")
+    partitions = await partition_manager.get_range_partitions(table_name)
+    if not partitions:
+        return set(), stats
+
+    groups = partition_manager.group_dates(partitions, dates)
+    bounds = {name: (lower, upper) for name, lower, upper in partitions}
+    min_days = int(exchange_config.get('min_days', 1))
+    async with db_manager.connection('zcwDB_Alicloud') as conn:
+        window = await load_session_vars(conn)
+    filter_date, end_date = [value if isinstance(value, datetime) else datetime.combine(value, datetime.min.time())
+                             for value in (window['filter_date'], window['end_date'])]
+    exchanged_dates = set()
+    for partition_name, partition_dates in groups.items():
+        lower, upper = bounds[partition_name]
+        if lower is None or upper is None or len(partition_dates) < min_days:
+            continue
+        if lower < filter_date or upper > end_date:
+            logger.info(f"{table_name} 分区 {partition_name} 不完全在同步区间 {filter_date:%Y-%m-%d} 至 {end_date:%Y-%m-%d} 内, "
+                        f"按日期删除后重新插入")
+            continue
+        partition_days = [(lower + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((upper - lower).days)]
+        logger.info(f"{table_name} 分区 {partition_name} 有 {len(partition_dates)} 个日期需要同步, "
+                    f"整体重新加载 {partition_days[0]} 至 {partition_days[-1]} 后交换分区")
+        exchange_table = None
+        try:
+            exchange_table = await partition_manager.create_exchange_table(table_name, partition_name)
+            fetched, inserted, fetch_time, insert_time, failed_dates, max_id = \
+                await run_fetch_insert_pipeline(table_name, partition_days, table_config, target_table=exchange_table)
+            stats['fetch_time'] += fetch_time
+            stats['insert_time'] += insert_time
+            if failed_dates or inserted < fetched:
+                logger.warning(f"{table_name} 分区 {partition_name} 加载不完整, 改为按日期删除后重新插入")
+                continue
+            start_exchange_time = time.time()
+            async with target_limiter.slot():
+                await partition_manager.exchange_partition(table_name, partition_name, exchange_table)
+            exchange_time = time.time() - start_exchange_time
+            stats['exchange_time'] += exchange_time
+            logger.info(f"{table_name} 分区 {partition_name} 交换完成, 加载 {inserted} 行, 交换耗时 {exchange_time:.2f} 秒")
+            stats['fetched'] += fetched
+            stats['inserted'] += inserted
+            stats['max_id'] = max(filter(None, [stats['max_id'], max_id]), default=None)
+            exchanged_dates.update(partition_dates)
+        except Exception as e:
+            logger.error(f"{table_name} 分区 {partition_name} 交换失败, 改为按日期删除后重新插入, 错误信息: {e}")
+        finally:
+            if exchange_table:
+                await partition_manager.drop_table(exchange_table)
+
+    # 交换的分区是新建的, 只有按日期删除和插入的分区需要维护任务重建
+    await partition_manager.mark_touched(table_name, [name for name in groups if not set(groups[name]) <= exchanged_dates])
+    return exchanged_dates, stats
+
+# sync_large_table(staging方式): 读取的数据写入暂存表后按日期替换原表数据
+async def sync_dates_via_staging(table_name, dates, table_config, checkpoint_key):
+    """
+    流水线把数据写入暂存表, 每轮结束后把完整写入的日期按staging_merge_days分组, 每组在一个事务中替换原表的数据,
+    合并后在运行断点中记录这些日期; 中途失败的日期从暂存表中删除后重新同步, 最多pipeline_redo_rounds轮
+    :param table_name: 表名
+    :param dates: 需要同步的日期列表
+    :param table_config: 大表配置
+    :param checkpoint_key: 运行断点中的名称(表名或分片名称)
+    :return: (读取行数, 写入暂存表的行数, 读取耗时, 写入耗时, 合并耗时, 未完成的日期集合, 最大id)
+    """
+    if not dates:
+        return 0, 0, 0.0, 0.0, 0.0, set(), None
+    # 分片使用各自的暂存表
+    staging_table = f"{checkpoint_key.replace('#', '_')}__staging"
+    total_row_count = inserted_rows = 0
+    data_query_time = insert_time = merge_time = 0.0
+    max_id = None
+    failed_dates = set()
+    pending_dates = list(dates)
+    await staging_merger.create(table_name, staging_table)
+    try:
+        for redo_round in range(pipeline_redo_rounds + 1):
+            if redo_round:
+                logger.warning(f"{table_name} 第 {redo_round} 轮重新同步日期: {', '.join(pending_dates)}")
+                await staging_merger.clear(staging_table, pending_dates)
+            fetched, inserted, fetch_time, round_insert_time, failed_dates, round_max_id = \
+                await run_fetch_insert_pipeline(table_name, pending_dates, table_config, target_table=staging_table)
+            total_row_count += fetched
+            inserted_rows += inserted
+            data_query_time += fetch_time
+            insert_time += round_insert_time
+            max_id = max(filter(None, [max_id, round_max_id]), default=None)
+
+            # 完整写入暂存表的日期逐组替换原表数据
+            for group in staging_merger.date_groups(date for date in pending_dates if date not in failed_dates):
+                start_merge_time = time.time()
+                deleted, merged = await staging_merger.merge(table_name, staging_table, group)
+                elapsed_time = time.time() - start_merge_time
+                merge_time += elapsed_time
+                logger.info(f"{table_name} 合并 {group[0]} 至 {group[-1]} 的数据完成, 删除 {deleted} 行, "
+                            f"插入 {merged} 行, 耗时 {elapsed_time:.2f} 秒")
+                run_checkpoint.mark_dates_done(checkpoint_key, group)
+
+            pending_dates = sorted(failed_dates)
+            if not pending_dates:
+                break
+    finally:
+        try:
+            await staging_merger.drop(staging_table)
+        except Exception as e:
+            logger.error(f"删除暂存表 {staging_table} 时发生错误信息: {e}")
+    return total_row_count, inserted_rows, data_query_time, insert_time, merge_time, failed_dates, max_id
+
 # sync_large_table: 处理查询和数据同步任务带重试机制
-async def sync_large_table(table_name, date_query, data_query_template, semaphore):
+async def sync_large_table(table_name, table_config, semaphore, shard_key=None):
+    """
+    同步大表: 查询有更新的createdAt日期, 删除个人数据库中这些日期的数据后重新获取并插入
+    sync_mode为delta时改为只同步updatedAt在区间内的行, 见sync_large_table_delta
+    :param table_name: 表名
+    :param table_config: 大表配置, 包含date_query/data_query_template以及可选的chunking/row_filter/sync_mode
+    :param semaphore: 限制同时处理表数量的信号量
+    :param shard_key: 日期分片名称, 只同步运行断点中该分片的日期且不推进水位线(由主进程在全部分片完成后推进)
+    :return: 是否同步成功
+    """
+    # 分片的进度以分片名称记录在运行断点中
+    checkpoint_key = shard_key or table_name
+    if table_config.get('sync_mode') == 'delta':
+        async with semaphore:
+            synced = await sync_large_table_delta(table_name, table_config)
+        if synced:
+            run_checkpoint.mark_table_done(table_name)
+        return synced
+
     retries = 0
     max_retries = 3
     
@@ -286,67 +1169,145 @@ async def sync_large_table(table_name, date_query, data_query_template, semaphor
                 logger.info(f"开始处理表: {table_name}, 第 {retries + 1} 次尝试")
 
                 # Step 1: 从公司数据库获取在updateAt中所有 createdAt 日期的数据
-                start_dates_query_time = time.time()
-                conn1 = await get_company_connection()
-                try:
-                    dates = await fetch_dates_with_updates(conn1, date_query, table_name)
-                    dates_query_time = time.time() - start_dates_query_time
-                except TimeoutError:
-                    # 对于大表超时，使用更长的重试间隔
-                    retry_delay = 30 if table_name in ['orderitems', 'deliveryreceiptitems'] else 10
-                    logger.error(f"{table_name} Step 1 超时, 等待{retry_delay}秒后进行第 {retries + 2} 次重试")
-                    retries += 1
-                    if retries <= max_retries:
-                        await asyncio.sleep(retry_delay)
-                        continue
-                    else:
-                        logger.error(f"{table_name} 已达到最大重试次数 {max_retries}, 处理失败")
-                        return False
+                # 有断点(--resume或本次运行中的重试)时使用之前确定的日期, 跳过已完整写入的日期
+                checkpoint_state = run_checkpoint.table_state(checkpoint_key)
+                if checkpoint_state and checkpoint_state.get('dates'):
+                    dates_query_time = 0.0
+                    dates = run_checkpoint.pending_dates(checkpoint_key)
+                    logger.info(f"{table_name} 从断点继续, 跳过已完成的日期 {len(checkpoint_state['done_dates'])} 个")
+                else:
+                    start_dates_query_time = time.time()
+                    conn1 = await get_company_connection()
+                    try:
+                        dates = await fetch_dates_with_updates(conn1, table_config['date_query'], table_name)
+                        dates_query_time = time.time() - start_dates_query_time
+                    except TimeoutError:
+                        # 对于大表超时，使用更长的重试间隔
+                        retry_delay = 30 if table_name in ['orderitems', 'deliveryreceiptitems'] else 10
+                        logger.error(f"{table_name} Step 1 超时, 等待{retry_delay}秒后进行第 {retries + 2} 次重试")
+                        retries += 1
+                        if retries <= max_retries:
+                            await asyncio.sleep(retry_delay)
+                            continue
+                        else:
+                            logger.error(f"{table_name} 已达到最大重试次数 {max_retries}, 处理失败")
+                            return False
+
+                    run_checkpoint.start_table(checkpoint_key, dates)
 
                 if not dates:
                     logger.info(f"{table_name} 没有需要同步的数据")
+                    if shard_key is None:
+                        await save_watermark(table_name)
+                    run_checkpoint.mark_table_done(checkpoint_key)
                     return True
 
                 logger.info(f"{table_name} 需要同步的日期有: {', '.join(dates)}")
 
-                # Step 2: 删除个人数据库中对应createdAt的数据
-                start_delete_time = time.time()
-                conn2 = await get_personal_connection()
-                await delete_existing_data(conn2, table_name, dates)
-                delete_time = time.time() - start_delete_time
+                # Step 2(分区表): 变化日期较多的分区整体重新加载后交换, 剩余日期继续按下面的步骤处理
+                exchanged_dates, exchange_stats = await sync_exchange_partitions(table_name, table_config, dates)
+                dates = [date for date in dates if date not in exchanged_dates]
+                if exchanged_dates:
+                    run_checkpoint.mark_dates_done(checkpoint_key, exchanged_dates)
 
-                # Step 3: 从公司数据库异步获取每个createdAt的数据
-                start_data_query_time = time.time()
-                all_data_by_date = {}
-                tasks = []
+                # Step 2: 删除个人数据库中对应createdAt的数据, 与Step 3的读取同时进行
+                # 从断点继续时未完成的日期可能已写入部分数据, 同样先删除
+                # staging方式不预先删除, 数据写入暂存表后按日期在短事务中替换
+                use_staging = stream_large_table and table_config.get('resync_strategy', default_resync_strategy) == 'staging'
+                if not use_staging:
+                    delete_task = asyncio.create_task(delete_existing_data(table_name, dates, checkpoint_key))
 
-                date_semaphore = asyncio.Semaphore(1)  # 允许同时处理多个日期, 但限制并发数
-                for date in dates:
-                    task = asyncio.create_task(fetch_and_collect_data_with_retry_by_date(
-                        table_name, date, data_query_template, all_data_by_date, date_semaphore))
-                    tasks.append(task)
+                if use_staging:
+                    # Step 3 + Step 4: 流水线读取并写入暂存表, 完整写入的日期替换原表数据
+                    total_row_count, inserted_rows, data_query_time, insert_time, delete_time, failed_dates, max_id = \
+                        await sync_dates_via_staging(table_name, dates, table_config, checkpoint_key)
+                    if failed_dates:
+                        logger.error(f"{table_name} 以下日期同步不完整, 保留原数据: {', '.join(sorted(failed_dates))}")
+                    sync_complete = not failed_dates
+                    all_data_by_date = {}
+                elif stream_large_table:
+                    # Step 3 + Step 4: 流水线读取与写入, 读取到的分块经有界队列直接交给写入任务
+                    try:
+                        total_row_count, inserted_rows, data_query_time, insert_time, failed_dates, max_id = \
+                            await run_fetch_insert_pipeline(table_name, dates, table_config, delete_task,
+                                                            on_date_complete=checkpoint_date_callback(checkpoint_key))
+                    finally:
+                        await asyncio.wait([delete_task])
+                    delete_time = delete_task.result()[1]
 
-                await asyncio.gather(*tasks)
+                    # 同步中途失败的日期: 删除已写入的部分数据后重新同步
+                    redo_round = 0
+                    while failed_dates and redo_round < pipeline_redo_rounds:
+                        redo_round += 1
+                        redo_dates = sorted(failed_dates)
+                        logger.warning(f"{table_name} 第 {redo_round} 轮重新同步日期: {', '.join(redo_dates)}")
+                        redo_delete_time = (await delete_existing_data(table_name, redo_dates))[1]
+                        delete_time += redo_delete_time
+                        redo_fetched, redo_inserted, redo_fetch_time, redo_insert_time, failed_dates, redo_max_id = \
+                            await run_fetch_insert_pipeline(table_name, redo_dates, table_config,
+                                                            on_date_complete=checkpoint_date_callback(checkpoint_key))
+                        max_id = max(filter(None, [max_id, redo_max_id]), default=None)
+                        total_row_count += redo_fetched
+                        inserted_rows += redo_inserted
+                        data_query_time += redo_fetch_time
+                        insert_time += redo_insert_time
+                    if failed_dates:
+                        logger.error(f"{table_name} 以下日期同步不完整: {', '.join(sorted(failed_dates))}")
+                    sync_complete = not failed_dates
+                    all_data_by_date = {}
+                else:
+                    # Step 3: 从公司数据库异步获取每个createdAt的数据
+                    start_data_query_time = time.time()
+                    all_data_by_date = {}
+                    tasks = []
 
-                total_row_count = sum(len(data) for data in all_data_by_date.values())
-                data_query_time = time.time() - start_data_query_time
+                    date_semaphore = get_unit_semaphore(table_config)
+                    for date in dates:
+                        task = asyncio.create_task(fetch_and_collect_data_with_retry_by_date(
+                            table_name, date, table_config, all_data_by_date, date_semaphore))
+                        tasks.append(task)
 
-                # Step 4: 从公司数据库插入所有createdAt的数据到个人数据库
-                start_insert_time = time.time()
-                inserted_rows = await insert_data_by_date(table_name, all_data_by_date)
-                insert_time = time.time() - start_insert_time
+                    try:
+                        fetch_results = await asyncio.gather(*tasks)
+                    finally:
+                        # 读取失败时也等待删除结束, 避免重试时与未完成的删除重叠
+                        await asyncio.wait([delete_task])
+                    delete_time = delete_task.result()[1]
+
+                    total_row_count = sum(len(data) for data in all_data_by_date.values())
+                    data_query_time = time.time() - start_data_query_time
+
+                    # Step 4: 从公司数据库插入所有createdAt的数据到个人数据库
+                    start_insert_time = time.time()
+                    inserted_rows = await insert_data_by_date(table_name, all_data_by_date, table_config['writer'])
+                    insert_time = time.time() - start_insert_time
+                    sync_complete = all(fetch_results) and inserted_rows >= total_row_count
+                    if sync_complete:
+                        run_checkpoint.mark_dates_done(checkpoint_key, dates)
+                    max_id = max(filter(None, [max_row_id(data) for data in all_data_by_date.values()]), default=None)
+                total_row_count += exchange_stats['fetched']
+                inserted_rows += exchange_stats['inserted']
+                data_query_time += exchange_stats['fetch_time']
+                insert_time += exchange_stats['insert_time'] + exchange_stats['exchange_time']
+                max_id = max(filter(None, [max_id, exchange_stats['max_id']]), default=None)
                 total_sync_time = time.time() - total_start_time
 
                 # 计算每个步骤的耗时百分比
                 total_time_str = f"总耗时: {total_sync_time:.2f} 秒"
                 steps_time_str = (
                     f"其中日期查询: {dates_query_time:.2f} 秒 ({(dates_query_time/total_sync_time*100):.1f}%), "
-                    f"数据删除: {delete_time:.2f} 秒 ({(delete_time/total_sync_time*100):.1f}%), "
+                    f"{'数据合并' if use_staging else '数据删除'}: {delete_time:.2f} 秒 ({(delete_time/total_sync_time*100):.1f}%), "
                     f"数据查询: {data_query_time:.2f} 秒 ({(data_query_time/total_sync_time*100):.1f}%), "
                     f"数据插入: {insert_time:.2f} 秒 ({(insert_time/total_sync_time*100):.1f}%)"
                 )
                 logger.info(f"{table_name} 数据同步完成, {total_time_str} ({steps_time_str}), 总查询到的行数: {total_row_count} 行, 插入的行数: {inserted_rows} 行")
 
+                # 全部日期同步完整时才推进水位线, 否则下次运行重新同步同一区间
+                if sync_complete:
+                    if shard_key is None:
+                        await save_watermark(table_name, max_id)
+                    run_checkpoint.mark_table_done(checkpoint_key)
+
                 # Step 5: 手动释放内存
                 del all_data_by_date
                 logger.info(f"{table_name} 内存已释放, 处理完成")
@@ -370,57 +1331,41 @@ async def sync_large_table(table_name, date_query, data_query_template, semaphor
 async def fetch_data(conn, query, table_name):
     start_time = time.time()  # 记录查询开始时间
     try:
-        async with conn.cursor() as cursor:
-            await cursor.execute(f"SET @start_date = CURRENT_DATE - INTERVAL {days_interval} DAY;")
-            await cursor.execute(f"SET @end_date = CURRENT_DATE - INTERVAL {days_offset} DAY;")
-            await cursor.execute(f"SET @filter_date = CURRENT_DATE - INTERVAL {days_updated} DAY;")
-            await cursor.execute(query)
-            data = await cursor.fetchall()
-            row_count = len(data)
+        # 编译查询模板并绑定同步日期区间参数(有水位线时从上次同步成功的位置开始)
+        data_query, args = await build_source_query(conn, query, get_window_params(table_name))
+        data = await db_manager.fetch_all(conn, data_query, args)
+        row_count = len(data)
     finally:
         end_time = time.time()  # 记录查询结束时间
         query_time = end_time - start_time  # 计算查询用时
     return data, row_count, query_time
 
 # sync_small_table_step2: 插入或更新个人数据库的数据(注: 使用了警告忽略)
-async def upsert_data(table_name, data):
+async def upsert_data(table_name, data, writer=default_writer):
     total_inserted = 0
-    batch_size = 10000  # 根据需要调整批次大小
-    data_length = len(data)
-    for i in range(0, data_length, batch_size):
-        batch_data = data[i:i + batch_size]
+    sizer = batch_sizers.get(table_name)  # 批次大小按字节预算和吞吐量自适应
+    for batch_index, batch_data in enumerate(sizer.iter_batches(data), 1):
         retries = 0
         max_retries = 3
         while retries <= max_retries:
             conn = None
             try:
-                conn = await get_personal_connection()
-                async with conn.cursor() as cursor:
-                    # 构建插入语句, 明确指定字段名
-                    columns = ', '.join(batch_data[0].keys())
-                    placeholders = ', '.join(['%s'] * len(batch_data[0]))
-                    
-                    # 只根据 id 字段进行重复检查, 忽略其他字段
-                    updates = ', '.join([f'{key} = VALUES({key})' for key in batch_data[0].keys() if key != 'id'])
-                    
-                    # 插入语句, 只通过 id 确保唯一性, 避免其他字段(如 phone)的冲突
-                    insert_query = f"""
-                    INSERT INTO {table_name} ({columns})
-                    VALUES ({placeholders})
-                    ON DUPLICATE KEY UPDATE {updates}
-                    """
-                    await cursor.executemany(insert_query, [tuple(row.values()) for row in batch_data])
-                await conn.commit()
+                async with target_limiter.slot():
+                    conn = await get_personal_connection()
+                    batch_start_time = time.time()
+                    await write_rows(conn, table_name, batch_data, writer, upsert=True)
+                    sizer.record(len(batch_data), time.time() - batch_start_time)
                 total_inserted += len(batch_data)
                 break  # 当前批次成功, 退出重试循环
             except aiomysql.MySQLError as e:
                 logger.error(f"在表 {table_name} 中同步数据时发生 MySQL 错误信息: {e}")
+                sizer.record_failure()
                 retries += 1
                 if retries > max_retries:
                     logger.error(f"表 {table_name} 中同步数据超过最大重试次数, 跳过当前批次")
                     break
                 else:
-                    logger.info(f"表 {table_name} 重试插入批次 {i // batch_size + 1}, 暂停 5 秒后重试")
+                    logger.info(f"表 {table_name} 重试插入批次 {batch_index}, 暂停 5 秒后重试")
                     await asyncio.sleep(5)
             except Exception as e:
                 logger.error(f"在表 {table_name} 中同步数据时发生未知错误信息: {e}")
@@ -430,8 +1375,32 @@ async def upsert_data(table_name, data):
                     await db_manager.release_connection('myDB_Alicloud', conn)
     return total_inserted
 
+# sync_small_table(delete_upsert方式)_step2: 删除同步区间内的旧数据
+async def delete_updated_rows(table_name):
+    """
+    删除个人数据库中updatedAt在同步区间内的行, 区间与读取时绑定的参数相同(有水位线时从水位线开始)
+    :param table_name: 表名
+    """
+    params = dict(session_vars)
+    params.update(get_window_params(table_name))
+    async with target_limiter.slot():
+        async with db_manager.connection('myDB_Alicloud') as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DELETE FROM {table_name} WHERE updatedAt BETWEEN %s AND %s",
+                                     (params['start_date'], params['end_date']))
+            await conn.commit()
+
 # sync_small_table: 处理查询和数据同步任务
-async def sync_small_table(table_name, query, semaphore):
+async def sync_small_table(table_name, query, semaphore, writer=default_writer, strategy=default_upsert_strategy):
+    """
+    同步小表: 获取同步区间内有变化的行并插入或更新
+    :param table_name: 表名
+    :param query: 查询语句
+    :param semaphore: 限制同时处理表数量的信号量
+    :param writer: 写入方式
+    :param strategy: id_diff 写入后检测并删除源库中已物理删除的行; delete_upsert 写入前删除同步区间内的旧数据
+    :return: 是否同步成功
+    """
     async with semaphore:
         try:
             total_start_time = time.time()  # 记录整个同步过程的开始时间
@@ -445,17 +1414,15 @@ async def sync_small_table(table_name, query, semaphore):
             query_time = time.time() - start_query_time
 
             if row_count > 0:
-                # Step 2: 删除旧数据
+                # Step 2: 删除旧数据(delete_upsert方式)
                 start_delete_time = time.time()
-                conn2 = await get_personal_connection()
-                async with conn2.cursor() as cursor:
-                    await cursor.execute(f"DELETE FROM {table_name} WHERE updatedAt BETWEEN @start_date AND @end_date")
-                await db_manager.release_connection('myDB_Alicloud', conn2)
+                if strategy == 'delete_upsert':
+                    await delete_updated_rows(table_name)
                 delete_time = time.time() - start_delete_time
                 
                 # Step 3: 插入新数据
                 start_insert_time = time.time()
-                inserted_rows = await upsert_data(table_name, data)
+                inserted_rows = await upsert_data(table_name, data, writer)
                 insert_time = time.time() - start_insert_time
                 
                 if inserted_rows > 0:
@@ -465,11 +1432,26 @@ async def sync_small_table(table_name, query, semaphore):
                               f"数据删除: {delete_time:.2f} 秒 ({(delete_time/total_time*100):.1f}%), "
                               f"数据插入: {insert_time:.2f} 秒 ({(insert_time/total_time*100):.1f}%)), "
                               f"总查询到的行数: {row_count} 行, 同步的行数: {inserted_rows} 行")
+                    if inserted_rows >= row_count:
+                        await save_watermark(table_name, max_row_id(data))
                 else:
                     logger.info(f"查询用时: {query_time:.2f} 秒, 总查询到的行数: {row_count}, 但是同步数据没有成功 {table_name}")
                     return False
             else:
                 logger.info(f"查询用时: {query_time:.2f} 秒, 总查询到的行数: {row_count}, 没有数据需要同步, {table_name} 处理完成")
+                await save_watermark(table_name)
+
+            # Step 4: 检测源库中已物理删除的行(id_diff方式), 每次比较全部主键, 不受水位线影响
+            if strategy == 'id_diff':
+                start_detect_time = time.time()
+                try:
+                    stats = await deletion_detector.sync_deletions(table_name)
+                except Exception as e:
+                    logger.error(f"{table_name} 删除检测失败: {e}")
+                    return False
+                logger.info(f"{table_name} 删除检测完成, 耗时: {time.time() - start_detect_time:.2f} 秒, "
+                            f"源库 {stats['source_rows']} 行, 个人数据库 {stats['target_rows']} 行, "
+                            f"删除 {stats['deleted_rows']} 行, 个人数据库缺少 {stats['missing_rows']} 行")
 
         except aiomysql.MySQLError as e:
             logger.error(f"处理 {table_name} 时发生 MySQL 错误信息: {e}")
@@ -479,21 +1461,254 @@ async def sync_small_table(table_name, query, semaphore):
             return False
         return True
 
+# refresh_full_table(shadow方式)_step1: 创建影子表并暂时去掉普通二级索引
+async def prepare_shadow_table(table_name):
+    """
+    按原表结构创建影子表{table}__new, 去掉普通二级索引(KEY/FULLTEXT/SPATIAL)以加快写入, 主键和唯一索引保留
+    :param table_name: 表名
+    :return: (影子表名, 被去掉的索引定义列表)
+    """
+    shadow_table = f"{table_name}__new"
+    conn = await get_personal_connection()
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"DROP TABLE IF EXISTS {shadow_table}")
+            await cursor.execute(f"CREATE TABLE {shadow_table} LIKE {table_name}")
+            await cursor.execute(f"SHOW CREATE TABLE {shadow_table}")
+            create_sql = (await cursor.fetchone())['Create Table']
+            index_definitions = [
+                line.strip().rstrip(',') for line in create_sql.splitlines()
+                if re.match(r'\s*(FULLTEXT |SPATIAL )?KEY `', line)
+            ]
+            if index_definitions:
+                drops = ', '.join(
+                    f"DROP INDEX `{re.search(r'KEY `([^`]+)`', definition).group(1)}`" for definition in index_definitions)
+                await cursor.execute(f"ALTER TABLE {shadow_table} {drops}")
+    finally:
+        await db_manager.release_connection('myDB_Alicloud', conn)
+    logger.info(f"已创建影子表 {shadow_table}, 延后创建的二级索引: {len(index_definitions)} 个")
+    return shadow_table, index_definitions
+
+# refresh_full_table(shadow方式)_step4: 恢复二级索引并原子切换
+async def swap_shadow_table(table_name, shadow_table, index_definitions):
+    """
+    在影子表上一次性创建延后的二级索引, 然后用一条 RENAME TABLE 原子地替换原表, 最后删除旧表
+    :param table_name: 表名
+    :param shadow_table: 影子表名
+    :param index_definitions: 延后创建的索引定义列表
+    """
+    old_table = f"{table_name}__old"
+    conn = await get_personal_connection()
+    try:
+        async with conn.cursor() as cursor:
+            if index_definitions:
+                await cursor.execute(
+                    f"ALTER TABLE {shadow_table} {', '.join(f'ADD {definition}' for definition in index_definitions)}")
+            await cursor.execute(f"DROP TABLE IF EXISTS {old_table}")
+            await cursor.execute(f"RENAME TABLE {table_name} TO {old_table}, {shadow_table} TO {table_name}")
+            await cursor.execute(f"DROP TABLE IF EXISTS {old_table}")
+    finally:
+        await db_manager.release_connection('myDB_Alicloud', conn)
+
+# refresh_full_table(shadow方式): 刷新失败时删除影子表, 原表保持不变
+async def drop_shadow_table(shadow_table):
+    """
+    删除未完成切换的影子表
+    :param shadow_table: 影子表名
+    """
+    conn = None
+    try:
+        conn = await get_personal_connection()
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"DROP TABLE IF EXISTS {shadow_table}")
+    except Exception as e:
+        logger.error(f"删除影子表 {shadow_table} 时发生错误信息: {e}")
+    finally:
+        if conn:
+            await db_manager.release_connection('myDB_Alicloud', conn)
+
+# refresh_full_table(diff方式)_step1: 构建源库和个人数据库通用的查询
+def build_diff_queries(table_name, query, columns):
+    """
+    源库使用全量查询作为派生表, 个人数据库直接查询同名列, 两边计算校验和的表达式完全相同
+    :param table_name: 表名
+    :param query: 全量查询语句
+    :param columns: 全量查询返回的列名
+    :return: (源库派生表, 个人数据库派生表, 单行校验和表达式)
+    """
+    column_list = ', '.join(f'`{col}`' for col in columns)
+    source_table = f"({query.strip().rstrip(';')}) AS diff_source"
+    target_table = f"(SELECT {column_list} FROM {table_name}) AS diff_target"
+    # NULL替换为CHAR(0), 避免CONCAT_WS跳过NULL导致不同的行得到相同的文本
+    row_checksum = f"CRC32(CONCAT_WS('#', {', '.join(f'IFNULL(`{col}`, CHAR(0))' for col in columns)}))"
+    return source_table, target_table, row_checksum
+
+# refresh_full_table(diff方式)_step2: 按id分桶计算校验和
+async def fetch_range_checksums(env, diff_table, row_checksum, lo, hi, step):
+    """
+    把 [lo, hi] 按step拆分为多个桶, 计算每个桶的行数和 BIT_XOR(CRC32(...)) 校验和
+    :param env: 环境名称
+    :param diff_table: build_diff_queries返回的派生表
+    :param row_checksum: 单行校验和表达式
+    :param lo: 区间下界(包含)
+    :param hi: 区间上界(包含)
+    :param step: 每个桶的id跨度
+    :return: {桶序号: (行数, 校验和)}
+    """
+    checksum_query = (
+        f"SELECT FLOOR((`id` - {lo}) / {step}) AS bucket, COUNT(*) AS row_count, BIT_XOR({row_checksum}) AS checksum "
+        f"FROM {diff_table} WHERE `id` BETWEEN {lo} AND {hi} GROUP BY bucket"
+    )
+    limiter = source_limiter if env == 'zcwDB_Alicloud' else target_limiter
+    async with limiter.slot():
+        async with db_manager.connection(env) as conn:
+            result = await db_manager.fetch_all(conn, checksum_query, row_format='tuple')
+    return {int(bucket): (row_count, int(checksum)) for bucket, row_count, checksum in result.rows}
+
+# refresh_full_table(diff方式)_step3: 逐层拆分校验和不一致的区间
+async def find_changed_ranges(source_table, target_table, row_checksum, lo, hi):
+    """
+    从 [lo, hi] 开始, 每层把区间拆分为diff_fanout个桶, 只继续拆分校验和不一致的桶,
+    直到桶内行数不超过diff_leaf_rows
+    :param source_table: 源库派生表
+    :param target_table: 个人数据库派生表
+    :param row_checksum: 单行校验和表达式
+    :param lo: id下界
+    :param hi: id上界
+    :return: 需要重新同步的id区间列表[(lo, hi)]
+    """
+    ranges = [(lo, hi)]
+    changed_ranges = []
+    while ranges:
+        next_ranges = []
+        for range_lo, range_hi in ranges:
+            step = max(1, -(-(range_hi - range_lo + 1) // diff_fanout))
+            source_buckets, target_buckets = await asyncio.gather(
+                fetch_range_checksums('zcwDB_Alicloud', source_table, row_checksum, range_lo, range_hi, step),
+                fetch_range_checksums('myDB_Alicloud', target_table, row_checksum, range_lo, range_hi, step))
+            for bucket in sorted(set(source_buckets) | set(target_buckets)):
+                source_state = source_buckets.get(bucket, (0, 0))
+                target_state = target_buckets.get(bucket, (0, 0))
+                if source_state == target_state:
+                    continue
+                bucket_lo = range_lo + bucket * step
+                bucket_hi = min(range_hi, bucket_lo + step - 1)
+                if step == 1 or max(source_state[0], target_state[0]) <= diff_leaf_rows:
+                    changed_ranges.append((bucket_lo, bucket_hi))
+                else:
+                    next_ranges.append((bucket_lo, bucket_hi))
+        ranges = next_ranges
+    return changed_ranges
+
+# refresh_full_table(diff方式): 只同步校验和不一致的id区间
+async def diff_full_table(table_name, query, semaphore, writer=default_writer):
+    """
+    比较源库和个人数据库按id区间的校验和, 只重新同步不一致的区间(先删除个人数据库区间内的行, 再写入源库的行),
+    新增、修改和删除的行都会同步, 网络和写入量与变化的行数成正比; 可以重复执行, 失败时下次运行会重新比较
+    :param table_name: 表名
+    :param query: 全量查询语句
+    :param semaphore: 表级并发控制
+    :param writer: 写入方式
+    :return: 是否同步成功
+    """
+    async with semaphore:
+        try:
+            total_start_time = time.time()
+            logger.info(f"开始全量刷新表: {table_name}, 刷新方式: diff")
+
+            # Step 1: 获取列名和两边的id范围
+            start_diff_time = time.time()
+            async with db_manager.connection('zcwDB_Alicloud') as conn:
+                columns = (await db_manager.fetch_all(
+                    conn, f"SELECT * FROM ({query.strip().rstrip(';')}) AS diff_source LIMIT 0", row_format='tuple')).columns
+            source_table, target_table, row_checksum = build_diff_queries(table_name, query, columns)
+            bounds = []
+            for env, diff_table in (('zcwDB_Alicloud', source_table), ('myDB_Alicloud', target_table)):
+                async with db_manager.connection(env) as conn:
+                    result = await db_manager.fetch_all(
+                        conn, f"SELECT MIN(`id`), MAX(`id`) FROM {diff_table}", row_format='tuple')
+                bounds.extend(value for value in result.rows[0] if value is not None)
+
+            # Step 2: 逐层比较校验和, 找出不一致的id区间
+            changed_ranges = []
+            if bounds:
+                changed_ranges = await find_changed_ranges(source_table, target_table, row_checksum, min(bounds), max(bounds))
+            diff_time = time.time() - start_diff_time
+            logger.info(f"{table_name} 校验和不一致的id区间: {len(changed_ranges)} 个")
+
+            # Step 3: 逐个区间获取源库数据, 删除个人数据库区间内的行后写入
+            query_time = 0.0
+            insert_time = 0.0
+            total_fetched = 0
+            total_inserted = 0
+            total_deleted = 0
+            for range_lo, range_hi in changed_ranges:
+                start_query_time = time.time()
+                async with source_limiter.slot():
+                    async with db_manager.connection('zcwDB_Alicloud') as conn:
+                        data = await db_manager.fetch_all(
+                            conn, f"SELECT * FROM {source_table} WHERE `id` BETWEEN {range_lo} AND {range_hi}")
+                query_time += time.time() - start_query_time
+                total_fetched += len(data)
+
+                start_insert_time = time.time()
+                # 删除与插入在同一个事务中, 插入失败时回滚, 区间保持原来的数据
+                async with target_limiter.slot():
+                    async with db_manager.connection('myDB_Alicloud') as conn2:
+                        try:
+                            await conn2.begin()
+                            async with conn2.cursor() as cursor:
+                                await cursor.execute(
+                                    f"DELETE FROM {table_name} WHERE `id` BETWEEN %s AND %s", (range_lo, range_hi))
+                                deleted_rows = cursor.rowcount
+                            if data:
+                                await write_rows(conn2, table_name, data, writer)  # 写入完成后提交事务
+                            else:
+                                await conn2.commit()
+                        except Exception:
+                            await conn2.rollback()
+                            raise
+                        total_deleted += deleted_rows
+                insert_time += time.time() - start_insert_time
+                total_inserted += len(data)
+            total_time = time.time() - total_start_time
+
+            logger.info(f"{table_name} 全量刷新完成, 总耗时: {total_time:.2f} 秒 "
+                       f"(其中校验和比较: {diff_time:.2f} 秒 ({(diff_time/total_time*100):.1f}%), "
+                       f"数据查询: {query_time:.2f} 秒 ({(query_time/total_time*100):.1f}%), "
+                       f"数据删除与插入: {insert_time:.2f} 秒 ({(insert_time/total_time*100):.1f}%)), "
+                       f"不一致的区间: {len(changed_ranges)} 个, 总查询到的行数: {total_fetched} 行, "
+                       f"删除的行数: {total_deleted} 行, 插入的行数: {total_inserted} 行")
+            return True
+
+        except Exception as e:
+            logger.error(f"全量刷新 {table_name} 时发生未捕获的错误信息: {e}")
+            return False
+
 # refresh_full_table: 处理全表刷新任务
-async def refresh_full_table(table_name, query, semaphore):
+async def refresh_full_table(table_name, query, semaphore, writer=default_writer, strategy=default_refresh_strategy):
+    if strategy == 'diff':
+        return await diff_full_table(table_name, query, semaphore, writer)
     async with semaphore:
+        shadow_table = None
+        swapped = False
         try:
             total_start_time = time.time()  # 记录整个同步过程的开始时间
-            logger.info(f"开始全量刷新表: {table_name}")
+            logger.info(f"开始全量刷新表: {table_name}, 刷新方式: {strategy}")
 
-            # Step 1: 在目标数据库中使用 TRUNCATE TABLE 清空表
+            # Step 1: shadow方式创建影子表, 数据写入影子表; truncate方式在目标数据库中使用 TRUNCATE TABLE 清空表
             start_delete_time = time.time()
-            conn2 = await get_personal_connection()
-            async with conn2.cursor() as cursor:
-                await cursor.execute(f"TRUNCATE TABLE {table_name};")
-            await db_manager.release_connection('myDB_Alicloud', conn2)
+            if strategy == 'shadow':
+                shadow_table, index_definitions = await prepare_shadow_table(table_name)
+                target_table = shadow_table
+            else:
+                conn2 = await get_personal_connection()
+                async with conn2.cursor() as cursor:
+                    await cursor.execute(f"TRUNCATE TABLE {table_name};")
+                await db_manager.release_connection('myDB_Alicloud', conn2)
+                target_table = table_name
+                logger.info(f"已清空 {table_name} 表的数据")
             delete_time = time.time() - start_delete_time
-            logger.info(f"已清空 {table_name} 表的数据")
 
             # Step 2: 从源数据库中获取所有数据
             retries = 0
@@ -504,11 +1719,9 @@ async def refresh_full_table(table_name, query, semaphore):
                 conn1 = None
                 try:
                     conn1 = await get_company_connection()
-                    async with conn1.cursor() as cursor:
-                        # 不需要执行时间范围的设置
-                        await cursor.execute(query)
-                        data = await cursor.fetchall()
-                        row_count = len(data)
+                    # 不需要执行时间范围的设置
+                    data = await db_manager.fetch_all(conn1, query)
+                    row_count = len(data)
                     query_time = time.time() - start_query_time
                     break
                 except aiomysql.MySQLError as e:
@@ -529,33 +1742,28 @@ async def refresh_full_table(table_name, query, semaphore):
 
             if not data:
                 logger.info(f"未获取到任何数据, 跳过插入 {table_name}")
-                return True
+                if not shadow_table:
+                    return True
 
-            # Step 3: 将数据插入目标数据库
+            # Step 3: 将数据插入目标数据库, 批次大小按字节预算和吞吐量自适应
             total_inserted = 0
-            batch_size = 10000  # 根据需要调整批次大小
-            data_length = len(data)
+            sizer = batch_sizers.get(table_name)
             start_insert_time = time.time()  # 开始插入的时间
-            for i in range(0, data_length, batch_size):
-                batch_data = data[i:i + batch_size]
+            for batch_data in sizer.iter_batches(data):
                 insert_retries = 0
                 while insert_retries <= max_retries:
                     conn2 = None
                     try:
-                        conn2 = await get_personal_connection()
-                        async with conn2.cursor() as cursor:
-                            columns = ', '.join(batch_data[0].keys())
-                            placeholders = ', '.join(['%s'] * len(batch_data[0]))
-                            insert_query = f"""
-                            INSERT INTO {table_name} ({columns})
-                            VALUES ({placeholders})
-                            """
-                            await cursor.executemany(insert_query, [tuple(row.values()) for row in batch_data])
-                        await conn2.commit()
+                        async with target_limiter.slot():
+                            conn2 = await get_personal_connection()
+                            batch_start_time = time.time()
+                            await write_rows(conn2, target_table, batch_data, writer)
+                            sizer.record(len(batch_data), time.time() - batch_start_time)
                         total_inserted += len(batch_data)
                         break
                     except aiomysql.MySQLError as e:
                         logger.error(f"插入 {table_name} 时发生 MySQL 错误信息: {e}")
+                        sizer.record_failure()
                         insert_retries += 1
                         if insert_retries > max_retries:
                             logger.error(f"超过最大重试次数, 放弃插入 {table_name}")
@@ -570,21 +1778,363 @@ async def refresh_full_table(table_name, query, semaphore):
                         if conn2:
                             await db_manager.release_connection('myDB_Alicloud', conn2)
             insert_time = time.time() - start_insert_time  # 插入数据所用的时间
+
+            # Step 4: shadow方式恢复二级索引后原子切换
+            swap_time = 0.0
+            if shadow_table:
+                start_swap_time = time.time()
+                await swap_shadow_table(table_name, shadow_table, index_definitions)
+                swapped = True
+                swap_time = time.time() - start_swap_time
             total_time = time.time() - total_start_time
 
             logger.info(f"{table_name} 全量刷新完成, 总耗时: {total_time:.2f} 秒 "
                        f"(其中数据删除: {delete_time:.2f} 秒 ({(delete_time/total_time*100):.1f}%), "
                        f"数据查询: {query_time:.2f} 秒 ({(query_time/total_time*100):.1f}%), "
-                       f"数据插入: {insert_time:.2f} 秒 ({(insert_time/total_time*100):.1f}%)), "
-                       f"总查询到的行数: {data_length} 行, 插入的行数: {total_inserted} 行")
+                       f"数据插入: {insert_time:.2f} 秒 ({(insert_time/total_time*100):.1f}%), "
+                       f"索引与切换: {swap_time:.2f} 秒 ({(swap_time/total_time*100):.1f}%)), "
+                       f"总查询到的行数: {len(data)} 行, 插入的行数: {total_inserted} 行")
             return True
 
         except Exception as e:
             logger.error(f"全量刷新 {table_name} 时发生未捕获的错误信息: {e}")
             return False
+        finally:
+            # 刷新失败时删除影子表, 原表保持刷新前的数据
+            if shadow_table and not swapped:
+                await drop_shadow_table(shadow_table)
+
+# 执行计划_step1: 估算表本次需要处理的行数
+async def estimate_table_rows(table_name, table_type):
+    """
+    估算表本次需要处理的行数: full_refresh表使用information_schema中的表行数,
+    其他表使用 EXPLAIN 估算同步区间内updatedAt有变化的行数(只读取优化器统计信息, 不扫描数据)
+    :param table_name: 表名
+    :param table_type: 表类型, large_table/small_table/full_refresh
+    :return: 预计行数, 估算失败时为None
+    """
+    try:
+        async with source_limiter.slot():
+            async with db_manager.connection('zcwDB_Alicloud') as conn:
+                if table_type == 'full_refresh':
+                    result = await db_manager.fetch_all(
+                        conn, "SELECT `TABLE_ROWS` FROM information_schema.TABLES WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = %s",
+                        (table_name,), row_format='tuple')
+                    return int(result.rows[0][0] or 0) if result.rows else None
+                params = dict(await load_session_vars(conn))
+                params.update(get_window_params(table_name))
+                result = await db_manager.fetch_all(
+                    conn, f"EXPLAIN SELECT `id` FROM {table_name} WHERE `updatedAt` BETWEEN %s AND %s",
+                    (params['start_date'], params['end_date']), row_format='tuple')
+                rows_index = result.column_index('rows')
+                return sum(int(row[rows_index] or 0) for row in result.rows)
+    except Exception as e:
+        logger.error(f"估算 {table_name} 的行数失败: {e}")
+        return None
+
+# 执行计划_step2: 按预计耗时从长到短安排表的开始顺序
+async def plan_tables(table_types):
+    """
+    估算每张表的行数和耗时, 按LPT规则分配到table_concurrency个并发名额上并输出预计的执行时间线
+    :param table_types: {表名: 表类型}
+    :return: 按计划开始顺序排列的表名列表
+    """
+    sync_history.load()
+    estimates = await asyncio.gather(*[estimate_table_rows(table, table_type) for table, table_type in table_types.items()])
+    table_estimates.update(zip(table_types, estimates))
+    costs = {table: sync_history.estimate(table, table_estimates[table], default_rows_per_second) for table in table_types}
+    schedule = lpt_schedule(costs, table_concurrency)
+    for table, slot, start, end in schedule:
+        estimated_rows = table_estimates[table]
+        logger.info(f"执行计划: 并发名额 {slot + 1}, {table} ({table_types[table]}), "
+                    f"预计行数: {estimated_rows if estimated_rows is not None else '未知'}, "
+                    f"预计耗时: {end - start:.1f} 秒, 预计开始: {start:.1f} 秒, 预计结束: {end:.1f} 秒")
+    makespan = max((end for _, _, _, end in schedule), default=0.0)
+    logger.info(f"执行计划: 共 {len(schedule)} 张表, 并发 {table_concurrency}, 预计总时长: {makespan:.1f} 秒")
+    return [table for table, _, _, _ in schedule]
+
+# 动态查找项目根目录
+def find_project_root(root_name='Python'):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        if os.path.basename(current_dir) == root_name:
+            return current_dir
+        new_dir = os.path.dirname(current_dir)
+        if new_dir == current_dir:
+            raise RuntimeError(f"无法找到包含目录 '{root_name}' 的项目根目录")
+        current_dir = new_dir
+
+# 加载yaml配置
+def load_query_config():
+    project_root = find_project_root()
+    config_path = os.path.join(project_root, 'auto_scripts', 'sql', 'config', 'daily_database_query.yaml')
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"未找到配置文件: {config_path}")
+    with open(config_path, 'r', encoding='utf-8') as f:
+        configs = yaml.safe_load(f)
+    return configs['daily_database_query']
+
+# 整理每张表的同步参数
+def build_table_jobs(query_configs):
+    """
+    按yaml配置整理每张表的同步参数, 结果只包含字典和字符串, 可以直接传给worker进程
+    :param query_configs: yaml中daily_database_query的配置
+    :return: {表名: {'type': 表类型, 'config': 大表配置或查询语句, 'writer': 写入方式, 'refresh_strategy': 刷新方式,
+              'upsert_strategy': 小表同步方式}}
+    """
+    table_jobs = {}
+    for table, conf in query_configs.items():
+        table_type = conf.get('type')
+        if table_type == 'large_table':
+            # 整个分区重新加载时, row_filter中按同步区间筛选掉的行会随交换被删除
+            if conf.get('partition_exchange') and re.search(r'@(start_date|end_date|filter_date)\b', conf.get('row_filter') or ''):
+                raise ValueError(f"{table} 的row_filter引用了同步区间参数, 不能配置partition_exchange")
+            table_config = {
+                'date_query': conf['queries']['date_query'],
+                'data_query_template': conf['queries']['data_query'],
+                'chunking': conf.get('chunking', {}),
+                'row_filter': conf.get('row_filter'),
+                'writer': conf.get('writer', default_writer),
+                'sync_mode': conf.get('sync_mode', 'day'),
+                'partition_exchange': conf.get('partition_exchange'),
+                'resync_strategy': conf.get('resync_strategy', default_resync_strategy)
+            }
+        elif table_type in ('small_table', 'full_refresh'):
+            table_config = conf['query']
+        else:
+            continue
+        table_jobs[table] = {
+            'type': table_type,
+            'config': table_config,
+            'writer': conf.get('writer', default_writer),
+            'refresh_strategy': conf.get('refresh_strategy', default_refresh_strategy),
+            'upsert_strategy': conf.get('upsert_strategy', default_upsert_strategy)
+        }
+    return table_jobs
+
+# 按表类型同步单张表或大表的一个日期分片
+async def sync_table(table_name, table_job, table_slot, shard_key=None):
+    """
+    按表类型调用对应的同步函数, 成功时在运行断点中记录表已完成(大表在sync_large_table内部按日期记录)
+    :param table_name: 表名
+    :param table_job: build_table_jobs中该表的同步参数
+    :param table_slot: 表级并发名额
+    :param shard_key: 大表日期分片名称, 不分片时为None
+    :return: 是否同步成功
+    """
+    table_type = table_job['type']
+    if table_type == 'large_table':
+        return await sync_large_table(table_name, table_job['config'], table_slot, shard_key)
+    if table_type == 'small_table':
+        synced = await sync_small_table(
+            table_name, table_job['config'], table_slot, table_job['writer'], table_job['upsert_strategy'])
+    else:
+        synced = await refresh_full_table(
+            table_name, table_job['config'], table_slot, table_job['writer'], table_job['refresh_strategy'])
+    if synced:
+        run_checkpoint.mark_table_done(table_name)
+    return synced
+
+# 多进程分片执行_step1: 把耗时长的大表按连续日期拆分为分片
+async def shard_large_table(table_name, table_config, shard_count):
+    """
+    按连续日期把大表拆分为最多shard_count个分片, 每个分片至少shard_min_dates个日期, 分片记录在运行断点中,
+    --resume时沿用上次的分片. 只拆分按日期同步且没有配置分区交换的大表(分区交换需要整个分区在同一个进程中处理)
+    :param table_name: 表名
+    :param table_config: 大表配置
+    :param shard_count: 最多拆分的分片数
+    :return: 分片名称列表, 不拆分时为空列表
+    """
+    shard_keys = run_checkpoint.table_shards(table_name)
+    if shard_keys:
+        return shard_keys
+    if table_config.get('sync_mode') == 'delta' or table_config.get('partition_exchange') \
+            or run_checkpoint.table_state(table_name):
+        return []
+    try:
+        conn = await get_company_connection()
+        dates = sorted(await fetch_dates_with_updates(conn, table_config['date_query'], table_name))
+    except Exception as e:
+        logger.error(f"{table_name} 拆分分片前查询日期失败, 整张表由一个进程处理: {e}")
+        return []
+
+    shard_count = min(shard_count, len(dates) // shard_min_dates)
+    if shard_count < 2:
+        # 记录已经查询到的日期, worker进程直接使用, 不再重复查询
+        run_checkpoint.start_table(table_name, dates)
+        return []
+    shard_size = math.ceil(len(dates) / shard_count)
+    date_groups = [dates[i:i + shard_size] for i in range(0, len(dates), shard_size)]
+    shard_keys = run_checkpoint.shard_table(table_name, date_groups)
+    for shard_key, shard_dates in zip(shard_keys, date_groups):
+        logger.info(f"{table_name} 分片 {shard_key}: {shard_dates[0]} 至 {shard_dates[-1]}, 共 {len(shard_dates)} 个日期")
+    return shard_keys
+
+# 多进程分片执行_step2: worker进程中同步分配到的表和分片
+async def worker_main(worker_index, units, table_jobs, checkpoint_tables, shared_session_vars, watermarks, events):
+    """
+    worker进程的主函数, 使用主进程的同步日期区间和水位线, 保证所有进程同步同一个区间
+    :param worker_index: worker序号
+    :param units: 按计划顺序排列的 (表名, 分片名称) 列表, 不分片的表分片名称为None
+    :param table_jobs: 这些表的同步参数
+    :param checkpoint_tables: 主进程中这些表和分片的进度
+    :param shared_session_vars: 主进程的@start_date/@end_date/@filter_date
+    :param watermarks: 主进程读取的水位线
+    :param events: 发送进度给主进程的队列
+    :return: {'results': {名称: (是否成功, 耗时秒数)}, 'summaries': 统计描述列表, 'batch_sizes': 学习到的批次行数}
+    """
+    global run_checkpoint
+    run_checkpoint = RelayCheckpoint(checkpoint_tables, events.put)
+    session_vars.update(shared_session_vars)
+    table_watermarks.update(watermarks)
+    batch_sizers.load()
+    logger.info(f"worker {worker_index} 开始处理: {', '.join(shard_key or table for table, shard_key in units)}")
+
+    semaphore = asyncio.Semaphore(table_concurrency)
+    table_slot = contextlib.nullcontext()
+    results = {}
+
+    async def run_unit(table_name, shard_key):
+        async with semaphore:
+            unit_start_time = time.time()
+            try:
+                synced = await sync_table(table_name, table_jobs[table_name], table_slot, shard_key)
+            except Exception as e:
+                logger.error(f"worker {worker_index} 处理 {shard_key or table_name} 时发生错误信息: {e}")
+                synced = False
+            results[shard_key or table_name] = (synced, time.time() - unit_start_time)
+
+    try:
+        await asyncio.gather(*[run_unit(table, shard_key) for table, shard_key in units])
+    finally:
+        db_manager.log_pool_stats()
+        await db_manager.close_all()
+    return {
+        'results': results,
+        'summaries': [limiter.summary() for limiter in (source_limiter, target_limiter)] + batch_sizers.summaries(),
+        'batch_sizes': {name: sizer.learned_rows for name, sizer in batch_sizers.sizers.items() if sizer.stats['batches']}
+    }
+
+# worker进程入口
+def run_worker(worker_index, units, table_jobs, checkpoint_tables, shared_session_vars, watermarks, events):
+    """在worker进程中创建独立的事件循环运行worker_main, 参数与返回值见worker_main"""
+    return asyncio.run(worker_main(worker_index, units, table_jobs, checkpoint_tables, shared_session_vars, watermarks, events))
+
+# 多进程分片执行_step3: 合并worker进程发送的进度
+async def relay_checkpoint_events(events):
+    """
+    把worker进程发送的进度合并到主进程的运行断点, 收到None时结束
+    :param events: worker进程发送进度的队列
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        tables = await loop.run_in_executor(None, events.get)
+        if tables is None:
+            return
+        run_checkpoint.merge_tables(tables)
+
+# 多进程分片执行: 分配表和分片到worker进程并汇总结果
+async def run_sharded_tables(tables, table_jobs, workers):
+    """
+    把表(和耗时长的大表的日期分片)按预计耗时(LPT)分配到workers个进程, 等待所有进程结束后汇总结果:
+    记录执行计划历史和批次大小, 所有分片都完成的大表推进水位线
+    :param tables: 按计划顺序排列的待同步表名
+    :param table_jobs: 表的同步参数
+    :param workers: worker进程数
+    :return: 处理失败的表名列表
+    """
+    costs = {table: sync_history.estimate(table, table_estimates.get(table), default_rows_per_second) for table in tables}
+    target_cost = sum(costs.values()) / workers
+    units = {}  # 名称: (表名, 分片名称)
+    unit_costs = {}
+    sharded_tables = {}  # 表名: 分片名称列表
+    for table in tables:
+        shard_keys = []
+        if table_jobs[table]['type'] == 'large_table' and target_cost > 0 and costs[table] > target_cost:
+            shard_keys = await shard_large_table(table, table_jobs[table]['config'],
+                                                 min(workers, math.ceil(costs[table] / target_cost)))
+        if not shard_keys:
+            units[table] = (table, None)
+            unit_costs[table] = costs[table]
+            continue
+        sharded_tables[table] = shard_keys
+        total_dates = max(1, sum(len(run_checkpoint.table_state(key)['dates']) for key in shard_keys))
+        for shard_key in shard_keys:
+            if run_checkpoint.is_table_done(shard_key):
+                logger.info(f"{shard_key} 在上次运行中已完成, 跳过")
+                continue
+            units[shard_key] = (table, shard_key)
+            unit_costs[shard_key] = costs[table] * len(run_checkpoint.table_state(shard_key)['dates']) / total_dates
+
+    # 按预计耗时从长到短分配到worker进程, 每个进程内按分配顺序开始
+    worker_units = [[] for _ in range(workers)]
+    worker_costs = [0.0] * workers
+    for key, slot, start, end in lpt_schedule(unit_costs, workers):
+        worker_units[slot].append(units[key])
+        worker_costs[slot] = max(worker_costs[slot], end)
+    for index, assigned in enumerate(worker_units):
+        logger.info(f"分片计划: worker {index + 1}, 预计耗时: {worker_costs[index]:.1f} 秒, "
+                    f"处理: {', '.join(shard_key or table for table, shard_key in assigned) or '无'}")
+
+    loop = asyncio.get_running_loop()
+    # 使用spawn启动worker进程, 不继承主进程已经建立的连接池和事件循环
+    mp_context = multiprocessing.get_context('spawn')
+    worker_futures = {}
+    with mp_context.Manager() as manager, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        events = manager.Queue()
+        relay_task = asyncio.create_task(relay_checkpoint_events(events))
+        for index, assigned in enumerate(worker_units):
+            if not assigned:
+                continue
+            unit_keys = [shard_key or table for table, shard_key in assigned]
+            checkpoint_tables = {key: run_checkpoint.table_state(key) for key in unit_keys if run_checkpoint.table_state(key)}
+            assigned_jobs = {table: table_jobs[table] for table, _ in assigned}
+            worker_futures[index + 1] = loop.run_in_executor(
+                executor, run_worker, index + 1, assigned, assigned_jobs, checkpoint_tables,
+                dict(session_vars), dict(table_watermarks), events)
+        worker_results = await asyncio.gather(*worker_futures.values(), return_exceptions=True)
+        events.put(None)
+        await relay_task
+
+    # 汇总各worker进程的结果
+    unit_results = {}
+    for worker_index, result in zip(worker_futures, worker_results):
+        if isinstance(result, Exception):
+            logger.error(f"worker {worker_index} 运行失败: {result}")
+            continue
+        unit_results.update(result['results'])
+        for summary in result['summaries']:
+            logger.info(f"worker {worker_index} {summary}")
+        batch_sizers.learned.update(result['batch_sizes'])
+
+    failed_tables = []
+    for table in tables:
+        if table in sharded_tables:
+            shard_keys = sharded_tables[table]
+            # 上次运行中已完成的分片没有本次的结果, 以运行断点为准
+            if not all(run_checkpoint.is_table_done(key) for key in shard_keys):
+                failed_tables.append(table)
+                continue
+            await save_watermark(table)
+            run_checkpoint.mark_table_done(table)
+            seconds = sum(unit_results.get(key, (True, 0.0))[1] for key in shard_keys)
+            sync_history.record(table, seconds, table_estimates.get(table))
+            continue
+        synced, seconds = unit_results.get(table, (False, 0.0))
+        if synced:
+            sync_history.record(table, seconds, table_estimates.get(table))
+        else:
+            failed_tables.append(table)
+    return failed_tables
 
 # 主函数
-async def main():
+async def main(resume=False, plan_only=False, workers=1):
+    """
+    :param resume: 是否从上次中断的运行继续, 跳过已完成的表和日期
+    :param plan_only: 只输出执行计划, 不同步数据
+    :param workers: worker进程数, 大于1时按多进程分片执行
+    """
     start_time = time.time()
     
     # 计算同步的日期区间
@@ -595,97 +2145,96 @@ async def main():
     logger.info("开始同步数据...")
     logger.info(f"同步日期区间: {start_date.strftime('%Y-%m-%d %H:%M:%S')} 至 {end_date.strftime('%Y-%m-%d %H:%M:%S')}")
 
-    # 动态查找项目根目录
-    def find_project_root(root_name='Python'):
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        while True:
-            if os.path.basename(current_dir) == root_name:
-                return current_dir
-            new_dir = os.path.dirname(current_dir)
-            if new_dir == current_dir:
-                raise RuntimeError(f"无法找到包含目录 '{root_name}' 的项目根目录")
-            current_dir = new_dir
-
-    # 加载yaml配置
-    def load_query_config():
-        project_root = find_project_root()
-        config_path = os.path.join(project_root, 'auto_scripts', 'sql', 'config', 'daily_database_query.yaml')
-        if not os.path.exists(config_path):
-            raise FileNotFoundError(f"未找到配置文件: {config_path}")
-        with open(config_path, 'r', encoding='utf-8') as f:
-            configs = yaml.safe_load(f)
-        return configs['daily_database_query']
-
-    query_configs = load_query_config()
-    queries_large_table = {}
-    queries_small_table = {}
-    queries_full_refresh_table = {}
-    for table, conf in query_configs.items():
-        if conf.get('type') == 'large_table':
-            queries_large_table[table] = {
-                'date_query': conf['queries']['date_query'],
-                'data_query_template': conf['queries']['data_query']
-            }
-        elif conf.get('type') == 'small_table':
-            queries_small_table[table] = conf['query']
-        elif conf.get('type') == 'full_refresh':
-            queries_full_refresh_table[table] = conf['query']
+    table_jobs = build_table_jobs(load_query_config())
+
+    # 并行创建公司数据库和个人数据库的连接池并预先建立连接, 避免连接建立出现在第一批查询的关键路径上
+    await db_manager.warm_up(['zcwDB_Alicloud', 'myDB_Alicloud'], min_connections=db_manager.max_concurrent)
+
+    # 读取各表上次同步成功的水位线, 读取失败时所有表使用固定日期区间
+    if use_watermark:
+        try:
+            table_watermarks.update(await watermark_store.load_all(watermark_job))
+            for table, watermark in sorted(table_watermarks.items()):
+                logger.info(f"{table} 水位线: {watermark['last_updated_at']}, 最大id: {watermark['max_id']}")
+        except Exception as e:
+            logger.error(f"读取水位线失败, 使用固定日期区间: {e}")
+
+    batch_sizers.load()
+
+    # 读取运行断点: 从断点继续时恢复上次运行的同步日期区间, 断点中的日期和推进的水位线属于同一个区间(即使跨过零点)
+    resumed = False
+    if resume and run_checkpoint.load():
+        checkpoint_vars = run_checkpoint.session_vars()
+        if checkpoint_vars:
+            session_vars.update(checkpoint_vars)
+            resumed = True
+            logger.info(f"从断点继续上次开始于 {run_checkpoint.started_at} 的运行, 同步日期区间: "
+                        f"{', '.join(f'{name}={value}' for name, value in sorted(checkpoint_vars.items()))}")
+        else:
+            logger.info("断点中没有记录同步日期区间, 开始新的运行")
+    elif resume:
+        logger.info("没有可以继续的断点, 开始新的运行")
+
+    # 估算每张表的耗时, 按耗时从长到短安排开始顺序
+    table_types = {table: job['type'] for table, job in table_jobs.items()}
+    planned_tables = await plan_tables(table_types)
+    if plan_only:
+        logger.info("只输出执行计划, 不同步数据")
+        await db_manager.close_all()
+        return
+
+    # 开始新的运行时重置断点, 并记录本次的同步日期区间供 --resume 使用
+    if not resumed:
+        if not session_vars:
+            async with db_manager.connection('zcwDB_Alicloud') as conn:
+                await load_session_vars(conn)
+        run_checkpoint.reset(session_vars)
+
+    def skip_done_table(table_name):
+        if run_checkpoint.is_table_done(table_name):
+            logger.info(f"{table_name} 在上次运行中已完成, 跳过")
+            return True
+        return False
 
     failed_steps = []
     error_count = 0
     max_errors = 5
-    
-    # 限制同时处理的表数量, 防止过多并发
-    semaphore = asyncio.Semaphore(1)
 
-    tasks = []
+    if workers > 1:
+        # 多进程分片执行, worker进程使用主进程的同步日期区间, 并发控制和批次统计在run_sharded_tables中输出
+        logger.info(f"使用 {workers} 个worker进程同步")
+        failed_steps = await run_sharded_tables(
+            [table for table in planned_tables if not skip_done_table(table)], table_jobs, workers)
+    else:
+        # 限制同时处理的表数量, 防止过多并发
+        semaphore = asyncio.Semaphore(table_concurrency)
+        # 表级并发名额由run_scheduled_table占用, 同步函数内部不再重复占用
+        table_slot = contextlib.nullcontext()
 
-    # 处理使用 sync_large_table 的表 - 优先处理problematic的大表
-    priority_tables = ['orderitems', 'deliveryreceiptitems']
-    
-    # 首先创建优先级表的任务
-    for table in priority_tables:
-        if table in queries_large_table:
-            config = queries_large_table[table]
-            task = asyncio.create_task(
-                sync_large_table(table, config['date_query'], config['data_query_template'], semaphore)
-            )
-            tasks.append(task)
-            logger.info(f"优先处理大表: {table}")
-    
-    # 然后创建其他大表的任务
-    for table, config in queries_large_table.items():
-        if table not in priority_tables:
-            task = asyncio.create_task(
-                sync_large_table(table, config['date_query'], config['data_query_template'], semaphore)
-            )
-            tasks.append(task)
-
-    # 处理使用 sync_small_table 的表
-    for table, query in queries_small_table.items():
-        task = asyncio.create_task(
-            sync_small_table(table, query, semaphore)
-        )
-        tasks.append(task)
-
-    # 处理使用 refresh_full_table 的表
-    for table, query in queries_full_refresh_table.items():
-        task = asyncio.create_task(
-            refresh_full_table(table, query, semaphore)
-        )
-        tasks.append(task)
-
-    # 等待所有任务完成
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-
-    # 检查结果
-    for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            logger.error(f"任务 {i} 发生错误信息: {result}")
-            error_count += 1
-            if error_count >= max_errors:
-                logger.error(f"错误次数达到最大限制, 停止处理")
-                break
+        async def run_scheduled_table(table_name):
+            # 按计划顺序创建任务, 信号量按等待顺序唤醒, 预计耗时长的表先开始
+            async with semaphore:
+                table_start_time = time.time()
+                synced = await sync_table(table_name, table_jobs[table_name], table_slot)
+                if synced:
+                    sync_history.record(table_name, time.time() - table_start_time, table_estimates.get(table_name))
+                else:
+                    failed_steps.append(table_name)
+                return synced
+
+        tasks = [asyncio.create_task(run_scheduled_table(table)) for table in planned_tables if not skip_done_table(table)]
+
+        # 等待所有任务完成
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        # 检查结果
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.error(f"任务 {i} 发生错误信息: {result}")
+                error_count += 1
+                if error_count >= max_errors:
+                    logger.error(f"错误次数达到最大限制, 停止处理")
+                    break
 
     end_time = time.time()
     total_time = end_time - start_time
@@ -695,8 +2244,33 @@ async def main():
     else:
         logger.info("所有表处理成功")
 
+    if workers <= 1:
+        # 输出自适应并发控制最终选择的并发上限
+        for limiter in (source_limiter, target_limiter):
+            logger.info(limiter.summary())
+
+        # 输出学习到的批次大小
+        for summary in batch_sizers.summaries():
+            logger.info(summary)
+    # 保存学习到的批次大小(多进程运行时为各worker进程汇总的结果)
+    try:
+        batch_sizers.save()
+    except OSError as e:
+        logger.error(f"保存批次大小失败: {e}")
+    # 保存本次各表的实际耗时, 供下次运行估算执行计划
+    try:
+        sync_history.save()
+    except OSError as e:
+        logger.error(f"保存执行计划历史失败: {e}")
+
     # 关闭所有连接池
+    db_manager.log_pool_stats()
     await db_manager.close_all()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='同步公司数据库到个人数据库')
+    parser.add_argument('--resume', action='store_true', help='从上次中断的运行继续, 跳过已完成的表和日期')
+    parser.add_argument('--plan', action='store_true', help='只输出预计的执行时间线, 不同步数据')
+    parser.add_argument('--workers', type=int, default=1, help='worker进程数, 大于1时把表和大表的日期分片分配到多个进程同步')
+    args = parser.parse_args()
+    asyncio.run(main(resume=args.resume, plan_only=args.plan, workers=max(1, args.workers)))
\ No newline at end of file
@@ -16,6 +16,16 @@ warnings.filterwarnings('ignore', message='.*VALUES function.*')
 days_offset = 0  # 0表示今天, 1表示昨天, 以此类推; 表示日期末位置
 days_interval = 1  # 1表示间隔1天, 2表示间隔2天, 以此类推; 表示日期始位置
 
+# 水位线配置: 开启后@start_date使用个人数据库sync_watermarks表中该表上次同步成功的@end_date,
+# 漏跑的日期在下次运行时一并同步; 没有水位线的表仍使用 end_date - days_interval
+use_watermark = True
+watermark_job = 'daily_dwh_sync'
+
+# 写入数仓的方式, 可在yaml中按表配置write_mode覆盖
+# executemany: 插入和更新分别按批次(大小由batch_sizers自适应)逐行执行 INSERT / INSERT ... ON CONFLICT
+# copy: 结果集通过COPY加载到临时暂存表, 再执行一条 INSERT ... SELECT ... ON CONFLICT DO UPDATE 合并到目标表
+write_mode = 'copy'
+
 # 动态获取当前脚本所在目录，并根据相对路径设置sys.path
 def load_sys_path():
     """动态查找项目根目录并将 config 目录添加到 sys.path"""
@@ -45,13 +55,26 @@ def load_sys_path():
 load_sys_path()
 from directory import SCRIPT_DIR
 from log_tools import setup_logger
-from db_conn import DBManager
+from db_conn import DBManager, RowBatch
+from query_compiler import QueryCompiler
+from watermark_store import WatermarkStore
+from batch_sizer import BatchSizerStore
 
 # 获取logger
 logger = setup_logger(__file__)
 
 # 初始化数据库管理器
-db_manager = DBManager(logger=logger, max_retry=3, connect_timeout=20, max_concurrent=5)
+# 个人数据库的查询结果使用RowBatch(列名一份+行元组), 行元组直接传给executemany/COPY, 不为每行构建字典
+db_manager = DBManager(logger=logger, max_retry=3, connect_timeout=20, max_concurrent=5, row_format='tuple')
+
+# 查询模板编译器, 把SQL文件中的@start_date/@end_date编译为参数化查询
+query_compiler = QueryCompiler()
+
+# 水位线存储, 水位线表位于个人数据库
+watermark_store = WatermarkStore(db_manager)
+
+# executemany方式的批次大小: 按估算字节数和实际吞吐量自适应调整, 学习到的行数供下次运行使用
+batch_sizers = BatchSizerStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'state', 'daily_dwh_sync_batch_sizes.json'))
 
 def find_project_root(root_name='Python'):
     """
@@ -111,7 +134,7 @@ async def check_table_exists(conn: asyncpg.Connection, schema: str, table_name:
     
     return exists
 
-async def insert_new_data(conn: asyncpg.Connection, table_name: str, data: List[Dict], schema: str) -> float:
+async def insert_new_data(conn: asyncpg.Connection, table_name: str, data: RowBatch, schema: str) -> float:
     """
     将新数据插入到数仓的指定表中
     :param conn: 数据库连接
@@ -129,19 +152,19 @@ async def insert_new_data(conn: asyncpg.Connection, table_name: str, data: List[
 
     try:
         # 准备插入语句
-        columns = list(data[0].keys())
+        columns = list(data.columns)
         values_str = ','.join([f'${i+1}' for i in range(len(columns))])
         insert_query = f"""
         INSERT INTO {schema}.{table_name} ({', '.join(columns)})
         VALUES ({values_str})
         """
 
-        # 分批插入数据
-        batch_size = 10000
-        for i in range(0, len(data), batch_size):
-            batch = data[i:i+batch_size]
-            values = [[row[col] for col in columns] for row in batch]
-            await conn.executemany(insert_query, values)
+        # 分批插入数据, 批次大小按字节预算和吞吐量自适应
+        sizer = batch_sizers.get(f"{table_name}:insert")
+        for batch in sizer.iter_batches(data):
+            batch_start_time = datetime.now()
+            await conn.executemany(insert_query, batch.rows)
+            sizer.record(len(batch), (datetime.now() - batch_start_time).total_seconds())
             logger.info(f"已插入 {len(batch)} 条数据到 {table_name}")
 
         insert_duration = (datetime.now() - start_time).total_seconds()
@@ -151,7 +174,7 @@ async def insert_new_data(conn: asyncpg.Connection, table_name: str, data: List[
         logger.error(f"插入数据时出错: {str(e)}")
         raise
 
-async def update_existing_data(conn: asyncpg.Connection, table_name: str, data: List[Dict], 
+async def update_existing_data(conn: asyncpg.Connection, table_name: str, data: RowBatch, 
                              unique_columns: List[str], schema: str) -> float:
     """
     更新数仓中指定表的现有数据
@@ -171,7 +194,7 @@ async def update_existing_data(conn: asyncpg.Connection, table_name: str, data:
 
     try:
         # 准备更新语句
-        columns = list(data[0].keys())
+        columns = list(data.columns)
         update_columns = [col for col in columns if col not in unique_columns]
 
         if not update_columns:
@@ -190,12 +213,12 @@ async def update_existing_data(conn: asyncpg.Connection, table_name: str, data:
         DO UPDATE SET {set_values}
         """
 
-        # 分批处理数据
-        batch_size = 10000
-        for i in range(0, len(data), batch_size):
-            batch = data[i:i+batch_size]
-            values = [[row[col] for col in columns] for row in batch]
-            await conn.executemany(upsert_query, values)
+        # 分批处理数据, 批次大小按字节预算和吞吐量自适应
+        sizer = batch_sizers.get(f"{table_name}:update")
+        for batch in sizer.iter_batches(data):
+            batch_start_time = datetime.now()
+            await conn.executemany(upsert_query, batch.rows)
+            sizer.record(len(batch), (datetime.now() - batch_start_time).total_seconds())
             logger.info(f"已处理 {len(batch)} 条数据")
 
         update_duration = (datetime.now() - start_time).total_seconds()
@@ -205,11 +228,61 @@ async def update_existing_data(conn: asyncpg.Connection, table_name: str, data:
         logger.error(f"更新数据时出错: {str(e)}")
         raise
 
+async def copy_merge_data(conn: asyncpg.Connection, table_name: str, data: RowBatch,
+                          unique_columns: List[str], schema: str) -> float:
+    """
+    通过COPY加载到临时暂存表, 再用一条集合语句插入或更新数仓的指定表
+    :param conn: 数据库连接
+    :param table_name: 表名
+    :param data: 要插入或更新的数据
+    :param unique_columns: 唯一键列名列表
+    :param schema: schema名称
+    :return: 合并操作耗时（秒）
+    """
+    if not data:
+        logger.info(f"无需插入或更新 {table_name} 中的数据")
+        return 0
+
+    logger.info(f"正在通过COPY向 {table_name} 合并 {len(data)} 条数据")
+    start_time = datetime.now()
+    staging_table = f"{table_name}_staging"
+
+    try:
+        columns = list(data.columns)
+        update_columns = [col for col in columns if col not in unique_columns]
+        column_list = ', '.join(columns)
+        merge_query = f"""
+        INSERT INTO {schema}.{table_name} ({column_list})
+        SELECT {column_list} FROM {staging_table}
+        ON CONFLICT ({', '.join(unique_columns)})
+        """
+        if update_columns:
+            merge_query += f"DO UPDATE SET {', '.join([f'{col} = EXCLUDED.{col}' for col in update_columns])}"
+        else:
+            merge_query += "DO NOTHING"
+
+        # 暂存表是只在当前事务内存在的临时表(不写WAL), 合并失败时整个事务回滚, 目标表不会出现部分写入
+        async with conn.transaction():
+            await conn.execute(f"""
+            CREATE TEMP TABLE {staging_table} (LIKE {schema}.{table_name} INCLUDING DEFAULTS) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table(
+                staging_table, records=data.rows, columns=columns)
+            result = await conn.execute(merge_query)
+
+        merge_duration = (datetime.now() - start_time).total_seconds()
+        logger.info(f"表 {table_name} 合并数据花费时间: {merge_duration:.2f} 秒, 影响行数: {result.split()[-1]}")
+        return merge_duration
+    except Exception as e:
+        logger.error(f"合并数据时出错: {str(e)}")
+        raise
+
 async def main():
     """
     主函数，负责从个人数据库读取数据，根据唯一标识分为插入和更新数据，然后同步到数仓
     """
     total_start_time = datetime.now()
+    batch_sizers.load()
 
     # Step 1: 加载配置信息
     table_info = []
@@ -224,14 +297,22 @@ async def main():
             'sql_file': table_config['sql_file'],
             'conn': table_config['conn'],
             'db': table_config['db'],
-            'schema': table_config['schema']
+            'schema': table_config['schema'],
+            'write_mode': table_config.get('write_mode', write_mode)
         })
 
     try:
-        # Step 2: 创建数仓数据库连接
-        dwh_conn = await db_manager.get_connection('myDWH_Tencent')
-        logger.info("成功连接到数仓数据库")
-        
+        # Step 2: 并行预热个人数据库和数仓的连接池, 之后每个步骤通过 async with db_manager.connection 获取和归还连接
+        await db_manager.warm_up(['myDB_Alicloud', 'myDWH_Tencent'])
+
+        # 读取各表上次同步成功的水位线, 读取失败时所有表使用固定日期区间
+        table_watermarks = {}
+        if use_watermark:
+            try:
+                table_watermarks = await watermark_store.load_all(watermark_job)
+            except Exception as e:
+                logger.error(f"读取水位线失败, 使用固定日期区间: {str(e)}")
+
         # Step 3: 循环处理每个表
         for table in table_info:
             table_start_time = datetime.now()
@@ -246,7 +327,7 @@ async def main():
             
             try:
                 # Step 4: 检查表是否存在
-                async with dwh_conn.acquire() as conn:
+                async with db_manager.connection('myDWH_Tencent', schema=schema) as conn:
                     table_exists = await check_table_exists(conn, schema, table_name)
                     if not table_exists:
                         logger.error(f"表 {schema}.{table_name} 不存在，跳过处理")
@@ -255,7 +336,6 @@ async def main():
                     logger.info(f"表 {schema}.{table_name} 存在，继续处理")
                     
                     # Step 5: 从数仓获取最大 id_column 值
-                    await conn.execute(f'SET search_path TO {schema}')
                     result = await conn.fetchrow(f"SELECT MAX({id_column}) AS max_id FROM {schema}.{table_name}")
                     max_id = result['max_id'] if result['max_id'] else 0
                     logger.info(f"表 {table_name} 中 {id_column} 的最大值为: {max_id}")
@@ -264,7 +344,11 @@ async def main():
                 tz = pytz.timezone("Asia/Shanghai")
                 end_date = (datetime.now(tz) - timedelta(days=days_offset)).replace(hour=0, minute=0, second=0, microsecond=0)
                 start_date = end_date - timedelta(days=days_interval)
-                logger.info(f"表 {table_name} 同步时间范围: {start_date} 至 {end_date}")
+                watermark = table_watermarks.get(table_name, {}).get('last_updated_at')
+                if watermark:
+                    # 从上次同步成功的位置开始, 覆盖漏跑的日期
+                    start_date = tz.localize(watermark)
+                logger.info(f"表 {table_name} 同步时间范围: {start_date} 至 {end_date}" + (" (水位线)" if watermark else ""))
 
                 # Step 7: 从SQL文件读取查询
                 sql_file_path = os.path.join(project_root, 'auto_scripts', 'sql', sql_file)
@@ -276,48 +360,59 @@ async def main():
                 with open(sql_file_path, 'r', encoding='utf-8') as f:
                     sql = f.read()
 
-                # Step 8: 替换时间占位符
-                sql = sql.replace('@start_date', f"'{start_date.strftime('%Y-%m-%d %H:%M:%S')}'")
-                sql = sql.replace('@end_date', f"'{end_date.strftime('%Y-%m-%d %H:%M:%S')}'")
+                # Step 8: 编译为参数化查询并绑定时间参数
+                compiled = query_compiler.compile(sql)
+                args = compiled.bind({
+                    'start_date': start_date.strftime('%Y-%m-%d %H:%M:%S'),
+                    'end_date': end_date.strftime('%Y-%m-%d %H:%M:%S')
+                })
                 logger.info(f"个人数据库正在执行 SQL 查询: {sql_file_path}")
 
                 # Step 9: 在个人数据库执行SQL查询
                 sql_start_time = datetime.now()
-                try:
-                    mydb_conn = await db_manager.get_connection('myDB_Alicloud')
-                    async with mydb_conn.cursor() as cursor:
-                        await cursor.execute(sql)
-                        results = await cursor.fetchall()
-                    sql_duration = (datetime.now() - sql_start_time).total_seconds()
-                    logger.info(f"从个人数据库获取了 {len(results)} 条记录")
-                    logger.info(f"从个人数据库 SQL 查询花费时间: {sql_duration:.2f} 秒")
-                finally:
-                    await db_manager.release_connection('myDB_Alicloud', mydb_conn)
+                async with db_manager.connection('myDB_Alicloud') as mydb_conn:
+                    results = await db_manager.fetch_all(mydb_conn, compiled.bind_sql, args)
+                sql_duration = (datetime.now() - sql_start_time).total_seconds()
+                logger.info(f"从个人数据库获取了 {len(results)} 条记录")
+                logger.info(f"从个人数据库 SQL 查询花费时间: {sql_duration:.2f} 秒")
 
                 # Step 10: 将结果分类为插入和更新的数据
-                insert_data = []
-                update_data = []
-
-                for row in results:
-                    if row[id_column] > max_id:
-                        insert_data.append(row)
-                    else:
-                        update_data.append(row)
+                id_index = results.column_index(id_column)
+                insert_data = results.filter(lambda row: row[id_index] > max_id)
+                update_data = results.filter(lambda row: row[id_index] <= max_id)
 
                 logger.info(f"表 {table_name} 需要插入的记录数: {len(insert_data)}, 需要更新的记录数: {len(update_data)}")
 
                 # Step 11: 更新和插入数据
-                async with dwh_conn.acquire() as conn:
-                    # 更新现有数据
-                    update_duration = await update_existing_data(conn, table_name, update_data, unique_columns, schema)
-                    
-                    # 插入新数据
-                    insert_duration = await insert_new_data(conn, table_name, insert_data, schema)
-
-                    total_db_duration = update_duration + insert_duration
+                async with db_manager.connection('myDWH_Tencent', schema=schema) as conn:
+                    total_db_duration = None
+                    if table['write_mode'] == 'copy':
+                        # 插入和更新的数据一起通过暂存表合并
+                        try:
+                            total_db_duration = await copy_merge_data(conn, table_name, results, unique_columns, schema)
+                        except asyncpg.exceptions.CardinalityViolationError:
+                            # 结果集中唯一键重复时一条ON CONFLICT语句无法处理, 回退到逐行执行
+                            logger.info(f"表 {table_name} 结果集存在重复的唯一键, 回退到逐行插入和更新")
+
+                    if total_db_duration is None:
+                        # 更新现有数据
+                        update_duration = await update_existing_data(conn, table_name, update_data, unique_columns, schema)
+
+                        # 插入新数据
+                        insert_duration = await insert_new_data(conn, table_name, insert_data, schema)
+
+                        total_db_duration = update_duration + insert_duration
                     logger.info(f"表 {table_name} 更新和插入总时间: {total_db_duration:.2f} 秒")
 
-                # Step 12: 计算表的执行时间
+                # Step 12: 记录水位线, 保存失败时下次运行重新同步同一区间
+                if use_watermark:
+                    new_max_id = max([max_id] + [row[id_index] for row in insert_data.rows])
+                    try:
+                        await watermark_store.save(watermark_job, table_name, end_date.replace(tzinfo=None), new_max_id)
+                    except Exception as e:
+                        logger.error(f"表 {table_name} 保存水位线失败: {str(e)}")
+
+                # Step 13: 计算表的执行时间
                 table_duration = (datetime.now() - table_start_time).total_seconds()
                 logger.info(f"表 {table_name} 总计花费时间: {table_duration:.2f} 秒")
 
@@ -326,7 +421,14 @@ async def main():
                 continue
 
     finally:
-        # Step 13: 关闭数据库连接
+        # Step 14: 保存学习到的批次大小, 关闭数据库连接
+        for summary in batch_sizers.summaries():
+            logger.info(summary)
+        try:
+            batch_sizers.save()
+        except OSError as e:
+            logger.error(f"保存批次大小失败: {str(e)}")
+        db_manager.log_pool_stats()
         await db_manager.close_all()
         total_duration = (datetime.now() - total_start_time).total_seconds()
         logger.info(f"数据库连接已关闭")
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+# -------------------------------------------------------
+# 自适应并发控制(AIMD)
+# 延迟正常时每完成"当前上限"个任务, 并发上限加1(加性增)
+# 超时、锁等待、死锁或延迟超过目标值时, 并发上限乘以回退系数(乘性减), 同一冷却时间内只回退一次
+# -------------------------------------------------------
+
+# 视为拥塞的MySQL错误码: 1205 锁等待超时, 1213 死锁
+CONGESTION_ERROR_CODES = (1205, 1213)
+
+def is_congestion_error(error: BaseException) -> bool:
+    """
+    判断异常是否表示数据库拥塞
+    :param error: 任务抛出的异常
+    :return: 超时或锁等待/死锁时返回True
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    code = error.args[0] if getattr(error, 'args', None) else None
+    return code in CONGESTION_ERROR_CODES
+
+class LimiterSlot:
+    def __init__(self):
+        """一次占用的并发名额, 可以记录多个延迟样本(如每个分块的读取耗时)"""
+        self.samples = []
+        self.congested = False
+
+    def add_sample(self, latency: float):
+        """
+        记录一个延迟样本, 有样本时使用样本的最大值代替整个占用时长
+        :param latency: 延迟(秒)
+        """
+        self.samples.append(latency)
+
+    def mark_congested(self):
+        """标记本次占用遇到拥塞(例如调用方自己捕获了超时异常)"""
+        self.congested = True
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: int = 1, minimum: int = 1, maximum: int = 5,
+                 target_latency: float = 10.0, decrease_factor: float = 0.5):
+        """
+        初始化自适应并发控制器
+        :param name: 名称, 用于日志
+        :param initial: 初始并发上限
+        :param minimum: 最小并发上限
+        :param maximum: 最大并发上限, 一般不超过连接池最大连接数
+        :param target_latency: 单个任务(或分块)可接受的最大延迟(秒), 超过时视为拥塞
+        :param decrease_factor: 拥塞时并发上限的乘数
+        """
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.condition = None  # 在事件循环中首次使用时创建
+        self.successes = 0  # 上次调整后延迟正常的任务数
+        self.last_decrease = 0.0
+        self.stats = {'peak_limit': self.limit, 'increases': 0, 'decreases': 0,
+                      'completed': 0, 'congested': 0, 'total_latency': 0.0}
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        占用一个并发名额, 退出时根据延迟和异常调整并发上限
+        用法: async with limiter.slot() as slot: ...
+        :return: LimiterSlot
+        """
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        slot = LimiterSlot()
+        start_time = time.time()
+        try:
+            yield slot
+        except BaseException as e:
+            if is_congestion_error(e):
+                slot.mark_congested()
+            raise
+        finally:
+            latency = max(slot.samples) if slot.samples else time.time() - start_time
+            async with condition:
+                self.in_flight -= 1
+                self._adjust(latency, slot.congested)
+                condition.notify_all()
+
+    def _adjust(self, latency: float, congested: bool):
+        """
+        按AIMD规则调整并发上限
+        :param latency: 本次占用的延迟
+        :param congested: 是否遇到拥塞
+        """
+        self.stats['completed'] += 1
+        self.stats['total_latency'] += latency
+        now = time.time()
+        if congested or latency > self.target_latency:
+            self.stats['congested'] += 1
+            self.successes = 0
+            # 同一批并发任务往往同时变慢, 冷却时间内只回退一次
+            if now - self.last_decrease >= self.target_latency and self.limit > self.minimum:
+                self.limit = max(self.minimum, int(self.limit * self.decrease_factor))
+                self.last_decrease = now
+                self.stats['decreases'] += 1
+            return
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self.successes = 0
+            self.stats['increases'] += 1
+            self.stats['peak_limit'] = max(self.stats['peak_limit'], self.limit)
+
+    def summary(self) -> str:
+        """
+        获取运行结束时的并发统计
+        :return: 统计描述
+        """
+        stats = self.stats
+        avg_latency = stats['total_latency'] / stats['completed'] if stats['completed'] else 0.0
+        return (
+            f"并发控制 {self.name}: 最终并发上限 {self.limit}, 最高 {stats['peak_limit']} (范围 {self.minimum}-{self.maximum}), "
+            f"增加 {stats['increases']} 次, 回退 {stats['decreases']} 次, 完成任务 {stats['completed']} 个, "
+            f"拥塞 {stats['congested']} 次, 平均延迟 {avg_latency:.2f} 秒"
+        )
@@ -0,0 +1,189 @@
+import json
+import os
+from typing import Any, Dict, Iterator, Optional
+
+# -------------------------------------------------------
+# 自适应批次大小
+# 每个批次的行数同时受两个条件限制:
+# 1. 字节预算: 按抽样行估算编码后的字节数, 避免宽表的单个批次超过max_allowed_packet
+# 2. 吞吐量: 按每个批次的实际耗时计算行/秒, 行数每次按step倍增大或减小, 吞吐量下降时反向调整(爬山法)
+# 每张表吞吐量最高时的行数保存到本地文件, 下次运行从该行数开始
+# -------------------------------------------------------
+
+# 默认字节预算, 低于MySQL 5.7默认的max_allowed_packet(4MB)
+DEFAULT_BYTE_BUDGET = 3 * 1024 * 1024
+
+def estimate_row_bytes(row) -> int:
+    """
+    估算单行在INSERT语句中编码后的字节数
+    :param row: 行元组或字典
+    :return: 估算的字节数
+    """
+    values = row.values() if isinstance(row, dict) else row
+    size = 4  # 括号和分隔符
+    for value in values:
+        if value is None:
+            size += 5
+        elif isinstance(value, (bytes, bytearray)):
+            size += 2 * len(value) + 3  # 转义后最多两倍
+        elif isinstance(value, str):
+            size += len(value.encode('utf-8', errors='surrogateescape')) + 3
+        else:
+            size += len(str(value)) + 3
+    return size
+
+class BatchSizer:
+    def __init__(self, name: str, initial_rows: int = 10000, min_rows: int = 100, max_rows: int = 100000,
+                 byte_budget: int = DEFAULT_BYTE_BUDGET, max_latency: float = 30.0, step: float = 1.25,
+                 sample_rows: int = 200):
+        """
+        初始化批次大小控制器
+        :param name: 名称(一般为表名), 用于记录学习到的批次大小
+        :param initial_rows: 初始行数
+        :param min_rows: 最小行数
+        :param max_rows: 最大行数
+        :param byte_budget: 单个批次的字节预算
+        :param max_latency: 单个批次可接受的最大耗时(秒), 超过时减小批次
+        :param step: 每次调整的倍数
+        :param sample_rows: 估算行字节数时抽样的行数
+        """
+        self.name = name
+        self.min_rows = max(1, min_rows)
+        self.max_rows = max(self.min_rows, max_rows)
+        self.rows = min(max(initial_rows, self.min_rows), self.max_rows)
+        self.byte_budget = byte_budget
+        self.max_latency = max_latency
+        self.step = step
+        self.sample_rows = sample_rows
+        self.direction = 1
+        self.last_throughput: Optional[float] = None
+        self.best_rows: Optional[int] = None
+        self.best_throughput = 0.0
+        self.byte_limited_rows: Optional[int] = None
+        self.stats = {'batches': 0, 'rows': 0, 'seconds': 0.0, 'failures': 0}
+
+    def _clamp(self, rows: float) -> int:
+        return min(max(int(rows), self.min_rows), self.max_rows)
+
+    def byte_limit(self, data) -> int:
+        """
+        按抽样行估算字节预算允许的最大行数
+        :param data: 行列表或RowBatch
+        :return: 行数上限
+        """
+        rows = getattr(data, 'rows', data)
+        sample = rows[:self.sample_rows]
+        if not sample:
+            return self.max_rows
+        avg_bytes = sum(estimate_row_bytes(row) for row in sample) / len(sample)
+        return max(1, int(self.byte_budget // max(avg_bytes, 1)))
+
+    def iter_batches(self, data) -> Iterator[Any]:
+        """
+        按当前批次大小切分数据, 每个批次的大小在上一个批次record之后重新确定
+        :param data: 行列表或RowBatch(切片仍为RowBatch)
+        :return: 批次迭代器
+        """
+        self.byte_limited_rows = self.byte_limit(data)
+        self.rows = self._clamp(min(self.rows, self.byte_limited_rows))
+        offset = 0
+        while offset < len(data):
+            batch_rows = max(1, min(self.rows, self.byte_limited_rows))
+            yield data[offset:offset + batch_rows]
+            offset += batch_rows
+
+    def record(self, rows: int, seconds: float):
+        """
+        记录批次的行数和耗时并调整批次大小; 行数明显少于当前批次大小(如最后一个批次)时只计入统计
+        :param rows: 批次行数
+        :param seconds: 批次耗时(秒)
+        """
+        self.stats['batches'] += 1
+        self.stats['rows'] += rows
+        self.stats['seconds'] += seconds
+        if seconds <= 0 or rows < self.rows * 0.9:
+            return
+        throughput = rows / seconds
+        if throughput > self.best_throughput:
+            self.best_throughput = throughput
+            self.best_rows = rows
+        if seconds > self.max_latency:
+            self.direction = -1
+        elif self.last_throughput is not None and throughput < self.last_throughput:
+            self.direction = -self.direction
+        self.last_throughput = throughput
+        target = self.rows * self.step if self.direction > 0 else self.rows / self.step
+        if self.byte_limited_rows is not None:
+            target = min(target, self.byte_limited_rows)
+        self.rows = self._clamp(target)
+
+    def record_failure(self):
+        """批次写入失败(如超过max_allowed_packet)时批次大小减半"""
+        self.stats['failures'] += 1
+        self.direction = -1
+        self.last_throughput = None
+        self.rows = self._clamp(self.rows / 2)
+
+    @property
+    def learned_rows(self) -> int:
+        """吞吐量最高时的批次行数, 没有完整批次时为当前行数"""
+        return self.best_rows or self.rows
+
+    def summary(self) -> str:
+        """
+        获取批次统计
+        :return: 统计描述
+        """
+        stats = self.stats
+        throughput = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+        return (f"批次大小 {self.name}: 学习到的批次行数 {self.learned_rows}, 批次数 {stats['batches']}, "
+                f"行数 {stats['rows']}, 平均 {throughput:.0f} 行/秒, 失败 {stats['failures']} 次")
+
+class BatchSizerStore:
+    def __init__(self, path: str, **defaults):
+        """
+        初始化批次大小记录
+        :param path: 记录文件路径
+        :param defaults: 创建BatchSizer时的默认参数
+        """
+        self.path = path
+        self.defaults = defaults
+        self.learned: Dict[str, int] = {}
+        self.sizers: Dict[str, BatchSizer] = {}
+
+    def load(self):
+        """读取上次运行学习到的批次行数, 文件不存在或不可读取时为空"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.learned = {name: int(rows) for name, rows in json.load(f).items()}
+        except (OSError, ValueError):
+            self.learned = {}
+
+    def get(self, name: str) -> BatchSizer:
+        """
+        获取名称对应的批次大小控制器, 同一次运行中共用同一个实例
+        :param name: 名称(一般为表名)
+        :return: BatchSizer
+        """
+        if name not in self.sizers:
+            options = dict(self.defaults)
+            if name in self.learned:
+                options['initial_rows'] = self.learned[name]
+            self.sizers[name] = BatchSizer(name, **options)
+        return self.sizers[name]
+
+    def save(self):
+        """保存本次运行学习到的批次行数, 本次没有使用的名称保留原来的值"""
+        self.learned.update({name: sizer.learned_rows for name, sizer in self.sizers.items() if sizer.stats['batches']})
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.learned, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def summaries(self):
+        """
+        获取本次运行使用过的控制器的统计
+        :return: 统计描述列表
+        """
+        return [sizer.summary() for sizer in self.sizers.values() if sizer.stats['batches']]
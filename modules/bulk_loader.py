@@ -0,0 +1,125 @@
+import os
+import tempfile
+from datetime import datetime, date, time, timedelta
+from decimal import Decimal
+from typing import Any, Optional, Sequence
+
+# -------------------------------------------------------
+# MySQL批量加载工具
+# 把批次数据序列化为TSV, 通过 LOAD DATA LOCAL INFILE 一次性写入目标表,
+# 需要连接池和服务端同时开启local_infile(database.yaml中配置 local_infile: true)
+# 插入或更新通过临时暂存表完成: 先加载到暂存表, 再 INSERT ... SELECT ... ON DUPLICATE KEY UPDATE
+# -------------------------------------------------------
+
+# TSV中需要转义的字符, 与 LOAD DATA 默认的 ESCAPED BY '\\' 对应
+TSV_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'}
+
+def to_tsv_field(value: Any) -> str:
+    """
+    把单个值转换为TSV字段
+    :param value: 数据库读取到的值
+    :return: TSV字段文本, NULL为\\N
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    if isinstance(value, timedelta):
+        # MySQL TIME类型在aiomysql中读取为timedelta
+        total_seconds = int(value.total_seconds())
+        sign = '-' if total_seconds < 0 else ''
+        hours, remainder = divmod(abs(total_seconds), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{sign}{hours:02d}:{minutes:02d}:{seconds:02d}"
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value).decode('utf-8', errors='surrogateescape')
+    text = str(value)
+    if any(ch in text for ch in TSV_ESCAPES):
+        text = ''.join(TSV_ESCAPES.get(ch, ch) for ch in text)
+    return text
+
+def rows_to_tsv(rows: Sequence[Sequence[Any]]) -> bytes:
+    """
+    把批次数据序列化为TSV
+    :param rows: 批次数据(行元组列表)
+    :return: UTF-8编码的TSV内容, 每行以\\n结尾
+    """
+    lines = ['\t'.join(to_tsv_field(value) for value in row) for row in rows]
+    return ('\n'.join(lines) + '\n').encode('utf-8', errors='surrogateescape')
+
+class BulkLoader:
+    def __init__(self, temp_dir: Optional[str] = None):
+        """
+        初始化批量加载器
+        :param temp_dir: TSV临时文件目录, 默认优先使用内存文件系统/dev/shm
+        """
+        if temp_dir is None and os.path.isdir('/dev/shm'):
+            temp_dir = '/dev/shm'
+        self.temp_dir = temp_dir
+
+    async def load(self, conn, table_name: str, columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> int:
+        """
+        通过 LOAD DATA LOCAL INFILE 把批次数据写入表
+        注意: LOCAL模式下主键冲突的行会被忽略(与IGNORE相同), 调用方需要先删除旧数据或使用upsert
+        :param conn: MySQL连接(需要开启local_infile)
+        :param table_name: 表名
+        :param columns: 列名, 顺序与行元组相同
+        :param rows: 批次数据(行元组列表)
+        :return: 写入的行数
+        """
+        if not rows:
+            return 0
+        # aiomysql按文件名读取LOCAL INFILE的内容, 所以TSV先写入临时文件(默认位于内存文件系统)
+        fd, path = tempfile.mkstemp(prefix=f"{table_name}_", suffix='.tsv', dir=self.temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(rows_to_tsv(rows))
+            load_query = (
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {table_name} CHARACTER SET utf8mb4 "
+                f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                f"({', '.join(f'`{col}`' for col in columns)})"
+            )
+            async with conn.cursor() as cursor:
+                await cursor.execute(load_query, (path,))
+                loaded = cursor.rowcount
+            await conn.commit()
+            return loaded
+        finally:
+            os.remove(path)
+
+    async def upsert(self, conn, table_name: str, columns: Sequence[str], rows: Sequence[Sequence[Any]],
+                     key_columns: Sequence[str] = ('id',)) -> int:
+        """
+        通过暂存表插入或更新批次数据: 加载到临时表后 INSERT ... SELECT ... ON DUPLICATE KEY UPDATE
+        :param conn: MySQL连接(需要开启local_infile)
+        :param table_name: 表名
+        :param columns: 列名, 顺序与行元组相同
+        :param rows: 批次数据(行元组列表)
+        :param key_columns: 唯一键列, 这些列不参与更新
+        :return: 加载到暂存表的行数
+        """
+        if not rows:
+            return 0
+        staging_table = f"{table_name}_staging"
+        column_list = ', '.join(f'`{col}`' for col in columns)
+        updates = ', '.join(f'`{col}` = VALUES(`{col}`)' for col in columns if col not in key_columns)
+        async with conn.cursor() as cursor:
+            # 临时表只对当前连接可见, 结构与目标表相同
+            await cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging_table}")
+            await cursor.execute(f"CREATE TEMPORARY TABLE {staging_table} LIKE {table_name}")
+        try:
+            loaded = await self.load(conn, staging_table, columns, rows)
+            async with conn.cursor() as cursor:
+                merge_query = f"INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM {staging_table}"
+                if updates:
+                    merge_query += f" ON DUPLICATE KEY UPDATE {updates}"
+                await cursor.execute(merge_query)
+            await conn.commit()
+            return loaded
+        finally:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging_table}")
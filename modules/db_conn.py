@@ -1,9 +1,12 @@
 import os
 import sys
 import yaml
+import time
+import weakref
 import asyncio
 import aiomysql
 import asyncpg
+from contextlib import asynccontextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 from typing import Optional, Dict, Any, Union
@@ -63,76 +66,449 @@ def load_all_db_configs(config_subpath='auto_scripts/config/database.yaml'):
     
     return configs
 
+# -------------------------------------------------------
+# 元组格式的结果集
+# -------------------------------------------------------
+class RowBatch:
+    """
+    元组格式的结果集(或其中一个分块): 列名只保存一份, 每行是数据库驱动返回的元组, 不为每行构建字典
+    支持len()和切片, 切片结果仍是RowBatch, 可以直接替代字典列表按批次处理
+    """
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        """
+        :param columns: 列名元组
+        :param rows: 行元组列表
+        """
+        self.columns = tuple(columns)
+        self.rows = rows
+
+    @classmethod
+    def from_cursor(cls, cursor, rows):
+        """
+        使用游标的description作为列名
+        :param cursor: 执行过查询的元组游标
+        :param rows: 游标返回的行
+        :return: RowBatch
+        """
+        return cls([column[0] for column in cursor.description or ()], list(rows))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RowBatch(self.columns, self.rows[index])
+        return self.rows[index]
+
+    def column_index(self, name: str) -> int:
+        """
+        获取列在行元组中的位置
+        :param name: 列名
+        :return: 列序号
+        """
+        return self.columns.index(name)
+
+    def filter(self, predicate) -> 'RowBatch':
+        """
+        按条件筛选行
+        :param predicate: 接收行元组, 返回是否保留
+        :return: 列名相同的新RowBatch
+        """
+        return RowBatch(self.columns, [row for row in self.rows if predicate(row)])
+
+    def to_columns(self) -> list:
+        """
+        转换为按列存储的格式
+        :return: 每列一个元组, 顺序与columns相同
+        """
+        return list(zip(*self.rows)) if self.rows else [() for _ in self.columns]
+
+    def to_dicts(self) -> list:
+        """
+        转换为字典列表, 只用于需要按列名访问单行的少量数据
+        :return: 字典列表
+        """
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
 # -------------------------------------------------------
 # 连接池管理器
 # -------------------------------------------------------
+# database.yaml中每个环境可选的连接池配置:
+#   pool_minsize: 连接池最小连接数, 默认1
+#   pool_maxsize: 连接池最大连接数, 默认5
+#   local_infile: MySQL是否允许 LOAD DATA LOCAL INFILE, 默认false
 class DBManager:
-    def __init__(self, logger: Optional[logging.Logger] = None, max_retry=3, connect_timeout=20, max_concurrent=3):
+    def __init__(self, logger: Optional[logging.Logger] = None, max_retry=3, connect_timeout=20, max_concurrent=3,
+                 row_format='dict'):
         """
         初始化数据库管理器
         :param logger: 日志记录器, 如果为None则创建新的日志记录器
         :param max_retry: 最大重试次数
         :param connect_timeout: 连接超时时间(秒)
         :param max_concurrent: 每个数据库环境最大并发连接数
+        :param row_format: fetch_all/stream_query默认的MySQL结果格式, dict为字典列表, tuple为RowBatch
         """
+        if row_format not in ('dict', 'tuple'):
+            raise ValueError(f"不支持的结果格式: {row_format}")
         self.logger = logger or setup_logger(__file__)
+        self.row_format = row_format
         self.configs = load_all_db_configs()
         self.pools = {}  # 存放连接池
         self.max_retry = max_retry
         self.connect_timeout = connect_timeout
         self.max_concurrent = max_concurrent
         self.semaphores = {}  # 存放每个env的信号量
+        self.usage = {}  # 存放每个env的连接使用计数
+        self.pool_locks = {}  # 存放每个env创建连接池的锁, 保证同一env只创建一次连接池
+        self.session_states = weakref.WeakKeyDictionary()  # 存放每个MySQL连接当前的数据库和会话变量
+
+    def _get_db_type(self, env: str) -> str:
+        """
+        获取数据库环境的类型
+        :param env: 环境名称
+        :return: 数据库类型(mysql/postgresql)
+        """
+        if env not in self.configs:
+            raise ValueError(f"配置文件中不存在名为 '{env}' 的数据库配置")
+        return self.configs[env].get('type', 'mysql')
+
+    def _get_pool_size(self, env: str):
+        """
+        从database.yaml读取连接池大小
+        :param env: 环境名称
+        :return: (最小连接数, 最大连接数)
+        """
+        config = self.configs[env]
+        minsize = int(config.get('pool_minsize', 1))
+        maxsize = int(config.get('pool_maxsize', 5))
+        return minsize, max(minsize, maxsize)
+
+    def _get_semaphore(self, env: str) -> asyncio.Semaphore:
+        """
+        获取env的信号量, 并发上限不超过连接池最大连接数
+        :param env: 环境名称
+        :return: 信号量
+        """
+        if env not in self.semaphores:
+            _, maxsize = self._get_pool_size(env)
+            self.semaphores[env] = asyncio.Semaphore(min(self.max_concurrent, maxsize))
+            self.usage[env] = {'in_use': 0, 'peak_in_use': 0, 'waiting': 0, 'acquired': 0, 'wait_time': 0.0,
+                               'round_trips_saved': 0, 'statements_prepared': 0, 'statements_reused': 0}
+        return self.semaphores[env]
+
+    async def _acquire_permit(self, env: str):
+        """
+        获取env的并发许可, 并更新使用计数
+        :param env: 环境名称
+        """
+        semaphore = self._get_semaphore(env)
+        usage = self.usage[env]
+        usage['waiting'] += 1
+        wait_start = time.time()
+        try:
+            await semaphore.acquire()
+        finally:
+            usage['waiting'] -= 1
+        usage['wait_time'] += time.time() - wait_start
+        usage['acquired'] += 1
+        usage['in_use'] += 1
+        usage['peak_in_use'] = max(usage['peak_in_use'], usage['in_use'])
+
+    def _release_permit(self, env: str):
+        """
+        归还env的并发许可, 并更新使用计数
+        :param env: 环境名称
+        """
+        if env in self.semaphores:
+            self.usage[env]['in_use'] -= 1
+            self.semaphores[env].release()
+
+    def get_pool_stats(self, env: str = None) -> Dict[str, Dict[str, Any]]:
+        """
+        获取连接池实时使用情况
+        :param env: 环境名称, 为None时返回所有已创建连接池的环境
+        :return: {env: {in_use, peak_in_use, waiting, acquired, wait_time, round_trips_saved,
+                  statements_prepared, statements_reused, pool_size, pool_free, pool_minsize, pool_maxsize}}
+        """
+        envs = [env] if env else list(self.pools.keys())
+        stats = {}
+        for name in envs:
+            self._get_semaphore(name)
+            item = dict(self.usage[name])
+            pool = self.pools.get(name)
+            if pool is not None:
+                if self._get_db_type(name) == 'mysql':
+                    item.update(pool_size=pool.size, pool_free=pool.freesize, pool_minsize=pool.minsize, pool_maxsize=pool.maxsize)
+                else:
+                    item.update(pool_size=pool.get_size(), pool_free=pool.get_idle_size(),
+                                pool_minsize=pool.get_min_size(), pool_maxsize=pool.get_max_size())
+            stats[name] = item
+        return stats
+
+    def log_pool_stats(self):
+        """将所有连接池的使用情况写入日志"""
+        for env, item in self.get_pool_stats().items():
+            self.logger.info(
+                f"连接池 {env} 使用情况: 当前使用 {item['in_use']}, 峰值 {item['peak_in_use']}, 等待 {item['waiting']}, "
+                f"累计获取 {item['acquired']} 次, 累计等待 {item['wait_time']:.2f} 秒, "
+                f"池大小 {item.get('pool_size')}/{item.get('pool_maxsize')}, 空闲 {item.get('pool_free')}, "
+                f"节省的USE/SET往返次数 {item['round_trips_saved']}, "
+                f"预处理语句 {item['statements_prepared']} 条/复用 {item['statements_reused']} 次"
+            )
+
+    def _get_session_state(self, env: str, conn) -> Dict[str, Any]:
+        """
+        获取MySQL连接的会话状态缓存, 新连接的数据库为配置中的默认数据库
+        :param env: 环境名称
+        :param conn: MySQL连接
+        :return: {'database': 当前数据库, 'vars': {变量名: 值}}
+        """
+        state = self.session_states.get(conn)
+        if state is None:
+            state = {'database': self.configs[env].get('default_db', 'mysql'), 'vars': {}, 'statements': {}}
+            self.session_states[conn] = state
+        return state
+
+    async def use_database(self, env: str, conn, database: str):
+        """
+        切换MySQL连接的当前数据库, 连接已在该数据库时不发送USE语句
+        :param env: 环境名称
+        :param conn: MySQL连接
+        :param database: 数据库名
+        """
+        self._get_semaphore(env)
+        state = self._get_session_state(env, conn)
+        if state['database'] == database:
+            self.usage[env]['round_trips_saved'] += 1
+            return
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"USE {database}")
+        state['database'] = database
+
+    async def set_session_vars(self, env: str, conn, variables: Dict[str, Any]):
+        """
+        设置MySQL连接的用户变量(@name), 只发送与连接当前值不同的变量, 多个变量合并为一条SET语句
+        :param env: 环境名称
+        :param conn: MySQL连接
+        :param variables: {变量名(不含@): 值}
+        """
+        self._get_semaphore(env)
+        state = self._get_session_state(env, conn)['vars']
+        changed = {name: value for name, value in variables.items() if name not in state or state[name] != value}
+        # 逐个SET时每个变量一次往返, 合并后最多一次往返
+        self.usage[env]['round_trips_saved'] += len(variables) - (1 if changed else 0)
+        if not changed:
+            return
+        assignments = ', '.join(f"@{name} = %s" for name in changed)
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"SET {assignments}", tuple(changed.values()))
+        except Exception:
+            # 会话状态未知, 丢弃缓存
+            self.session_states.pop(conn, None)
+            raise
+        state.update(changed)
+
+    async def prepare_statement(self, env: str, conn, sql: str) -> str:
+        """
+        在MySQL连接上创建服务端预处理语句, 同一连接上相同的SQL只PREPARE一次
+        :param env: 环境名称
+        :param conn: MySQL连接
+        :param sql: 使用?占位符的SQL
+        :return: 预处理语句名, 通过 EXECUTE 语句名 USING @变量 执行
+        """
+        self._get_semaphore(env)
+        statements = self._get_session_state(env, conn)['statements']
+        name = statements.get(sql)
+        if name is not None:
+            self.usage[env]['statements_reused'] += 1
+            return name
+        name = f"auto_stmt_{len(statements) + 1}"
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"PREPARE {name} FROM %s", (sql,))
+        statements[sql] = name
+        self.usage[env]['statements_prepared'] += 1
+        return name
+
+    @asynccontextmanager
+    async def connection(self, env: str, database: str = None, schema: str = None):
+        """
+        以 async with 方式获取数据库连接, 退出时同时归还连接和并发许可
+        :param env: 环境名称
+        :param database: 要使用的数据库名(仅MySQL), 如果为None则使用配置中的默认值
+        :param schema: 要使用的schema名(仅PostgreSQL), 如果为None则使用配置中的默认值
+        :return: MySQL返回aiomysql.Connection, PostgreSQL返回asyncpg.Connection
+        """
+        db_type = self._get_db_type(env)
+        if db_type not in ('mysql', 'postgresql'):
+            raise ValueError(f"不支持的数据库类型: {db_type}")
+
+        # 确保连接池存在
+        await self._ensure_pool(env)
+
+        await self._acquire_permit(env)
+        pool = self.pools[env]
+        conn = None
+        try:
+            conn = await asyncio.wait_for(pool.acquire(), timeout=self.connect_timeout)
+            if db_type == 'mysql':
+                if database:
+                    await self.use_database(env, conn, database)
+            elif schema:
+                # 连接归还时asyncpg会执行RESET ALL, search_path恢复为连接池默认值
+                await conn.execute(f'SET search_path TO {schema}')
+            yield conn
+        finally:
+            try:
+                if conn is not None:
+                    if db_type == 'mysql':
+                        pool.release(conn)
+                    else:
+                        await pool.release(conn)
+            except Exception as e:
+                self.logger.error(f"释放连接时出错: {str(e)}")
+            finally:
+                self._release_permit(env)
 
     async def get_connection(self, env: str, database: str = None, schema: str = None) -> Union[aiomysql.Connection, asyncpg.Pool]:
         """
         获取数据库连接
+        新代码建议使用 async with connection(...), 由上下文统一管理连接和并发许可
         :param env: 环境名称
         :param database: 要使用的数据库名，如果为None则使用配置中的默认值
         :param schema: 要使用的schema名（仅PostgreSQL），如果为None则使用配置中的默认值
-        :return: MySQL返回connection，PostgreSQL返回pool
+        :return: MySQL返回connection(需调用release_connection释放)，PostgreSQL返回pool(不占用并发许可)
         """
-        if env not in self.configs:
-            raise ValueError(f"配置文件中不存在名为 '{env}' 的数据库配置")
-        
-        config = self.configs[env]
-        db_type = config.get('type', 'mysql')
+        db_type = self._get_db_type(env)
         
         # 确保连接池存在
-        if env not in self.pools:
-            await self._create_pool(env)
+        await self._ensure_pool(env)
         
-        # 确保信号量存在
-        if env not in self.semaphores:
-            self.semaphores[env] = asyncio.Semaphore(self.max_concurrent)
-        
-        semaphore = self.semaphores[env]
-        await semaphore.acquire()
+        if db_type == 'postgresql':
+            # 返回连接池，让使用者通过 async with pool.acquire() 管理连接, 并发由连接池大小限制
+            return self.pools[env]
+        elif db_type != 'mysql':
+            raise ValueError(f"不支持的数据库类型: {db_type}")
+
+        await self._acquire_permit(env)
         
         try:
             pool = self.pools[env]
-            
-            if db_type == 'mysql':
-                conn = await asyncio.wait_for(pool.acquire(), timeout=self.connect_timeout)
-                if database:
-                    async with conn.cursor() as cursor:
-                        await cursor.execute(f"USE {database}")
-                return conn
-            
-            elif db_type == 'postgresql':
-                return pool  # 返回连接池，让使用者通过 async with 管理连接
-            
-            else:
-                raise ValueError(f"不支持的数据库类型: {db_type}")
+            conn = await asyncio.wait_for(pool.acquire(), timeout=self.connect_timeout)
+            if database:
+                await self.use_database(env, conn, database)
+            return conn
                 
         except Exception as e:
-            semaphore.release()
+            self._release_permit(env)
             self.logger.error(f"获取连接失败: {str(e)}")
             raise e
 
+    async def fetch_all(self, conn: aiomysql.Connection, query: str, args=None, row_format: Optional[str] = None):
+        """
+        执行MySQL查询并读取全部结果
+        :param conn: 通过get_connection获取的MySQL连接
+        :param query: 查询语句
+        :param args: 查询参数
+        :param row_format: 结果格式, 默认使用DBManager的row_format
+        :return: dict格式为字典列表, tuple格式为RowBatch
+        """
+        if (row_format or self.row_format) == 'tuple':
+            async with conn.cursor(aiomysql.Cursor) as cursor:
+                await cursor.execute(query, args)
+                return RowBatch.from_cursor(cursor, await cursor.fetchall())
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(query, args)
+            return await cursor.fetchall()
+
+    async def stream_query(self, conn: aiomysql.Connection, query: str, args=None, chunk_size: int = 10000,
+                           row_format: Optional[str] = None):
+        """
+        使用无缓冲的服务端游标(SSDictCursor/SSCursor)流式读取MySQL查询结果
+        :param conn: 通过get_connection获取的MySQL连接
+        :param query: 查询语句
+        :param args: 查询参数
+        :param chunk_size: 每次从服务端读取的行数
+        :param row_format: 结果格式, 默认使用DBManager的row_format
+        :return: 异步生成器, 每次产出最多chunk_size行数据(dict格式为字典列表, tuple格式为RowBatch)
+        """
+        as_tuple = (row_format or self.row_format) == 'tuple'
+        # 不使用 async with: 无缓冲游标关闭时会读取并丢弃服务端剩余的全部行, 失败时应先关闭连接
+        cursor = await conn.cursor(aiomysql.SSCursor if as_tuple else aiomysql.SSDictCursor)
+        try:
+            await cursor.execute(query, args)
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield RowBatch.from_cursor(cursor, rows) if as_tuple else rows
+        except BaseException:
+            # 无缓冲结果集未读完时连接不可复用, 直接关闭(不读取剩余的行), 归还连接池时会被丢弃
+            conn.close()
+            raise
+        # 结果集已全部读取, 关闭游标不再有剩余的行需要丢弃
+        await cursor.close()
+
+    async def _ensure_pool(self, env: str):
+        """
+        确保env的连接池存在, 多个协程同时调用时只有一个协程创建连接池, 其余协程等待其结果
+        :param env: 环境名称
+        :return: 连接池
+        """
+        if env in self.pools:
+            return self.pools[env]
+        lock = self.pool_locks.setdefault(env, asyncio.Lock())
+        async with lock:
+            if env not in self.pools:
+                await self._create_pool(env)
+        return self.pools[env]
+
+    async def warm_up(self, envs, min_connections: int = 1):
+        """
+        在第一次查询前并行创建所有需要的连接池, 并预先建立连接
+        :param envs: 需要预热的环境名称列表
+        :param min_connections: 每个环境预先建立的连接数, 不超过连接池最大连接数
+        :return: {env: 预先建立的连接数}, 预热失败的环境不在结果中
+        """
+        async def warm_env(env):
+            pool = await self._ensure_pool(env)
+            _, maxsize = self._get_pool_size(env)
+            db_type = self._get_db_type(env)
+            # 同时借出多个连接迫使连接池建立新连接, 归还后保留在空闲队列中
+            conns = await asyncio.gather(*[
+                asyncio.wait_for(pool.acquire(), timeout=self.connect_timeout)
+                for _ in range(min(min_connections, maxsize))
+            ], return_exceptions=True)
+            opened = 0
+            for conn in conns:
+                if isinstance(conn, BaseException):
+                    self.logger.warning(f"预热连接池 {env} 时建立连接失败: {str(conn)}")
+                    continue
+                if db_type == 'mysql':
+                    pool.release(conn)
+                else:
+                    await pool.release(conn)
+                opened += 1
+            return opened
+
+        start_time = time.time()
+        results = await asyncio.gather(*[warm_env(env) for env in envs], return_exceptions=True)
+        warmed = {}
+        for env, result in zip(envs, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f"预热连接池 {env} 失败: {str(result)}")
+            else:
+                warmed[env] = result
+        self.logger.info(f"连接池预热完成, 耗时 {time.time() - start_time:.2f} 秒, 预先建立的连接数: {warmed}")
+        return warmed
+
     async def _create_pool(self, env: str):
         """创建连接池"""
         config = self.configs[env]
         db_type = config.get('type', 'mysql')
+        minsize, maxsize = self._get_pool_size(env)
         retry = 0
 
         while retry < self.max_retry:
@@ -146,8 +522,9 @@ class DBManager:
                         db=config.get('default_db', 'mysql'),
                         charset=config.get('charset', 'utf8mb4'),
                         autocommit=True,
-                        minsize=1,
-                        maxsize=5,
+                        minsize=minsize,
+                        maxsize=maxsize,
+                        local_infile=config.get('local_infile', False),  # 开启后可使用 LOAD DATA LOCAL INFILE 批量加载
                         cursorclass=aiomysql.DictCursor
                     )
                 elif db_type == 'postgresql':
@@ -157,8 +534,8 @@ class DBManager:
                         user=config['user'],
                         password=config['password'],
                         database=config.get('default_db', 'postgres'),
-                        min_size=1,
-                        max_size=5,
+                        min_size=minsize,
+                        max_size=maxsize,
                         command_timeout=60.0,
                         server_settings={
                             'application_name': 'auto_scripts',
@@ -170,7 +547,7 @@ class DBManager:
                 else:
                     raise ValueError(f"不支持的数据库类型: {db_type}")
                 
-                self.logger.info(f"成功创建连接池: {env} ({db_type})")
+                self.logger.info(f"成功创建连接池: {env} ({db_type}), 连接数 {minsize}-{maxsize}")
                 return
             except Exception as e:
                 retry += 1
@@ -192,21 +569,21 @@ class DBManager:
         config = self.configs[env]
         db_type = config.get('type', 'mysql')
 
+        if db_type == 'postgresql':
+            # PostgreSQL的连接由async with自动管理, get_connection也未占用并发许可, 这里不需要手动释放
+            return
+
         try:
             if db_type == 'mysql':
                 if env in self.pools:
                     self.pools[env].release(conn)
                     self.logger.info(f"已释放MySQL连接: {env}")
-            elif db_type == 'postgresql':
-                # PostgreSQL的连接由async with自动管理，这里不需要手动释放
-                pass
             else:
                 raise ValueError(f"不支持的数据库类型: {db_type}")
         except Exception as e:
             self.logger.error(f"释放连接时出错: {str(e)}")
         finally:
-            if env in self.semaphores:
-                self.semaphores[env].release()
+            self._release_permit(env)
 
     async def close_all(self):
         """关闭所有连接池"""
@@ -238,21 +615,19 @@ async def main():
 
     try:
         # 测试MySQL连接
-        conn_mysql = await db_manager.get_connection('zcwDB_Alicloud')
-        try:
+        async with db_manager.connection('zcwDB_Alicloud') as conn_mysql:
             async with conn_mysql.cursor() as cursor:
                 await cursor.execute("SELECT NOW()")
                 result = await cursor.fetchone()
                 logger.info(f"[MySQL] 查询结果: {result}")
-        finally:
-            await db_manager.release_connection('zcwDB_Alicloud', conn_mysql)
 
         # 测试PostgreSQL连接
-        pool = await db_manager.get_connection('zcwDWH_Alicloud')
-        async with pool.acquire() as conn:
+        async with db_manager.connection('zcwDWH_Alicloud') as conn:
             result = await conn.fetchrow("SELECT NOW()")
             logger.info(f"[PostgreSQL] 查询结果: {result}")
 
+        db_manager.log_pool_stats()
+
     finally:
         await asyncio.wait_for(db_manager.close_all(), timeout=30)
 
@@ -0,0 +1,138 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List
+
+# -------------------------------------------------------
+# 物理删除检测
+# 按主键顺序分页读取源库和目标库的主键(WHERE id > 上一页最大id ORDER BY id LIMIT n),
+# 两边都是有序的主键流, 逐个归并比较: 只存在于目标库的主键即源库中已物理删除的行, 分批删除;
+# 只存在于源库的主键只计数(通常是同步区间之外新增的行), 由调用方决定如何处理
+# 内存只与分页大小和待删除的主键数相关, 写入只与实际删除的行数相关
+# -------------------------------------------------------
+
+class DeletionDetector:
+    def __init__(self, db_manager, source_env: str, target_env: str, page_rows: int = 50000, delete_batch_rows: int = 5000,
+                 max_delete_ratio: float = 0.5, source_limiter=None, target_limiter=None):
+        """
+        初始化物理删除检测工具
+        :param db_manager: DBManager实例
+        :param source_env: 源库的MySQL环境
+        :param target_env: 目标库的MySQL环境
+        :param page_rows: 每次读取的主键数
+        :param delete_batch_rows: 每条DELETE语句删除的最大主键数
+        :param max_delete_ratio: 待删除的行数超过目标库行数的该比例时不执行删除(避免源库查询异常时清空目标表)
+        :param source_limiter: 可选的AdaptiveLimiter, 读取源库的每一页占用一个并发名额
+        :param target_limiter: 可选的AdaptiveLimiter, 读取目标库和删除的每一批占用一个并发名额
+        """
+        self.db_manager = db_manager
+        self.source_env = source_env
+        self.target_env = target_env
+        self.page_rows = page_rows
+        self.delete_batch_rows = delete_batch_rows
+        self.max_delete_ratio = max_delete_ratio
+        self.source_limiter = source_limiter
+        self.target_limiter = target_limiter
+
+    @asynccontextmanager
+    async def _slot(self, limiter):
+        if limiter is None:
+            yield
+        else:
+            async with limiter.slot():
+                yield
+
+    async def iter_ids(self, env: str, table_name: str, key_column: str = 'id', limiter=None) -> AsyncIterator[Any]:
+        """
+        按主键顺序分页读取表的所有主键
+        :param env: MySQL环境
+        :param table_name: 表名
+        :param key_column: 主键列名
+        :param limiter: 可选的AdaptiveLimiter
+        :return: 有序的主键异步迭代器
+        """
+        last_key = None
+        while True:
+            query = f"SELECT `{key_column}` FROM {table_name}"
+            args = []
+            if last_key is not None:
+                query += f" WHERE `{key_column}` > %s"
+                args.append(last_key)
+            query += f" ORDER BY `{key_column}` LIMIT %s"
+            args.append(self.page_rows)
+            async with self._slot(limiter):
+                async with self.db_manager.connection(env) as conn:
+                    rows = (await self.db_manager.fetch_all(conn, query, args, row_format='tuple')).rows
+            for row in rows:
+                yield row[0]
+            if len(rows) < self.page_rows:
+                return
+            last_key = rows[-1][0]
+
+    async def find_deleted_ids(self, table_name: str, key_column: str = 'id') -> Dict[str, Any]:
+        """
+        归并比较两边的有序主键流, 找出只存在于目标库的主键
+        :param table_name: 表名(两边相同)
+        :param key_column: 主键列名
+        :return: {'source_rows': 源库行数, 'target_rows': 目标库行数, 'missing_rows': 只存在于源库的行数, 'deleted_ids': 待删除的主键列表}
+        """
+        source_ids = self.iter_ids(self.source_env, table_name, key_column, self.source_limiter)
+        target_ids = self.iter_ids(self.target_env, table_name, key_column, self.target_limiter)
+        stats = {'source_rows': 0, 'target_rows': 0, 'missing_rows': 0, 'deleted_ids': []}
+
+        async def next_source_id():
+            try:
+                source_id = await source_ids.__anext__()
+            except StopAsyncIteration:
+                return None
+            stats['source_rows'] += 1
+            return source_id
+
+        source_id = await next_source_id()
+        async for target_id in target_ids:
+            stats['target_rows'] += 1
+            while source_id is not None and source_id < target_id:
+                stats['missing_rows'] += 1
+                source_id = await next_source_id()
+            if source_id is not None and source_id == target_id:
+                source_id = await next_source_id()
+            else:
+                stats['deleted_ids'].append(target_id)
+        while source_id is not None:
+            stats['missing_rows'] += 1
+            source_id = await next_source_id()
+        return stats
+
+    async def delete_ids(self, table_name: str, ids: List[Any], key_column: str = 'id') -> int:
+        """
+        按批删除目标库中的主键, 每批一条 DELETE ... WHERE id IN (...) 语句并提交
+        :param table_name: 表名
+        :param ids: 主键列表
+        :param key_column: 主键列名
+        :return: 删除的行数
+        """
+        deleted_rows = 0
+        for offset in range(0, len(ids), self.delete_batch_rows):
+            batch = ids[offset:offset + self.delete_batch_rows]
+            async with self._slot(self.target_limiter):
+                async with self.db_manager.connection(self.target_env) as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            f"DELETE FROM {table_name} WHERE `{key_column}` IN ({', '.join(['%s'] * len(batch))})", batch)
+                        deleted_rows += cursor.rowcount
+                    await conn.commit()
+        return deleted_rows
+
+    async def sync_deletions(self, table_name: str, key_column: str = 'id') -> Dict[str, Any]:
+        """
+        检测并删除目标库中源库已物理删除的行
+        待删除的行数超过max_delete_ratio时抛出ValueError, 不执行删除
+        :param table_name: 表名
+        :param key_column: 主键列名
+        :return: {'source_rows', 'target_rows', 'missing_rows', 'deleted_rows'}
+        """
+        stats = await self.find_deleted_ids(table_name, key_column)
+        deleted_ids = stats.pop('deleted_ids')
+        if deleted_ids and len(deleted_ids) > stats['target_rows'] * self.max_delete_ratio:
+            raise ValueError(f"{table_name} 待删除 {len(deleted_ids)} 行, 超过目标表 {stats['target_rows']} 行的 "
+                             f"{self.max_delete_ratio:.0%}, 不执行删除")
+        stats['deleted_rows'] = await self.delete_ids(table_name, deleted_ids, key_column) if deleted_ids else 0
+        return stats
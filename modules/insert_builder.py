@@ -0,0 +1,64 @@
+from typing import Any, Callable, Iterator, Optional, Sequence, Tuple
+
+# -------------------------------------------------------
+# 多行INSERT语句构建
+# aiomysql的executemany只有在语句匹配RE_INSERT_VALUES时才会改写为一条多行 VALUES (...),(...) 语句,
+# 否则退化为每行一次往返; 这里直接生成多行 INSERT / INSERT ... ON DUPLICATE KEY UPDATE 语句,
+# 并按服务端的max_allowed_packet拆分, 每条语句都不会超过packet上限
+# -------------------------------------------------------
+
+# 为协议头和统计误差预留的字节数
+PACKET_MARGIN = 1024
+
+async def fetch_max_allowed_packet(conn) -> int:
+    """
+    查询服务端的max_allowed_packet
+    :param conn: MySQL连接
+    :return: 字节数
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT @@max_allowed_packet AS max_allowed_packet")
+        row = await cursor.fetchone()
+    value = row['max_allowed_packet'] if isinstance(row, dict) else row[0]
+    return int(value)
+
+class MultiRowInsert:
+    def __init__(self, table_name: str, columns: Sequence[str], update_columns: Optional[Sequence[str]] = None):
+        """
+        初始化多行INSERT语句构建器
+        :param table_name: 表名
+        :param columns: 列名, 顺序与行元组相同
+        :param update_columns: 主键冲突时更新的列, 为None时只插入
+        """
+        self.prefix = f"INSERT INTO {table_name} ({', '.join(f'`{col}`' for col in columns)}) VALUES "
+        self.suffix = ''
+        if update_columns:
+            self.suffix = " ON DUPLICATE KEY UPDATE " + ', '.join(f'`{col}` = VALUES(`{col}`)' for col in update_columns)
+        self.column_count = len(columns)
+
+    def statements(self, escape: Callable[[Any], str], rows: Sequence[Sequence[Any]],
+                   max_packet: int) -> Iterator[Tuple[str, int]]:
+        """
+        生成多行INSERT语句, 每条语句的字节数不超过 max_packet - PACKET_MARGIN
+        :param escape: 把行元组转义为 (v1,v2,...) 的函数, 一般为连接的escape方法(与连接的字符集和SQL模式一致)
+        :param rows: 行元组列表
+        :param max_packet: 服务端的max_allowed_packet
+        :return: (语句, 语句中的行数) 迭代器
+        """
+        limit = max_packet - PACKET_MARGIN
+        fixed_bytes = len(self.prefix.encode('utf-8')) + len(self.suffix.encode('utf-8'))
+        values = []
+        size = fixed_bytes
+        for row in rows:
+            value = escape(tuple(row))
+            value_bytes = len(value.encode('utf-8', errors='surrogateescape')) + 1  # 加上分隔的逗号
+            if fixed_bytes + value_bytes > limit:
+                raise ValueError(f"单行数据 {value_bytes} 字节, 超过max_allowed_packet允许的 {limit - fixed_bytes} 字节")
+            if values and size + value_bytes > limit:
+                yield self.prefix + ','.join(values) + self.suffix, len(values)
+                values = []
+                size = fixed_bytes
+            values.append(value)
+            size += value_bytes
+        if values:
+            yield self.prefix + ','.join(values) + self.suffix, len(values)
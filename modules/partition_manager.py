@@ -0,0 +1,223 @@
+from datetime import datetime, date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# -------------------------------------------------------
+# 按createdAt分区的目标表管理
+# 只支持 PARTITION BY RANGE COLUMNS(`createdAt`) 的分区表(按天或按月均可), 例如:
+#   ALTER TABLE orders PARTITION BY RANGE COLUMNS(`createdAt`) (
+#       PARTITION p202410 VALUES LESS THAN ('2024-11-01'),
+#       PARTITION p202411 VALUES LESS THAN ('2024-12-01'),
+#       PARTITION pmax VALUES LESS THAN (MAXVALUE))
+# 注意: 分区表的主键和唯一索引必须包含createdAt, 例如 PRIMARY KEY (`id`, `createdAt`)
+# 整个分区可以在暂存表中重新加载后通过 EXCHANGE PARTITION 交换, 维护任务只重建有变化的分区
+# -------------------------------------------------------
+
+# 分区的区间: (分区名, 下界(包含), 上界(不包含)), 第一个分区没有下界, MAXVALUE分区没有上界
+PartitionRange = Tuple[str, Optional[datetime], Optional[datetime]]
+
+def parse_partition_bound(description: str) -> Optional[datetime]:
+    """
+    解析RANGE COLUMNS分区的上界
+    :param description: INFORMATION_SCHEMA.PARTITIONS中的PARTITION_DESCRIPTION, 如 '2024-11-01 00:00:00' 或 MAXVALUE
+    :return: 上界时间, MAXVALUE为None
+    """
+    value = description.strip().strip("'")
+    if value.upper() == 'MAXVALUE':
+        return None
+    return datetime.fromisoformat(value) if ' ' in value else datetime.combine(date.fromisoformat(value), datetime.min.time())
+
+def next_month(day: datetime) -> datetime:
+    """
+    获取下个月1日
+    :param day: 任意时间
+    :return: 下个月1日00:00:00
+    """
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+class PartitionManager:
+    def __init__(self, db_manager, env: str = 'myDB_Alicloud', maintenance_table: str = 'partition_maintenance'):
+        """
+        初始化分区管理工具
+        :param db_manager: DBManager实例
+        :param env: 分区表所在的MySQL环境
+        :param maintenance_table: 记录分区变化和重建时间的表名
+        """
+        self.db_manager = db_manager
+        self.env = env
+        self.maintenance_table = maintenance_table
+        self.table_ready = False
+
+    async def _execute(self, *statements: str):
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                for statement in statements:
+                    await cursor.execute(statement)
+
+    async def get_range_partitions(self, table_name: str) -> List[PartitionRange]:
+        """
+        读取表的RANGE COLUMNS分区
+        :param table_name: 表名
+        :return: 按顺序排列的分区区间列表, 不是RANGE COLUMNS分区表时返回空列表
+        """
+        async with self.db_manager.connection(self.env) as conn:
+            result = await self.db_manager.fetch_all(conn, """
+                SELECT `PARTITION_NAME`, `PARTITION_METHOD`, `PARTITION_DESCRIPTION`
+                FROM information_schema.PARTITIONS
+                WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = %s AND `PARTITION_NAME` IS NOT NULL
+                ORDER BY `PARTITION_ORDINAL_POSITION`
+            """, (table_name,), row_format='tuple')
+        if not result.rows or any(method != 'RANGE COLUMNS' for _, method, _ in result.rows):
+            return []
+        partitions = []
+        lower = None
+        for name, _, description in result.rows:
+            upper = parse_partition_bound(description)
+            partitions.append((name, lower, upper))
+            lower = upper
+        return partitions
+
+    @staticmethod
+    def group_dates(partitions: List[PartitionRange], dates: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        把日期按所在分区分组
+        :param partitions: get_range_partitions返回的分区区间
+        :param dates: 日期字符串列表, 格式YYYY-MM-DD
+        :return: {分区名: [日期]}
+        """
+        groups = {}
+        for day in sorted(dates):
+            start = datetime.strptime(str(day), '%Y-%m-%d')
+            for name, lower, upper in partitions:
+                if (lower is None or lower <= start) and (upper is None or start < upper):
+                    groups.setdefault(name, []).append(day)
+                    break
+        return groups
+
+    async def add_month_partitions(self, table_name: str, through: datetime) -> List[str]:
+        """
+        把MAXVALUE分区拆分出按月的分区, 直到包含through所在的月份
+        只在最后一个有上界的分区按月对齐时执行, MAXVALUE分区中已有的数据会随拆分移动到对应的分区
+        :param table_name: 表名
+        :param through: 需要有独立分区的最晚时间
+        :return: 新增的分区名列表
+        """
+        partitions = await self.get_range_partitions(table_name)
+        if len(partitions) < 2 or partitions[-1][2] is not None:
+            return []
+        last_bound = partitions[-2][2]
+        if last_bound.day != 1 or last_bound.time() != datetime.min.time():
+            return []
+        definitions = []
+        added = []
+        bound = last_bound
+        while bound <= through:
+            upper = next_month(bound)
+            name = f"p{bound:%Y%m}"
+            definitions.append(f"PARTITION {name} VALUES LESS THAN ('{upper:%Y-%m-%d}')")
+            added.append(name)
+            bound = upper
+        if not definitions:
+            return []
+        maxvalue_name = partitions[-1][0]
+        definitions.append(f"PARTITION {maxvalue_name} VALUES LESS THAN (MAXVALUE)")
+        await self._execute(f"ALTER TABLE {table_name} REORGANIZE PARTITION {maxvalue_name} INTO ({', '.join(definitions)})")
+        return added
+
+    async def create_exchange_table(self, table_name: str, partition_name: str) -> str:
+        """
+        创建与分区表结构相同的非分区暂存表, 用于加载一个分区的数据
+        :param table_name: 分区表名
+        :param partition_name: 分区名
+        :return: 暂存表名
+        """
+        exchange_table = f"{table_name}__{partition_name}"
+        await self._execute(
+            f"DROP TABLE IF EXISTS {exchange_table}",
+            f"CREATE TABLE {exchange_table} LIKE {table_name}",
+            f"ALTER TABLE {exchange_table} REMOVE PARTITIONING")
+        return exchange_table
+
+    async def exchange_partition(self, table_name: str, partition_name: str, exchange_table: str):
+        """
+        把暂存表与分区交换, 交换后暂存表中是分区原来的数据
+        MySQL会校验暂存表中的行都在分区的区间内
+        :param table_name: 分区表名
+        :param partition_name: 分区名
+        :param exchange_table: 暂存表名
+        """
+        await self._execute(f"ALTER TABLE {table_name} EXCHANGE PARTITION {partition_name} WITH TABLE {exchange_table}")
+
+    async def drop_table(self, table_name: str):
+        """
+        删除暂存表
+        :param table_name: 暂存表名
+        """
+        await self._execute(f"DROP TABLE IF EXISTS {table_name}")
+
+    async def ensure_table(self):
+        """不存在时创建分区维护记录表"""
+        if self.table_ready:
+            return
+        await self._execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.maintenance_table} (
+                `table_name` VARCHAR(128) NOT NULL COMMENT '分区表',
+                `partition_name` VARCHAR(64) NOT NULL COMMENT '分区名',
+                `touched_at` DATETIME NULL COMMENT '最近一次删除或写入的时间',
+                `rebuilt_at` DATETIME NULL COMMENT '最近一次重建的时间',
+                PRIMARY KEY (`table_name`, `partition_name`)
+            ) COMMENT='分区维护记录'
+        """)
+        self.table_ready = True
+
+    async def mark_touched(self, table_name: str, partition_names: Iterable[str]):
+        """
+        记录分区有删除或写入, 维护任务会重建这些分区
+        :param table_name: 分区表名
+        :param partition_names: 分区名列表
+        """
+        partition_names = list(partition_names)
+        if not partition_names:
+            return
+        await self.ensure_table()
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(f"""
+                    INSERT INTO {self.maintenance_table} (`table_name`, `partition_name`, `touched_at`)
+                    VALUES (%s, %s, NOW())
+                    ON DUPLICATE KEY UPDATE `touched_at` = VALUES(`touched_at`)
+                """, [(table_name, name) for name in partition_names])
+
+    async def load_pending(self, table_name: str) -> List[str]:
+        """
+        读取上次重建后有变化的分区
+        :param table_name: 分区表名
+        :return: 分区名列表
+        """
+        await self.ensure_table()
+        async with self.db_manager.connection(self.env) as conn:
+            result = await self.db_manager.fetch_all(conn, f"""
+                SELECT `partition_name` FROM {self.maintenance_table}
+                WHERE `table_name` = %s AND (`rebuilt_at` IS NULL OR `touched_at` > `rebuilt_at`)
+            """, (table_name,), row_format='tuple')
+        return [row[0] for row in result.rows]
+
+    async def rebuild_partitions(self, table_name: str, partition_names: List[str]):
+        """
+        重建并分析指定分区, 并记录重建时间
+        InnoDB不支持单独OPTIMIZE分区(会重建整张表), 所以使用 REBUILD PARTITION + ANALYZE PARTITION
+        :param table_name: 分区表名
+        :param partition_names: 分区名列表
+        """
+        if not partition_names:
+            return
+        partition_list = ', '.join(partition_names)
+        await self._execute(
+            f"ALTER TABLE {table_name} REBUILD PARTITION {partition_list}",
+            f"ALTER TABLE {table_name} ANALYZE PARTITION {partition_list}")
+        await self.ensure_table()
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(f"""
+                    UPDATE {self.maintenance_table} SET `rebuilt_at` = NOW()
+                    WHERE `table_name` = %s AND `partition_name` = %s
+                """, [(table_name, name) for name in partition_names])
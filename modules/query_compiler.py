@@ -0,0 +1,132 @@
+import re
+from typing import Dict, Any, List, Tuple
+
+# -------------------------------------------------------
+# SQL模板编译器
+# 把使用MySQL用户变量(@name)和{占位符}的查询模板编译为参数化查询:
+#   bind_sql: 使用%s占位符, 由aiomysql在客户端绑定参数, 一次往返
+#   prepare_sql: 使用?占位符, 用于服务端 PREPARE ... / EXECUTE ... USING
+# 编译结果按模板缓存, 同一张表的所有分块共用同一个编译结果
+# -------------------------------------------------------
+
+# 匹配用户变量@name, 不匹配系统变量@@name
+VARIABLE_PATTERN = re.compile(r'(?<![@\w])@(\w+)')
+
+def split_sql(sql: str) -> List[Tuple[str, str]]:
+    """
+    把SQL拆分为代码/字符串字面量/注释片段, 只有代码片段中的@name会被当作参数
+    :param sql: SQL文本
+    :return: [(片段类型, 片段文本), ...], 片段类型为code/literal/comment
+    """
+    parts = []
+    length = len(sql)
+    start = 0
+    i = 0
+    while i < length:
+        ch = sql[i]
+        if ch in ("'", '"', '`'):
+            # 字符串或反引号标识符, 支持反斜杠转义和两个引号的转义
+            j = i + 1
+            while j < length:
+                if sql[j] == '\\' and ch != '`':
+                    j += 2
+                    continue
+                if sql[j] == ch:
+                    if j + 1 < length and sql[j + 1] == ch:
+                        j += 2
+                        continue
+                    break
+                j += 1
+            end = min(j + 1, length)
+            kind = 'literal'
+        elif ch == '#' or (sql.startswith('--', i) and (i + 2 == length or sql[i + 2].isspace())):
+            # 单行注释
+            end = sql.find('\n', i)
+            end = length if end == -1 else end
+            kind = 'comment'
+        elif sql.startswith('/*', i):
+            # 多行注释
+            end = sql.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            kind = 'comment'
+        else:
+            i += 1
+            continue
+        if start < i:
+            parts.append(('code', sql[start:i]))
+        parts.append((kind, sql[i:end]))
+        start = i = end
+    if start < length:
+        parts.append(('code', sql[start:]))
+    return parts
+
+class CompiledQuery:
+    def __init__(self, bind_sql: str, prepare_sql: str, param_names: List[str]):
+        """
+        编译后的参数化查询
+        :param bind_sql: 客户端绑定参数的SQL(%s占位符, 其余%已转义为%%)
+        :param prepare_sql: 服务端预处理的SQL(?占位符)
+        :param param_names: 按占位符顺序排列的参数名, 同一参数出现多次时重复出现
+        """
+        self.bind_sql = bind_sql
+        self.prepare_sql = prepare_sql
+        self.param_names = param_names
+
+    def bind(self, values: Dict[str, Any]) -> tuple:
+        """
+        按占位符顺序生成参数元组
+        :param values: {参数名: 值}
+        :return: 参数元组, 与bind_sql一起传给cursor.execute
+        """
+        missing = [name for name in self.param_names if name not in values]
+        if missing:
+            raise ValueError(f"缺少查询参数: {', '.join(sorted(set(missing)))}")
+        return tuple(values[name] for name in self.param_names)
+
+    def execute_sql(self, statement_name: str) -> str:
+        """
+        生成执行服务端预处理语句的SQL, 参数通过同名用户变量传入
+        :param statement_name: PREPARE时使用的语句名
+        :return: EXECUTE ... USING @参数 ... 语句
+        """
+        if not self.param_names:
+            return f"EXECUTE {statement_name}"
+        return f"EXECUTE {statement_name} USING {', '.join('@' + name for name in self.param_names)}"
+
+class QueryCompiler:
+    def __init__(self):
+        """初始化编译器, 编译结果按(模板, 占位符)缓存"""
+        self.cache = {}
+
+    def compile(self, template: str, **fragments: str) -> CompiledQuery:
+        """
+        编译查询模板
+        :param template: 查询模板, 可包含@name用户变量和{name}占位符
+        :param fragments: {占位符名: SQL片段}, 片段中同样可以使用@name参数
+        :return: 编译后的查询
+        """
+        key = (template, tuple(sorted(fragments.items())))
+        compiled = self.cache.get(key)
+        if compiled is not None:
+            return compiled
+
+        sql = template
+        for name, fragment in fragments.items():
+            sql = sql.replace('{' + name + '}', fragment)
+        sql = sql.strip().rstrip(';').rstrip()
+
+        bind_parts = []
+        prepare_parts = []
+        param_names = []
+        for kind, text in split_sql(sql):
+            if kind == 'code':
+                param_names.extend(VARIABLE_PATTERN.findall(text))
+                bind_parts.append(VARIABLE_PATTERN.sub('%s', text.replace('%', '%%')))
+                prepare_parts.append(VARIABLE_PATTERN.sub('?', text))
+            else:
+                bind_parts.append(text.replace('%', '%%'))
+                prepare_parts.append(text)
+
+        compiled = CompiledQuery(''.join(bind_parts), ''.join(prepare_parts), param_names)
+        self.cache[key] = compiled
+        return compiled
@@ -0,0 +1,92 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Iterable, List, Tuple
+
+# -------------------------------------------------------
+# 分段删除工具
+# 连续的日期合并为一个区间, 读取一次区间内的最小和最大主键后, 按固定宽度的主键窗口逐段删除并立即提交,
+# 每个事务只锁定一小段主键, 避免一次删除整天数据时长时间持有锁并产生大量undo;
+# 每段只做主键区间扫描, 不再为每段重新按日期条件读取和排序剩余的主键
+# -------------------------------------------------------
+
+def merge_date_ranges(dates: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    把日期列表中连续的日期合并为区间
+    :param dates: 日期字符串列表, 格式YYYY-MM-DD
+    :return: [(区间开始 'YYYY-MM-DD 00:00:00', 区间结束 'YYYY-MM-DD 23:59:59')]
+    """
+    days = sorted({datetime.strptime(str(date), '%Y-%m-%d').date() for date in dates})
+    ranges = []
+    for day in days:
+        if ranges and day - ranges[-1][1] == timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [(f"{start} 00:00:00", f"{end} 23:59:59") for start, end in ranges]
+
+class RangeDeleter:
+    def __init__(self, db_manager, env: str = 'myDB_Alicloud', chunk_rows: int = 5000, limiter=None):
+        """
+        初始化分段删除工具
+        :param db_manager: DBManager实例
+        :param env: 执行删除的MySQL环境
+        :param chunk_rows: 每个事务删除的主键窗口宽度(窗口内最多chunk_rows行)
+        :param limiter: 可选的AdaptiveLimiter, 每个分段占用一个并发名额, 与写入共享并发上限
+        """
+        self.db_manager = db_manager
+        self.env = env
+        self.chunk_rows = chunk_rows
+        self.limiter = limiter
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self.limiter is None:
+            yield
+        else:
+            async with self.limiter.slot():
+                yield
+
+    async def delete_range(self, table_name: str, column: str, start, end, key_column: str = 'id') -> int:
+        """
+        删除 column BETWEEN start AND end 的行: 先读取一次区间内的最小和最大主键,
+        再按固定宽度(chunk_rows)的主键窗口逐段删除窗口内满足条件的行并提交, 每段都是主键区间扫描;
+        某个窗口没有删除任何行时(主键分布稀疏), 直接跳到下一个满足条件的主键, 避免大量空窗口的往返
+        删除失败时抛出异常, 已提交的分段不会回滚, 调用方重新执行即可
+        :param table_name: 表名
+        :param column: 区间条件的列名
+        :param start: 区间开始(包含)
+        :param end: 区间结束(包含)
+        :param key_column: 主键列名(整数)
+        :return: 删除的行数
+        """
+        async with self._slot():
+            async with self.db_manager.connection(self.env) as conn:
+                bounds = (await self.db_manager.fetch_all(
+                    conn, f"SELECT MIN(`{key_column}`), MAX(`{key_column}`) FROM {table_name} WHERE `{column}` BETWEEN %s AND %s",
+                    (start, end), row_format='tuple')).rows
+        min_key, max_key = bounds[0] if bounds else (None, None)
+        if min_key is None:
+            return 0
+
+        deleted_rows = 0
+        window_start = int(min_key)
+        while window_start is not None and window_start <= max_key:
+            window_end = window_start + self.chunk_rows - 1
+            async with self._slot():
+                async with self.db_manager.connection(self.env) as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            f"DELETE FROM {table_name} WHERE `{key_column}` BETWEEN %s AND %s AND `{column}` BETWEEN %s AND %s",
+                            (window_start, window_end, start, end))
+                        window_deleted = cursor.rowcount
+                    await conn.commit()
+                    if window_deleted == 0:
+                        # 空窗口: 跳到下一个满足条件的主键
+                        next_keys = (await self.db_manager.fetch_all(
+                            conn, f"SELECT MIN(`{key_column}`) FROM {table_name} WHERE `{column}` BETWEEN %s AND %s AND `{key_column}` > %s",
+                            (start, end, window_end), row_format='tuple')).rows
+                        window_start = next_keys[0][0] if next_keys else None
+                        continue
+            deleted_rows += window_deleted
+            window_start = window_end + 1
+        return deleted_rows
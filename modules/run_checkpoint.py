@@ -0,0 +1,184 @@
+import copy
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# -------------------------------------------------------
+# 同步运行断点
+# 把本次运行的进度(表、需要同步的日期、阶段、已完成的日期)保存到本地状态文件,
+# 运行中断后使用 --resume 重新运行时跳过已完成的表和日期, 只重新同步未完成的部分
+# 每次更新都先写入临时文件再替换, 进程在写入过程中被终止也不会留下损坏的状态文件
+# 多进程运行时只有主进程写状态文件, 子进程使用RelayCheckpoint把进度发送给主进程合并
+# -------------------------------------------------------
+
+class RunCheckpoint:
+    def __init__(self, path: str):
+        """
+        初始化运行断点
+        :param path: 状态文件路径
+        """
+        self.path = path
+        self.state: Dict[str, Any] = {'started_at': None, 'tables': {}}
+
+    def load(self) -> bool:
+        """
+        读取上次运行的状态文件
+        :return: 状态文件存在且可读取时返回True
+        """
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.state.setdefault('tables', {})
+        return True
+
+    def reset(self, session_vars: Optional[Dict[str, Any]] = None):
+        """
+        开始新的运行, 清空之前的进度
+        :param session_vars: 本次运行的同步日期区间参数, 如 {'start_date': 日期, 'end_date': 日期}, 从断点继续时恢复
+        """
+        self.state = {
+            'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'session_vars': {name: value.isoformat() if isinstance(value, (date, datetime)) else value
+                             for name, value in (session_vars or {}).items()},
+            'tables': {}}
+        self.save()
+
+    def session_vars(self) -> Dict[str, Any]:
+        """
+        获取开始运行时记录的同步日期区间参数, 日期字符串还原为date/datetime
+        :return: 参数字典, 没有记录时为空字典
+        """
+        values = {}
+        for name, value in self.state.get('session_vars', {}).items():
+            if isinstance(value, str) and len(value) == 10:
+                value = date.fromisoformat(value)
+            elif isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            values[name] = value
+        return values
+
+    def save(self):
+        """把当前进度写入状态文件"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    @property
+    def started_at(self) -> Optional[str]:
+        return self.state.get('started_at')
+
+    def table_state(self, table_name: str) -> Optional[Dict[str, Any]]:
+        """
+        获取表的进度
+        :param table_name: 表名
+        :return: {'stage': 阶段, 'dates': 需要同步的日期, 'done_dates': 已完成的日期}, 没有进度时为None
+        """
+        return self.state['tables'].get(table_name)
+
+    def is_table_done(self, table_name: str) -> bool:
+        state = self.table_state(table_name)
+        return bool(state) and state.get('stage') == 'done'
+
+    def start_table(self, table_name: str, dates: Iterable[str]):
+        """
+        记录表本次需要同步的日期
+        :param table_name: 表名
+        :param dates: 需要同步的日期列表
+        """
+        self.state['tables'][table_name] = {'stage': 'planned', 'dates': list(dates), 'done_dates': []}
+        self.save()
+
+    def mark_stage(self, table_name: str, stage: str):
+        """
+        记录表当前所处的阶段
+        :param table_name: 表名
+        :param stage: 阶段, 如planned(已确定日期)、deleted(旧数据已删除)、done(已完成)
+        """
+        self.state['tables'].setdefault(table_name, {'dates': [], 'done_dates': []})['stage'] = stage
+        self.save()
+
+    def mark_dates_done(self, table_name: str, dates: Iterable[str]):
+        """
+        记录表中已完整写入的日期
+        :param table_name: 表名
+        :param dates: 日期列表
+        """
+        state = self.state['tables'].setdefault(table_name, {'stage': 'planned', 'dates': [], 'done_dates': []})
+        done_dates = set(state['done_dates'])
+        done_dates.update(dates)
+        state['done_dates'] = sorted(done_dates)
+        self.save()
+
+    def pending_dates(self, table_name: str) -> List[str]:
+        """
+        获取表中尚未完成的日期
+        :param table_name: 表名
+        :return: 日期列表
+        """
+        state = self.table_state(table_name) or {}
+        done_dates = set(state.get('done_dates', []))
+        # 表拆分为日期分片时, 分片中已完成的日期同样计入
+        for shard_key in state.get('shards', []):
+            done_dates.update((self.table_state(shard_key) or {}).get('done_dates', []))
+        return [date for date in state.get('dates', []) if date not in done_dates]
+
+    def mark_table_done(self, table_name: str):
+        """
+        记录表已同步完成
+        :param table_name: 表名
+        """
+        self.mark_stage(table_name, 'done')
+
+    def shard_table(self, table_name: str, date_groups: List[List[str]]) -> List[str]:
+        """
+        把表需要同步的日期拆分为多个分片, 每个分片以 表名#序号 为名称单独记录进度
+        :param table_name: 表名
+        :param date_groups: 每个分片的日期列表
+        :return: 分片名称列表
+        """
+        shard_keys = [f"{table_name}#{index + 1}" for index in range(len(date_groups))]
+        self.state['tables'][table_name] = {
+            'stage': 'sharded', 'dates': sorted(date for dates in date_groups for date in dates),
+            'done_dates': [], 'shards': shard_keys}
+        for shard_key, dates in zip(shard_keys, date_groups):
+            self.state['tables'][shard_key] = {'stage': 'planned', 'dates': list(dates), 'done_dates': []}
+        self.save()
+        return shard_keys
+
+    def table_shards(self, table_name: str) -> List[str]:
+        """
+        获取表的分片名称
+        :param table_name: 表名
+        :return: 分片名称列表, 没有拆分时为空列表
+        """
+        return list((self.table_state(table_name) or {}).get('shards', []))
+
+    def merge_tables(self, tables: Dict[str, Any]):
+        """
+        合并其他进程发送的进度并写入状态文件
+        :param tables: {名称: 进度}
+        """
+        self.state['tables'].update(tables)
+        self.save()
+
+class RelayCheckpoint(RunCheckpoint):
+    def __init__(self, tables: Dict[str, Any], send: Callable[[Dict[str, Any]], None]):
+        """
+        初始化子进程中的运行断点: 不读写状态文件, 每次更新时把进度交给send, 由主进程合并后保存
+        :param tables: 主进程中分配给该子进程的表和分片的进度 {名称: 进度}
+        :param send: 接收 {名称: 进度} 的回调
+        """
+        super().__init__('')
+        self.state['tables'] = copy.deepcopy(tables)
+        self.send = send
+
+    def save(self):
+        """把当前进度发送给主进程"""
+        self.send(copy.deepcopy(self.state['tables']))
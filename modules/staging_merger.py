@@ -0,0 +1,120 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Iterable, List, Tuple
+
+from range_deleter import merge_date_ranges
+
+# -------------------------------------------------------
+# 暂存表合并工具
+# 重新同步的数据先写入与原表结构相同的暂存表, 全部写入后再按日期区间在一个事务中
+# 删除原表的旧数据并 INSERT ... SELECT 暂存表的数据; 事务只包含本地的删除和复制, 持有锁的时间很短,
+# 读取方在事务提交前看到的是旧数据, 不会出现整天数据缺失的情况; 没有完整写入暂存表的日期保留原数据
+# -------------------------------------------------------
+
+def split_date_groups(dates: Iterable[str], max_days: int) -> List[List[str]]:
+    """
+    把日期列表拆分为连续日期组成的分组, 每组最多max_days个日期
+    :param dates: 日期字符串列表, 格式YYYY-MM-DD
+    :param max_days: 每组最多的日期数
+    :return: 日期分组列表
+    """
+    groups = []
+    previous = None
+    for date in sorted(set(dates)):
+        day = datetime.strptime(date, '%Y-%m-%d').date()
+        if groups and previous is not None and day - previous == timedelta(days=1) and len(groups[-1]) < max_days:
+            groups[-1].append(date)
+        else:
+            groups.append([date])
+        previous = day
+    return groups
+
+class StagingMerger:
+    def __init__(self, db_manager, env: str = 'myDB_Alicloud', limiter=None, max_days: int = 1):
+        """
+        初始化暂存表合并工具
+        :param db_manager: DBManager实例
+        :param env: 原表和暂存表所在的MySQL环境
+        :param limiter: 可选的AdaptiveLimiter, 每个合并事务占用一个并发名额, 与写入共享并发上限
+        :param max_days: 每个合并事务最多包含的连续日期数
+        """
+        self.db_manager = db_manager
+        self.env = env
+        self.limiter = limiter
+        self.max_days = max(1, max_days)
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self.limiter is None:
+            yield
+        else:
+            async with self.limiter.slot():
+                yield
+
+    async def create(self, table_name: str, staging_table: str):
+        """
+        按原表结构创建空的暂存表, 已存在时(上次运行中断留下的)先删除
+        :param table_name: 原表名
+        :param staging_table: 暂存表名
+        """
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+                await cursor.execute(f"CREATE TABLE {staging_table} LIKE {table_name}")
+
+    async def clear(self, staging_table: str, dates: Iterable[str], column: str = 'createdAt'):
+        """
+        删除暂存表中指定日期的数据, 用于重新写入中途失败的日期
+        :param staging_table: 暂存表名
+        :param dates: 日期列表
+        :param column: 日期列名
+        """
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                for start, end in merge_date_ranges(dates):
+                    await cursor.execute(f"DELETE FROM {staging_table} WHERE `{column}` BETWEEN %s AND %s", (start, end))
+            await conn.commit()
+
+    def date_groups(self, dates: Iterable[str]) -> List[List[str]]:
+        """
+        把需要合并的日期拆分为每个事务处理的分组
+        :param dates: 日期列表
+        :return: 日期分组列表, 每组为最多max_days个连续日期
+        """
+        return split_date_groups(dates, self.max_days)
+
+    async def merge(self, table_name: str, staging_table: str, dates: List[str], column: str = 'createdAt') -> Tuple[int, int]:
+        """
+        在一个事务中删除原表中这些日期的数据, 并从暂存表复制这些日期的数据, 失败时回滚, 原表保持不变
+        :param table_name: 原表名
+        :param staging_table: 暂存表名
+        :param dates: 连续的日期列表(date_groups中的一组)
+        :param column: 日期列名
+        :return: (删除的行数, 插入的行数)
+        """
+        start, end = merge_date_ranges(dates)[0]
+        async with self._slot():
+            async with self.db_manager.connection(self.env) as conn:
+                try:
+                    await conn.begin()
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(f"DELETE FROM {table_name} WHERE `{column}` BETWEEN %s AND %s", (start, end))
+                        deleted_rows = cursor.rowcount
+                        await cursor.execute(
+                            f"INSERT INTO {table_name} SELECT * FROM {staging_table} WHERE `{column}` BETWEEN %s AND %s",
+                            (start, end))
+                        inserted_rows = cursor.rowcount
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+        return deleted_rows, inserted_rows
+
+    async def drop(self, staging_table: str):
+        """
+        删除暂存表
+        :param staging_table: 暂存表名
+        """
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
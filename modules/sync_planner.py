@@ -0,0 +1,78 @@
+import heapq
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+# -------------------------------------------------------
+# 同步执行计划
+# 按历史耗时和预计行数估算每张表的耗时, 按耗时从长到短(LPT)分配到有限的并发名额上,
+# 避免耗时最长的表最后才开始, 导致运行末尾只剩一张表在执行
+# -------------------------------------------------------
+
+# 计划中的一项: (表名, 并发名额序号, 预计开始秒数, 预计结束秒数)
+ScheduleItem = Tuple[str, int, float, float]
+
+def lpt_schedule(costs: Dict[str, float], slots: int) -> List[ScheduleItem]:
+    """
+    最长任务优先调度: 按预计耗时从长到短, 每张表分配给最早空闲的并发名额
+    :param costs: {表名: 预计耗时(秒)}
+    :param slots: 并发名额数
+    :return: 按开始时间排序的计划列表
+    """
+    free_at = [(0.0, slot) for slot in range(max(1, slots))]
+    heapq.heapify(free_at)
+    schedule = []
+    for table_name, cost in sorted(costs.items(), key=lambda item: (-item[1], item[0])):
+        start, slot = heapq.heappop(free_at)
+        schedule.append((table_name, slot, start, start + cost))
+        heapq.heappush(free_at, (start + cost, slot))
+    return sorted(schedule, key=lambda item: (item[2], item[1]))
+
+class SyncHistory:
+    def __init__(self, path: str):
+        """
+        初始化历史耗时记录
+        :param path: 记录文件路径
+        """
+        self.path = path
+        self.tables: Dict[str, Dict[str, float]] = {}
+
+    def load(self):
+        """读取历史耗时记录, 文件不存在或不可读取时为空"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.tables = json.load(f)
+        except (OSError, ValueError):
+            self.tables = {}
+
+    def record(self, table_name: str, seconds: float, estimated_rows: int):
+        """
+        记录表本次的实际耗时和计划阶段的预计行数, 只更新内存, 运行结束时调用save写入文件
+        :param table_name: 表名
+        :param seconds: 实际耗时(秒)
+        :param estimated_rows: 计划阶段的预计行数
+        """
+        self.tables[table_name] = {'seconds': round(seconds, 2), 'estimated_rows': estimated_rows}
+
+    def save(self):
+        """把历史耗时记录写入文件"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.tables, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def estimate(self, table_name: str, estimated_rows: Optional[int], default_rows_per_second: float) -> float:
+        """
+        估算表的耗时: 有历史记录时按上次的(耗时/预计行数)比例换算, 否则按默认速度估算
+        :param table_name: 表名
+        :param estimated_rows: 本次的预计行数, 无法估算时为None
+        :param default_rows_per_second: 没有历史记录时使用的默认速度(行/秒)
+        :return: 预计耗时(秒)
+        """
+        history = self.tables.get(table_name)
+        if history:
+            if estimated_rows is not None and history.get('estimated_rows'):
+                return history['seconds'] * estimated_rows / history['estimated_rows']
+            return history['seconds']
+        return (estimated_rows or 0) / default_rows_per_second
@@ -0,0 +1,75 @@
+from datetime import datetime, date
+from typing import Dict, Any, Optional
+
+# -------------------------------------------------------
+# 同步水位线存储
+# 在个人数据库的水位线表中按(任务, 表)记录上次同步成功的updatedAt上界和最大id,
+# 同步任务从上次成功的位置开始构建增量区间, 漏跑的日期会在下次运行时一并补上
+# -------------------------------------------------------
+
+class WatermarkStore:
+    def __init__(self, db_manager, env: str = 'myDB_Alicloud', table_name: str = 'sync_watermarks'):
+        """
+        初始化水位线存储
+        :param db_manager: DBManager实例
+        :param env: 水位线表所在的MySQL环境
+        :param table_name: 水位线表名
+        """
+        self.db_manager = db_manager
+        self.env = env
+        self.table_name = table_name
+        self.table_ready = False
+
+    async def ensure_table(self):
+        """不存在时创建水位线表"""
+        if self.table_ready:
+            return
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    `job` VARCHAR(64) NOT NULL COMMENT '同步任务',
+                    `table_name` VARCHAR(128) NOT NULL COMMENT '同步的表',
+                    `last_updated_at` DATETIME NULL COMMENT '上次同步成功的updatedAt上界',
+                    `max_id` BIGINT NULL COMMENT '上次同步成功时的最大id',
+                    `last_success_at` DATETIME NOT NULL COMMENT '上次同步成功的时间',
+                    PRIMARY KEY (`job`, `table_name`)
+                ) COMMENT='同步水位线'
+                """)
+        self.table_ready = True
+
+    async def load_all(self, job: str) -> Dict[str, Dict[str, Any]]:
+        """
+        读取任务下所有表的水位线
+        :param job: 同步任务名
+        :return: {表名: {'last_updated_at': datetime, 'max_id': int}}
+        """
+        await self.ensure_table()
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"SELECT `table_name`, `last_updated_at`, `max_id` FROM {self.table_name} WHERE `job` = %s", (job,))
+                rows = await cursor.fetchall()
+        return {row['table_name']: {'last_updated_at': row['last_updated_at'], 'max_id': row['max_id']} for row in rows}
+
+    async def save(self, job: str, table_name: str, last_updated_at, max_id: Optional[int] = None):
+        """
+        记录表同步成功后的水位线, max_id为None时保留原来的值
+        :param job: 同步任务名
+        :param table_name: 表名
+        :param last_updated_at: 本次同步区间的updatedAt上界
+        :param max_id: 本次同步后的最大id
+        """
+        if isinstance(last_updated_at, date) and not isinstance(last_updated_at, datetime):
+            last_updated_at = datetime.combine(last_updated_at, datetime.min.time())
+        await self.ensure_table()
+        async with self.db_manager.connection(self.env) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"""
+                INSERT INTO {self.table_name} (`job`, `table_name`, `last_updated_at`, `max_id`, `last_success_at`)
+                VALUES (%s, %s, %s, %s, NOW())
+                ON DUPLICATE KEY UPDATE
+                    `last_updated_at` = VALUES(`last_updated_at`),
+                    `max_id` = COALESCE(VALUES(`max_id`), `max_id`),
+                    `last_success_at` = VALUES(`last_success_at`)
+                """, (job, table_name, last_updated_at, max_id))